@@ -1,12 +1,20 @@
-import functools
+import argparse
+import datetime
 import logging
 import multiprocessing
-from typing import List
+import pathlib
+import time
+from typing import Dict, List, Optional, Set, Tuple
 
-import tqdm
+import lxml
+import lxml.etree
 
+import batch_executor
 import core
+import downloader
 import files_management as fm
+import page_bundle
+import pipeline
 import prepostprocessing as ppp
 
 COMP_DIST_MAX_TAG_PER_GNODE = 15
@@ -15,8 +23,29 @@ COMP_DISTANCES_MIN_DEPTH = 0
 MINIMUM_DEPTH = 3
 MAX_TAGS_PER_GNODE = 10
 
+DISTANCE_THRESHOLDS = [th / 100 for th in range(5, 50 + 1)]
+
 N_PROCESSES = 3
 
+# concurrent requests, the downloads are mostly waiting for the network
+DOWNLOAD_MAX_CONNECTIONS = 32
+DOWNLOAD_MAX_CONNECTIONS_PER_HOST = 4
+
+# number of pages' metadata changes written per transaction
+METAS_FLUSH_EVERY = 100
+
+# limits of the tasks of a page (None for no limit), a page that exceeds them is recorded in the manifest and
+# its worker is replaced (see `batch_executor`)
+MAX_PAGE_TIME_S = None
+MAX_PAGE_RSS_MB = None
+# the pages that exceeded their limits are retried once with limits multiplied by it (None for no retry)
+RETRY_BUDGET_FACTOR = None
+
+# the tasks of the last run (in the outputs directory), see `run_tasks`
+MANIFEST_NAME = "preprocess_all-manifest.jsonl"
+# status of the manifest's first record
+RUN_STARTED = "run-started"
+
 
 logging.basicConfig(
     level=logging.INFO, format="[%(filename)s:%(lineno)s - %(funcName)20s()] %(message)s"
@@ -25,93 +54,357 @@ logging.basicConfig(
 logging.info("n available processes: %d", multiprocessing.cpu_count())
 
 
-class log_and_ignore_fails(object):
-    def __init__(self, target):
-        self.target = target
-        try:
-            functools.update_wrapper(self, target)
-        except Exception as ex:
-            import traceback
+# the functions running the stages, they're called with the page's metadata and the stage's arguments
+STAGES_FUNCTIONS = {
+    pipeline.CLEANUP: ppp.cleanup_html,
+    pipeline.DISTANCES: ppp.precompute_distances,
+    pipeline.DATA_REGIONS: ppp.precompute_data_regions,
+    pipeline.DATA_RECORDS: ppp.precompute_data_records,
+}
+
+# a task is a stage to run on a page: (stage, arguments of its function)
+Task = Tuple[str, dict]
+
+
+def download_all_pages(pages_metas, refresh=False) -> Dict[str, str]:
+    """ Returns the outcomes of the downloads by page_id, see `downloader.Downloader.download`. """
+    pages_metas = sorted(pages_metas.values(), key=lambda x: x.page_id)
+    return downloader.Downloader(
+        max_connections=DOWNLOAD_MAX_CONNECTIONS,
+        max_connections_per_host=DOWNLOAD_MAX_CONNECTIONS_PER_HOST,
+    ).download_all(pages_metas, refresh=refresh, metas_flush_every=METAS_FLUSH_EVERY)
+
+
+def make_tasks(
+    distance_thresholds: List[float],
+    exec_cleanup: bool = True,
+    exec_distances: bool = True,
+    exec_drs: bool = True,
+    exec_drecs: bool = True,
+) -> List[Task]:
+    """ The tasks to run on each page, in the order of their dependencies. """
+    tasks = []
+    if exec_cleanup:
+        tasks.append((pipeline.CLEANUP, {}))
+    if exec_distances:
+        tasks.append(
+            (
+                pipeline.DISTANCES,
+                dict(
+                    minimum_depth=COMP_DISTANCES_MIN_DEPTH,
+                    max_tag_per_gnode=COMP_DIST_MAX_TAG_PER_GNODE,
+                ),
+            )
+        )
+    if exec_drs:
+        tasks += [
+            (
+                pipeline.DATA_REGIONS,
+                dict(
+                    threshold=th,
+                    minimum_depth=MINIMUM_DEPTH,
+                    max_tags_per_gnode=MAX_TAGS_PER_GNODE,
+                ),
+            )
+            for th in distance_thresholds
+        ]
+    if exec_drecs:
+        # will only consider cases where all dist th are the same
+        tasks += [
+            (
+                pipeline.DATA_RECORDS,
+                dict(
+                    thresholds=core.MDREditDistanceThresholds.all_equal(th),
+                    max_tags_per_gnode=MAX_TAGS_PER_GNODE,
+                ),
+            )
+            for th in distance_thresholds
+        ]
+    return tasks
+
+
+def is_ready(page_meta: fm.PageMeta, stage: str, distance_thresholds: List[float]) -> bool:
+    """ Whether the inputs of the stage exist (the stages before it are not run on the page). """
+    if stage == pipeline.CLEANUP:
+        return page_meta.has_raw_html
+    if stage == pipeline.DISTANCES:
+        return page_meta.has_preprocessed_html
+    if stage == pipeline.DATA_REGIONS:
+        return page_meta.has_precomputed_distances
+    return page_meta.has_precomputed_distances and all(
+        page_meta.has_precomputed_data_regions(th, MAX_TAGS_PER_GNODE) for th in distance_thresholds
+    )
 
-            print(ex)
-            traceback.print_stack()
 
-    def __call__(self, *args, **kwargs):
+def task_params(task: Task) -> dict:
+    """ The parameters of the task's stage, see `pipeline`. """
+    stage, kwargs = task
+    if stage == pipeline.DATA_REGIONS:
+        return pipeline.data_regions_params(kwargs["threshold"], kwargs["max_tags_per_gnode"])
+    if stage == pipeline.DATA_RECORDS:
+        return pipeline.data_records_params(kwargs["thresholds"], kwargs["max_tags_per_gnode"])
+    return {}
+
+
+def task_key(page_id: str, stage: str, params: dict) -> Tuple[str, str, str]:
+    """ Identifies a task in the manifest. """
+    return page_id, stage, page_bundle.params_key(params)
+
+
+def run_page_tasks(
+    page_tasks: Tuple[fm.PageMeta, List[Task], pathlib.Path]
+) -> Tuple[str, int, Optional[str]]:
+    """
+    Run the tasks of a page one after the other (in a worker process), each one is recorded in the manifest.
+    The page's tree and distances are then loaded once for all its tasks, see `fm.parsed_trees_cache` and
+     `fm.PageMeta.load_precomputed_distances` (they're cached by each process).
+    A failed task is logged and the page's next tasks are skipped, they depend on it.
+
+    Returns:
+        (page_id, number of tasks that succeeded, error of the failed task if any)
+    """
+    page_meta, tasks, manifest_path = page_tasks
+    manifest = batch_executor.Manifest(manifest_path)
+    for n_done, task in enumerate(tasks):
+        stage, kwargs = task
+        params = task_params(task)
+        record = {"page_id": page_meta.page_id, "stage": stage, "params": params}
+        start = time.monotonic()
         try:
-            self.target(*args, **kwargs)
+            STAGES_FUNCTIONS[stage](page_meta, **kwargs)
         except Exception as ex:
-            page_id = args[0].page_id
-            logging.error("FAIL. page_id=%s ex=%s", page_id, ex)
+            logging.error("FAIL. page_id=%s stage=%s ex=%s", page_meta.page_id, stage, ex)
             import traceback
 
             traceback.print_tb(ex.__traceback__)
+            record.update(
+                status=batch_executor.FAILED,
+                duration_s=round(time.monotonic() - start, 3),
+                error=repr(ex),
+                time=datetime.datetime.now().isoformat(),
+            )
+            manifest.append(record)
+            return page_meta.page_id, n_done, repr(ex)
+        record.update(
+            status=batch_executor.DONE,
+            duration_s=round(time.monotonic() - start, 3),
+            output_sha256=pipeline.output_sha256(page_meta, stage, params),
+            time=datetime.datetime.now().isoformat(),
+        )
+        manifest.append(record)
+    return page_meta.page_id, len(tasks), None
 
 
-def download_all_pages(pages_metas):
-    pages_metas = sorted(pages_metas.values(), key=lambda x: x.page_id)
-    with multiprocessing.Pool(N_PROCESSES) as pool:
-        pool.map(log_and_ignore_fails(ppp.download_raw), pages_metas)
-
-
-def cleanup_all_pages(pages_metas):
-    pages_metas = sorted(pages_metas.values(), key=lambda x: x.page_id)
-    with multiprocessing.Pool(N_PROCESSES) as pool:
-        pool.map(log_and_ignore_fails(ppp.cleanup_html), pages_metas)
+def done_tasks(manifest: batch_executor.Manifest) -> Set[Tuple[str, str, str]]:
+    """ The keys (see `task_key`) of the tasks that the manifest records as done. """
+    return {
+        task_key(record["page_id"], record["stage"], record["params"])
+        for record in manifest.read()
+        if record.get("stage") is not None and record["status"] == batch_executor.DONE
+    }
 
 
-def compute_all_distances(pages_metas):
-    pages_metas = sorted(pages_metas.values(), key=lambda x: x.page_id)
-    precompute_distances = functools.partial(
-        ppp.precompute_distances,
-        minimum_depth=COMP_DISTANCES_MIN_DEPTH,
-        max_tag_per_gnode=COMP_DIST_MAX_TAG_PER_GNODE,
-        force_override=False,
+def estimate_cost(page_meta: fm.PageMeta) -> Optional[int]:
+    """ Relative cost of running the tasks on a page (they are the same for all the pages), None if its html
+     can't be parsed (its tasks will fail, it's up to the worker to report it).
+    The tree profile saved by the cleanup is used if there is one, the page is parsed otherwise. """
+    profile = page_meta.load_tree_profile() if page_meta.has_preprocessed_html else None
+    if profile is None:
+        try:
+            if page_meta.has_preprocessed_html:
+                root = page_meta.get_preprocessed_html_tree()
+            else:
+                root = page_meta.get_raw_html_tree(remove_stuff=True)
+        except (lxml.etree.LxmlError, OSError) as ex:
+            logging.warning("Failed to parse the page. page_id=%s ex=%r", page_meta.page_id, ex)
+            return None
+        if root is None:
+            # e.g. only blank text
+            logging.warning("The page has no html tree. page_id=%s", page_meta.page_id)
+            return None
+        profile = core.tree_profile(root)
+    stats = core.profile_stats(profile, COMP_DISTANCES_MIN_DEPTH, COMP_DIST_MAX_TAG_PER_GNODE)
+    return stats.n_nodes + stats.n_gnode_pairs
+
+
+def schedule(pages: List[fm.PageMeta]) -> Tuple[List[fm.PageMeta], Dict[str, int]]:
+    """
+    Longest processing time first: the most expensive pages are started first, so that a heavy page doesn't end
+     up running alone at the end of the batch while the other processes are idle.
+
+    The pages whose cost can't be estimated are given the maximum cost of the others, so they are started (and
+     fail) early.
+
+    Returns:
+        the pages in the order they should be started, the estimated costs by page_id (see `estimate_cost`)
+    """
+    costs = {page_meta.page_id: estimate_cost(page_meta) for page_meta in pages}
+    max_cost = max([cost for cost in costs.values() if cost is not None], default=1)
+    costs = {page_id: max_cost if cost is None else cost for page_id, cost in costs.items()}
+    scheduled = sorted(pages, key=lambda x: (-costs[x.page_id], x.page_id))
+    logging.info(
+        "Most expensive pages: %s",
+        ", ".join("{}={}".format(x.page_id, costs[x.page_id]) for x in scheduled[:N_PROCESSES]),
     )
-    with multiprocessing.Pool(N_PROCESSES) as pool:
-        pool.map(log_and_ignore_fails(precompute_distances), pages_metas)
-
-
-def compute_data_regions(
-    pages: List[fm.PageMeta],
-    distance_thresholds: List[float],
-    minimum_depth: int,
-    max_tags_per_gnode: int,
-):
-    n_runs = len(pages) * len(distance_thresholds)
-    logging.info("Number of combinations: {}".format(n_runs))
-
-    for th in tqdm.tqdm(distance_thresholds, desc="thresholds"):
-        run_th = functools.partial(
-            ppp.precompute_data_regions,
-            threshold=th,
-            minimum_depth=minimum_depth,
-            max_tags_per_gnode=max_tags_per_gnode,
+    return scheduled, costs
+
+
+def run_tasks(
+    pages_tasks: List[Tuple[fm.PageMeta, List[Task]]],
+    manifest: batch_executor.Manifest,
+    limits: batch_executor.Limits = batch_executor.NO_LIMITS,
+    retry_budget_factor: Optional[float] = None,
+    costs: Optional[Dict[str, int]] = None,
+) -> None:
+    """
+    Run the pages' tasks with long-lived processes, watched by `batch_executor.WatchdogExecutor`.
+    A page's tasks are a single work item (so they share the caches of a process, and the limits apply to all of
+     them), the pages are handed out one by one, in the given order (see `schedule`), to the processes as they
+     finish their previous one.
+    The tasks are recorded in the manifest by the processes, and the pages that exceeded their limits (or
+     crashed their process) by this one.
+    The throughput and the ETA are logged as the pages finish, the ETA is weighted by the pages' `costs` (the
+     most expensive pages are the first ones, a count of tasks would overestimate it).
+    """
+    n_runs = sum(len(tasks) for _, tasks in pages_tasks)
+    logging.info("Number of tasks: {}".format(n_runs))
+    costs = costs or {}
+    total_cost = sum(costs.get(page_meta.page_id, 1) for page_meta, _ in pages_tasks)
+    n_tasks = {page_meta.page_id: len(tasks) for page_meta, tasks in pages_tasks}
+
+    executor = batch_executor.WatchdogExecutor(
+        run_page_tasks, N_PROCESSES, limits, retry_budget_factor
+    )
+    n_failed_pages, n_finished, finished_cost = 0, 0, 0
+    start = time.monotonic()
+    for outcome in executor.map(
+        (page_meta.page_id, (page_meta, tasks, manifest.path)) for page_meta, tasks in pages_tasks
+    ):
+        if outcome.status != batch_executor.DONE:
+            manifest.append(
+                {
+                    "page_id": outcome.key,
+                    "stage": None,
+                    "status": outcome.status,
+                    "attempt": outcome.attempt,
+                    "duration_s": round(outcome.duration_s, 3),
+                    "max_wall_time_s": outcome.limits.max_wall_time_s,
+                    "max_rss_bytes": outcome.limits.max_rss_bytes,
+                    "error": outcome.error,
+                    "time": datetime.datetime.now().isoformat(),
+                }
+            )
+            if executor.is_retried(outcome):
+                continue
+        if outcome.status != batch_executor.DONE or outcome.value[2] is not None:
+            n_failed_pages += 1
+
+        n_finished += n_tasks[outcome.key]
+        finished_cost += costs.get(outcome.key, 1)
+        elapsed_s = time.monotonic() - start
+        eta_s = elapsed_s * (total_cost - finished_cost) / finished_cost
+        logging.info(
+            "Progress: %d/%d tasks, %.2f tasks/s, ETA %s.",
+            n_finished,
+            n_runs,
+            n_finished / elapsed_s,
+            datetime.timedelta(seconds=round(eta_s)),
+        )
+    logging.info("Number of pages with a failed task: %d.", n_failed_pages)
+
+
+def print_plan(pages: List[fm.PageMeta], distance_thresholds: List[float]) -> None:
+    """ Dry-run: what would be (re)computed and why. """
+    stages = [(pipeline.CLEANUP, {}), (pipeline.DISTANCES, {})]
+    stages += [
+        (pipeline.DATA_REGIONS, pipeline.data_regions_params(th, MAX_TAGS_PER_GNODE))
+        for th in distance_thresholds
+    ]
+    stages += [
+        (
+            pipeline.DATA_RECORDS,
+            pipeline.data_records_params(
+                core.MDREditDistanceThresholds.all_equal(th), MAX_TAGS_PER_GNODE
+            ),
         )
-        with multiprocessing.Pool(N_PROCESSES) as pool:
-            pool.map(log_and_ignore_fails(run_th), pages)
+        for th in distance_thresholds
+    ]
+    steps = pipeline.plan(sorted(pages, key=lambda x: x.page_id), stages)
+    for step in steps:
+        if step.status != pipeline.UP_TO_DATE:
+            print("{} {:<13} {:<18} {}".format(step.page_id, step.stage, step.status, step.params))
+    for stage, counts in pipeline.summarize(steps).items():
+        print("{:<13} {}".format(stage, counts))
+
+
+def _limits(max_page_time_s: Optional[float], max_page_rss_mb: Optional[float]):
+    return batch_executor.Limits(
+        max_wall_time_s=max_page_time_s,
+        max_rss_bytes=None if max_page_rss_mb is None else int(max_page_rss_mb * 2 ** 20),
+    )
 
 
-def compute_data_records(
-    pages: List[fm.PageMeta],
-    distance_thresholds: List[float],  # will only consider cases where all dist th are the same
-    max_tags_per_gnode: int,
-):
-    n_runs = len(pages) * len(distance_thresholds)
-    logging.info("Number of combinations: {}".format(n_runs))
-
-    for th in tqdm.tqdm(distance_thresholds, desc="thresholds"):
-        run_th = functools.partial(
-            ppp.precompute_data_records,
-            thresholds=core.MDREditDistanceThresholds.all_equal(th),
-            max_tags_per_gnode=max_tags_per_gnode,
-        )
-        with multiprocessing.Pool(N_PROCESSES) as pool:
-            pool.map(log_and_ignore_fails(run_th), pages)
+def resume_run(
+    manifest: batch_executor.Manifest,
+    tasks: List[Task],
+    max_page_time_s: Optional[float],
+    max_page_rss_mb: Optional[float],
+    retry_budget_factor: Optional[float],
+) -> None:
+    """ Run the tasks of the manifest's run that it doesn't record as done (see `main`). """
+    records = manifest.read()
+    started = [record for record in records if record["status"] == RUN_STARTED]
+    assert started, "There is no run to resume in {}.".format(str(manifest.path))
+    done = done_tasks(manifest)
+    all_metas = fm.PageMeta.get_all()
+    pages_tasks = []
+    for page_id in started[-1]["pages_ids"]:
+        page_tasks = [
+            task for task in tasks if task_key(page_id, task[0], task_params(task)) not in done
+        ]
+        if page_tasks and page_id in all_metas:
+            pages_tasks.append((all_metas[page_id], page_tasks))
+    logging.info("Resuming: %d tasks done, %d pages to finish.", len(done), len(pages_tasks))
+    pages, costs = schedule([page_meta for page_meta, _ in pages_tasks])
+    pages_tasks = dict((page_meta.page_id, page_tasks) for page_meta, page_tasks in pages_tasks)
+    run_tasks(
+        [(page_meta, pages_tasks[page_meta.page_id]) for page_meta in pages],
+        manifest,
+        _limits(max_page_time_s, max_page_rss_mb),
+        retry_budget_factor,
+        costs,
+    )
 
 
 def main(
-    exec_download=True, exec_cleanup=True, exec_distances=True, exec_drs=True, exec_drecs=True,
+    exec_download=True,
+    exec_cleanup=True,
+    exec_distances=True,
+    exec_drs=True,
+    exec_drecs=True,
+    dry_run=False,
+    refresh=False,
+    max_page_time_s=MAX_PAGE_TIME_S,
+    max_page_rss_mb=MAX_PAGE_RSS_MB,
+    retry_budget_factor=RETRY_BUDGET_FACTOR,
+    resume=False,
 ):
+    """
+    Args:
+        refresh: download the pages again if they changed (conditional requests), then only process the
+         ones that changed, starting with their cleanup (even if `exec_cleanup` is not set)
+        max_page_time_s, max_page_rss_mb, retry_budget_factor: see `run_tasks`
+        resume: continue the last run, only its tasks that are not done in the manifest are run (nothing is
+         downloaded)
+    """
+    manifest = batch_executor.Manifest(fm.outputs_dir.joinpath(MANIFEST_NAME))
+    # the preprocessed htmls of the changed pages are made from their previous raw htmls
+    exec_cleanup = exec_cleanup or refresh
+    tasks = make_tasks(DISTANCE_THRESHOLDS, exec_cleanup, exec_distances, exec_drs, exec_drecs)
+    if resume and not dry_run:
+        resume_run(manifest, tasks, max_page_time_s, max_page_rss_mb, retry_budget_factor)
+        return
+
     # only get the annotated ones
     all_labeled_pages = {
         page_id: page_meta
@@ -119,66 +412,107 @@ def main(
         if page_meta.n_data_records is not None
     }
     logging.info("Number of labeled pages: %d.", len(all_labeled_pages))
-    if exec_download:
+    if dry_run:
+        print_plan(list(all_labeled_pages.values()), DISTANCE_THRESHOLDS)
+        return
+    changed_pages_ids = None
+    if refresh:
+        outcomes = download_all_pages(all_labeled_pages, refresh=True)
+        changed_pages_ids = {
+            page_id for page_id, outcome in outcomes.items() if outcome == downloader.DOWNLOADED
+        }
+        logging.info("Number of changed pages: %d.", len(changed_pages_ids))
+    elif exec_download:
         download_all_pages(all_labeled_pages)
 
-    all_downloaded_pages = {
-        page_id: page_meta
-        for page_id, page_meta in fm.PageMeta.get_all().items()
-        if page_meta.raw_html.exists()
-    }
-    logging.info("Number of downloaded pages: %d.", len(all_downloaded_pages))
-    if exec_cleanup:
-        cleanup_all_pages(all_downloaded_pages)
-
-    all_cleaned_pages = {
-        page_id: page_meta
-        for page_id, page_meta in fm.PageMeta.get_all().items()
-        if page_meta.preprocessed_html.exists()
-    }
-    logging.info("Number of preprocessed pages: %d.", len(all_cleaned_pages))
-    if exec_distances:
-        compute_all_distances(all_cleaned_pages)
-
-    pages_with_distance = {
-        page_id: page_meta
-        for page_id, page_meta in fm.PageMeta.get_all().items()
-        if page_meta.distances_pkl.exists()
-    }
-    logging.info("Number of pages with distance: %d.", len(pages_with_distance))
-    distance_thresholds = [th / 100 for th in range(5, 50 + 1)]
-    logging.info("Number of threshold: %d.", len(distance_thresholds))
-    if exec_drs:
-        compute_data_regions(
-            list(pages_with_distance.values()),
-            distance_thresholds,
-            MINIMUM_DEPTH,
-            MAX_TAGS_PER_GNODE,
-        )
-
-    pages_with_distance_and_all_th = {
-        page_id: page_meta
-        for page_id, page_meta in fm.PageMeta.get_all().items()
-        if page_meta.distances_pkl.exists()
-        and all(page_meta.data_regions_pkl(th, MAX_TAGS_PER_GNODE) for th in distance_thresholds)
-    }
-    logging.info(
-        "Number of pages to computed data records: %d.", len(pages_with_distance_and_all_th)
+    def get_pages() -> Dict[str, fm.PageMeta]:
+        # the results of the pages that didn't change are up-to-date
+        all_metas = fm.PageMeta.get_all()
+        if changed_pages_ids is None:
+            return all_metas
+        return {page_id: all_metas[page_id] for page_id in changed_pages_ids}
+
+    if not tasks:
+        return
+    first_stage = tasks[0][0]
+    pages = [
+        page_meta
+        for page_meta in get_pages().values()
+        if is_ready(page_meta, first_stage, DISTANCE_THRESHOLDS)
+    ]
+    logging.info("Number of pages ready for the %s stage: %d.", first_stage, len(pages))
+    logging.info("Number of threshold: %d.", len(DISTANCE_THRESHOLDS))
+    manifest.clear()
+    # the run's pages, for `resume_run`
+    manifest.append(
+        {
+            "page_id": None,
+            "stage": None,
+            "status": RUN_STARTED,
+            "pages_ids": sorted(page_meta.page_id for page_meta in pages),
+            "time": datetime.datetime.now().isoformat(),
+        }
     )
-    if exec_drecs:
-        compute_data_records(
-            list(pages_with_distance_and_all_th.values()), distance_thresholds, MAX_TAGS_PER_GNODE
-        )
+    pages, costs = schedule(pages)
+    run_tasks(
+        [(page_meta, tasks) for page_meta in pages],
+        manifest,
+        _limits(max_page_time_s, max_page_rss_mb),
+        retry_budget_factor,
+        costs,
+    )
+    logging.info("Manifest: %s", str(manifest.path))
 
 
 if __name__ == "__main__":
-    main(
-        exec_download=False,
-        exec_cleanup=False,
-        exec_distances=True,
-        exec_drs=True,
-        exec_drecs=True,
+    parser = argparse.ArgumentParser(description="Preprocess all the labeled pages.")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only report what would be (re)computed"
     )
-    from files_management import cleanup_pages_meta_lock
-
-    cleanup_pages_meta_lock()
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="download the pages again if they changed, and process only those (cleanup included)",
+    )
+    parser.add_argument(
+        "--max-page-time-s",
+        type=float,
+        default=MAX_PAGE_TIME_S,
+        help="wall time limit of a page's tasks, its worker is killed beyond it",
+    )
+    parser.add_argument(
+        "--max-page-rss-mb",
+        type=float,
+        default=MAX_PAGE_RSS_MB,
+        help="memory limit of a worker while it runs a page's tasks, it is killed beyond it",
+    )
+    parser.add_argument(
+        "--retry-budget-factor",
+        type=float,
+        default=RETRY_BUDGET_FACTOR,
+        help="retry the pages that exceeded their limits once, with the limits multiplied by it",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the last run with the tasks that the manifest doesn't record as done",
+    )
+    args = parser.parse_args()
+    try:
+        main(
+            exec_download=False,
+            exec_cleanup=False,
+            exec_distances=True,
+            exec_drs=True,
+            exec_drecs=True,
+            dry_run=args.dry_run,
+            refresh=args.refresh,
+            max_page_time_s=args.max_page_time_s,
+            max_page_rss_mb=args.max_page_rss_mb,
+            retry_budget_factor=args.retry_budget_factor,
+            resume=args.resume,
+        )
+    finally:
+        if not args.dry_run:
+            # the pages registered (e.g. by the API) and the downloads since the last export, see the README
+            fm.export_pages_meta()
@@ -12,9 +12,11 @@ import urllib.error
 import urllib.parse
 import webargs
 
+# like `prepostprocessing` (without the `src.` package), so they are the same modules as the stages'
+import core
+import files_management as fm
 import prepostprocessing as ppp
-import src.core as core
-from src.files_management import PageMeta
+from files_management import PageMeta
 
 app = flask.Flask(__name__)
 cors = flask_cors.CORS(app)
@@ -28,6 +30,20 @@ logging.basicConfig(
 )
 
 
+# the outputs' disk budget is checked at most this often (see `artifacts_manager`)
+OUTPUTS_BUDGET_CHECK_PERIOD_S = 10 * 60
+
+
+@app.after_request
+def enforce_outputs_budget(response):
+    """ Only starts the eviction, in a background thread (see `enforce_budget_in_background`). """
+    try:
+        fm.artifacts.enforce_budget_in_background(OUTPUTS_BUDGET_CHECK_PERIOD_S)
+    except Exception as ex:
+        logging.error("Failed to enforce the outputs' disk budget. ex={}".format(ex))
+    return response
+
+
 class CallMdrSchema(marshmallow.Schema):
     class Meta:
         # the response is the colored html's path in the local machine
@@ -131,7 +147,6 @@ def save_page_execute(n_data_records: int, url: str, download: bool) -> PageMeta
                 )
             )
         else:
-            with meta.raw_html.open(mode="wb") as f:
-                f.write(page)
+            meta.persist_raw_html(page)
             logging.info("Done")
     return meta
@@ -0,0 +1,349 @@
+"""
+Module dependencies:
+    all - {page_bundle} -> artifacts_manager (and files_management for the command line)
+
+Keeps the outputs directory under a disk budget (`outputs-disk-budget-gb` in config.yml).
+
+Every file of the outputs (and every artifact in the pages' bundles) is an artifact of a kind, the kinds are
+ ranked by how expensive they are to get back (see `KINDS_COSTS`). When the budget is exceeded, the cheapest
+ artifacts are evicted first, and the least recently used first among the ones of the same kind.
+An evicted artifact is simply recomputed when it's needed again (see `pipeline`). The raw htmls would need to
+ be downloaded again (if it's still possible), so they are not evicted unless `evict-raw-htmls` is set.
+
+The last accesses are recorded by `AccessLog` (at most once per hour per artifact and process), the artifacts
+ that have never been accessed since they are tracked fall back on their modification time.
+
+Usage:
+    python artifacts_manager.py report
+    python artifacts_manager.py enforce [--dry-run]
+"""
+
+import argparse
+import collections
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import page_bundle
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(levelname)s [%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s",
+)
+
+ORPHAN_HTML = "orphan_html"  # in the html store but not referenced by any page
+OBSOLETE = "obsolete"  # legacy files replaced by another format
+RESULT = "result"
+NODE_NAMES = "node_names"
+TREE_PROFILE = "tree_profile"
+PREPROCESSED_HTML = "preprocessed_html"
+DATA_RECORDS = "data_records"
+DATA_REGIONS = "data_regions"
+DISTANCES = "distances"
+RAW_HTML = "raw_html"
+
+# the cheapest to get back first
+KINDS_COSTS = {
+    ORPHAN_HTML: 0,
+    OBSOLETE: 0,
+    RESULT: 1,
+    NODE_NAMES: 2,
+    TREE_PROFILE: 2,
+    PREPROCESSED_HTML: 3,
+    DATA_RECORDS: 4,
+    DATA_REGIONS: 5,
+    DISTANCES: 6,
+    RAW_HTML: 7,
+}
+
+# file name patterns (in the outputs directory) --> kind
+FILES_KINDS = (
+    ("raw_htmls/*raw.html", RAW_HTML),
+    ("preprocessed_htmls/*preprocessed.html", PREPROCESSED_HTML),
+    ("preprocessed_htmls/*named_nodes.html", OBSOLETE),
+    ("preprocessed_htmls/*node_names.json", NODE_NAMES),
+    ("intermediate_results/*distances.bin", DISTANCES),
+    ("intermediate_results/*distances.pkl", DISTANCES),
+    ("intermediate_results/*data_regions(*).pkl", DATA_REGIONS),
+    ("results/*data_records(*).pkl", DATA_RECORDS),
+    ("results/*colored.*", RESULT),
+)
+HTML_STORE_PATTERN = "html_store/??/*.html.*"
+BUNDLES_PATTERN = "intermediate_results/*bundle.sqlite"
+
+ACCESS_RESOLUTION_S = 60 * 60
+BUSY_TIMEOUT_MS = 30 * 1000
+
+Artifact = collections.namedtuple("Artifact", ["key", "kind", "n_bytes", "last_access", "location"])
+
+
+def file_key(outputs_dir: pathlib.Path, path: pathlib.Path) -> str:
+    """ Relative to the outputs directory, so the keys survive a move of the outputs. """
+    path = pathlib.Path(path)
+    try:
+        return path.relative_to(outputs_dir).as_posix()
+    except ValueError:
+        return path.as_posix()
+
+
+def html_key(sha256: str) -> str:
+    """ The html store's blobs are keyed by their hash, whatever their codec is. """
+    return "html_store/" + sha256
+
+
+def bundle_artifact_key(
+    outputs_dir: pathlib.Path, bundle_path: pathlib.Path, kind: str, params: dict
+) -> str:
+    return "#".join((file_key(outputs_dir, bundle_path), kind, page_bundle.params_key(params)))
+
+
+class AccessLog(object):
+    """
+        Last access time (unix time) of the artifacts, by key.
+        An artifact's access is written at most once per `resolution_s` by a process, so reading an artifact
+         doesn't mean writing in the database each time.
+    """
+
+    def __init__(self, db_path: pathlib.Path, resolution_s: float = ACCESS_RESOLUTION_S):
+        self.db_path = pathlib.Path(db_path)
+        self.resolution_s = resolution_s
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self._written = {}  # key -> time of the last write by this process
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        pid = os.getpid()
+        if self._connection_pid != pid:
+            connection = sqlite3.connect(
+                str(self.db_path),
+                timeout=BUSY_TIMEOUT_MS / 1000,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS accesses (key TEXT PRIMARY KEY, accessed REAL NOT NULL)"
+            )
+            self._connection = connection
+            self._connection_pid = pid
+            self._written = {}
+        return self._connection
+
+    def touch(self, key: str, now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        with self._lock:
+            connection = self.connection
+            if now - self._written.get(key, float("-inf")) < self.resolution_s:
+                return
+            connection.execute("INSERT OR REPLACE INTO accesses VALUES (?, ?)", (key, now))
+            self._written[key] = now
+
+    def get_all(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.connection.execute("SELECT key, accessed FROM accesses"))
+
+    def forget(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany("DELETE FROM accesses WHERE key = ?", [(key,) for key in keys])
+            connection.execute("COMMIT")
+            for key in keys:
+                self._written.pop(key, None)
+
+
+class ArtifactsManager(object):
+    def __init__(
+        self,
+        outputs_dir: pathlib.Path,
+        budget_bytes: Optional[int],
+        access_log: AccessLog,
+        htmls_kinds: Callable[[], Dict[str, str]],
+        evict_raw_htmls: bool = False,
+    ):
+        """
+        Args:
+            budget_bytes: None for no limit
+            htmls_kinds: gives the kind (RAW_HTML or PREPROCESSED_HTML) of the html store's blobs by hash
+        """
+        self.outputs_dir = pathlib.Path(outputs_dir)
+        self.budget_bytes = budget_bytes
+        self.access_log = access_log
+        self.htmls_kinds = htmls_kinds
+        self.evict_raw_htmls = evict_raw_htmls
+        self._last_enforced = float("-inf")
+        # held while enforcing, so that a single eviction runs at a time
+        self._enforcing = threading.Lock()
+
+    def scan(self) -> List[Artifact]:
+        accesses = self.access_log.get_all()
+        artifacts = []
+
+        def add_file(key: str, kind: str, path: pathlib.Path) -> None:
+            stat = path.stat()
+            last_access = accesses.get(key, stat.st_mtime)
+            artifacts.append(Artifact(key, kind, stat.st_size, last_access, path))
+
+        htmls_kinds = self.htmls_kinds()
+        for path in self.outputs_dir.glob(HTML_STORE_PATTERN):
+            sha256 = path.name.split(".", 1)[0]
+            add_file(html_key(sha256), htmls_kinds.get(sha256, ORPHAN_HTML), path)
+
+        for pattern, kind in FILES_KINDS:
+            for path in self.outputs_dir.glob(pattern):
+                is_converted = path.suffix == ".pkl" and path.with_suffix(".bin").exists()
+                # the converted distances are not used anymore, see `PageMeta.load_precomputed_distances`
+                add_file(
+                    file_key(self.outputs_dir, path),
+                    OBSOLETE if kind == DISTANCES and is_converted else kind,
+                    path,
+                )
+
+        for bundle_path in self.outputs_dir.glob(BUNDLES_PATTERN):
+            for artifact in page_bundle.PageBundle(bundle_path).list():
+                key = bundle_artifact_key(
+                    self.outputs_dir, bundle_path, artifact.kind, artifact.params
+                )
+                last_access = accesses.get(key, artifact.created.timestamp())
+                location = (bundle_path, artifact.kind, artifact.params)
+                artifacts.append(
+                    Artifact(key, artifact.kind, artifact.n_bytes, last_access, location)
+                )
+        return artifacts
+
+    def is_evictable(self, artifact: Artifact) -> bool:
+        return artifact.kind != RAW_HTML or self.evict_raw_htmls
+
+    def n_bytes_on_disk(self) -> int:
+        """ Includes what is not an artifact, e.g. the bundles' own overhead. """
+        return sum(
+            path.stat().st_size for path in self.outputs_dir.rglob("*") if path.is_file()
+        )
+
+    def plan_eviction(self, artifacts: Optional[List[Artifact]] = None) -> List[Artifact]:
+        """ The artifacts to evict to fit in the budget, in the order they would be evicted. """
+        if self.budget_bytes is None:
+            return []
+        artifacts = self.scan() if artifacts is None else artifacts
+        excess = self.n_bytes_on_disk() - self.budget_bytes
+        evicted = []
+        candidates = sorted(
+            filter(self.is_evictable, artifacts),
+            key=lambda a: (KINDS_COSTS.get(a.kind, 0), a.last_access),
+        )
+        for artifact in candidates:
+            if excess <= 0:
+                break
+            evicted.append(artifact)
+            excess -= artifact.n_bytes
+        if excess > 0:
+            logging.warning("The budget cannot be met, %d bytes over it after eviction.", excess)
+        return evicted
+
+    def evict(self, artifacts: List[Artifact]) -> int:
+        """ Returns the number of bytes freed (estimated for the bundles). """
+        n_bytes = 0
+        bundles = set()
+        for artifact in artifacts:
+            if isinstance(artifact.location, pathlib.Path):
+                if not artifact.location.exists():
+                    continue
+                artifact.location.unlink()
+            else:
+                bundle_path, kind, params = artifact.location
+                if not page_bundle.PageBundle(bundle_path).delete(kind, params):
+                    continue
+                bundles.add(bundle_path)
+            n_bytes += artifact.n_bytes
+            logging.info("Evicted. kind=%s key=%s", artifact.kind, artifact.key)
+        for bundle_path in bundles:
+            page_bundle.PageBundle(bundle_path).vacuum()
+        self.access_log.forget([artifact.key for artifact in artifacts])
+        return n_bytes
+
+    def enforce_budget(self, dry_run: bool = False) -> List[Artifact]:
+        with self._enforcing:
+            return self._enforce_budget(dry_run)
+
+    def _enforce_budget(self, dry_run: bool = False) -> List[Artifact]:
+        to_evict = self.plan_eviction()
+        if to_evict and not dry_run:
+            n_bytes = self.evict(to_evict)
+            logging.info("Evicted %d artifacts (%d bytes).", len(to_evict), n_bytes)
+        self._last_enforced = time.time()
+        return to_evict
+
+    def enforce_budget_in_background(self, period_s: float) -> Optional[threading.Thread]:
+        """ Enforce the budget in a (daemon) thread if it has not been done by this process for `period_s`
+         seconds and it is not being done, returns the thread if one was started. """
+        if self.budget_bytes is None or time.time() - self._last_enforced < period_s:
+            return None
+        if not self._enforcing.acquire(blocking=False):
+            return None
+        # released by the thread
+        self._last_enforced = time.time()
+
+        def enforce():
+            try:
+                self._enforce_budget()
+            except Exception as ex:
+                logging.error("Failed to enforce the outputs' disk budget. ex={}".format(ex))
+            finally:
+                self._enforcing.release()
+
+        thread = threading.Thread(target=enforce, name="enforce-outputs-budget", daemon=True)
+        try:
+            thread.start()
+        except BaseException:
+            self._enforcing.release()
+            raise
+        return thread
+
+    def report(self) -> str:
+        artifacts = self.scan()
+        by_kind = collections.defaultdict(lambda: [0, 0])
+        for artifact in artifacts:
+            by_kind[artifact.kind][0] += 1
+            by_kind[artifact.kind][1] += artifact.n_bytes
+        lines = ["{:<18} {:>8} {:>14}".format("kind", "count", "bytes")]
+        for kind in sorted(by_kind, key=lambda k: KINDS_COSTS.get(k, 0)):
+            lines.append("{:<18} {:>8} {:>14}".format(kind, *by_kind[kind]))
+        lines.append("on disk: {} bytes".format(self.n_bytes_on_disk()))
+        lines.append(
+            "budget: {}".format(
+                "none" if self.budget_bytes is None else "{} bytes".format(self.budget_bytes)
+            )
+        )
+        to_evict = self.plan_eviction(artifacts)
+        lines.append(
+            "to evict: {} artifacts ({} bytes)".format(
+                len(to_evict), sum(artifact.n_bytes for artifact in to_evict)
+            )
+        )
+        return "\n".join(lines)
+
+
+def main():
+    import files_management as fm
+
+    parser = argparse.ArgumentParser(description="Disk usage of the outputs and eviction.")
+    parser.add_argument("command", choices=("report", "enforce"))
+    parser.add_argument("--dry-run", action="store_true", help="only list what would be evicted")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        print(fm.artifacts.report())
+    else:
+        for artifact in fm.artifacts.enforce_budget(dry_run=args.dry_run):
+            print("{:<18} {:>12} {}".format(artifact.kind, artifact.n_bytes, artifact.key))
+
+
+if __name__ == "__main__":
+    main()
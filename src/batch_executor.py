@@ -0,0 +1,296 @@
+"""
+Module dependencies:
+    all -> batch_executor
+
+Runs a function on many items in worker processes watched by the parent process (see `WatchdogExecutor`).
+
+An item that runs for too long (wall time) or makes its worker use too much memory (RSS) gets its worker killed
+ and replaced, the item is reported as failed and the other items go on. A worker that dies by itself (e.g.
+ killed by the OS) is replaced the same way.
+Optionally, a failed item is retried once with bigger limits (`retry_budget_factor`).
+
+The workers are long-lived (what they cache is kept from an item to the next) and they are given one item at a
+ time, in the given order.
+The memory is read from `/proc` (Linux), elsewhere only the wall time is limited.
+
+The outcomes can be recorded in a `Manifest` (JSON lines appended atomically).
+"""
+
+import collections
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import pathlib
+import signal
+import time
+import traceback
+from typing import Any, Callable, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(levelname)s [%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s",
+)
+
+POLL_INTERVAL_S = 0.2
+TERMINATE_TIMEOUT_S = 5
+
+# statuses of the outcomes
+DONE = "done"
+FAILED = "failed"  # the function raised an exception
+TIMEOUT = "timeout"
+OUT_OF_MEMORY = "out-of-memory"
+CRASHED = "crashed"  # the worker died
+
+# None for no limit
+Limits = collections.namedtuple("Limits", ["max_wall_time_s", "max_rss_bytes"])
+NO_LIMITS = Limits(None, None)
+
+Outcome = collections.namedtuple(
+    "Outcome", ["key", "status", "value", "error", "duration_s", "attempt", "limits"]
+)
+
+_Task = collections.namedtuple("_Task", ["key", "item", "attempt", "limits", "started"])
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else None
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """ Resident memory of a process, None if it cannot be read (not on Linux or the process is gone). """
+    try:
+        with open("/proc/{}/statm".format(pid), "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError, TypeError):
+        return None
+
+
+def scale_limits(limits: Limits, factor: float) -> Limits:
+    return Limits(*(None if limit is None else limit * factor for limit in limits))
+
+
+def _work(fn: Callable[[Any], Any], connection: multiprocessing.connection.Connection) -> None:
+    """ A worker process' loop: receives (index, item), sends back (index, value, error). """
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        index, item = message
+        try:
+            value, error = fn(item), None
+        except Exception as ex:
+            logging.error("FAIL. ex=%s", ex)
+            traceback.print_tb(ex.__traceback__)
+            value, error = None, "".join(traceback.format_exception_only(type(ex), ex)).strip()
+        connection.send((index, value, error))
+
+
+class _Worker(object):
+    def __init__(self, fn: Callable[[Any], Any]):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_work, args=(fn, child_connection), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.task = None  # the running one
+
+    def submit(self, task: _Task) -> None:
+        self.task = task._replace(started=time.monotonic())
+        self.connection.send((task.key, task.item))
+
+    def exceeded_limit(self) -> Optional[str]:
+        """ The status of the running task if it exceeded one of its limits. """
+        max_wall_time_s, max_rss_bytes = self.task.limits
+        if max_wall_time_s is not None and time.monotonic() - self.task.started > max_wall_time_s:
+            return TIMEOUT
+        if max_rss_bytes is not None:
+            rss = rss_bytes(self.process.pid)
+            if rss is not None and rss > max_rss_bytes:
+                return OUT_OF_MEMORY
+        return None
+
+    def stop(self) -> None:
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(TERMINATE_TIMEOUT_S)
+        if self.process.is_alive():
+            self.kill()
+        self.connection.close()
+
+    def kill(self) -> None:
+        self.process.terminate()
+        self.process.join(TERMINATE_TIMEOUT_S)
+        if self.process.is_alive():
+            os.kill(self.process.pid, signal.SIGKILL)
+            self.process.join()
+        self.connection.close()
+
+
+class WatchdogExecutor(object):
+    def __init__(
+        self,
+        fn: Callable[[Any], Any],
+        n_processes: int,
+        limits: Limits = NO_LIMITS,
+        retry_budget_factor: Optional[float] = None,
+    ):
+        """
+        Args:
+            fn: called with an item in a worker process, it must be picklable (e.g. a module's function), and so
+             must its items and its results
+            limits: of each item, the RSS is the worker's (it includes what it cached for the previous items)
+            retry_budget_factor: an item that exceeded its limits (or crashed its worker) is retried once with
+             its limits multiplied by it, None for no retry
+        """
+        self.fn = fn
+        self.n_processes = n_processes
+        self.limits = limits
+        self.retry_budget_factor = retry_budget_factor
+
+    def is_retried(self, outcome: Outcome) -> bool:
+        """ Whether the item of the outcome is tried again. """
+        return (
+            outcome.status not in (DONE, FAILED)
+            and self.retry_budget_factor is not None
+            and outcome.attempt == 1
+        )
+
+    def _retry(self, task: _Task) -> Optional[_Task]:
+        if self.retry_budget_factor is None or task.attempt > 1:
+            return None
+        return _Task(
+            task.key,
+            task.item,
+            task.attempt + 1,
+            scale_limits(task.limits, self.retry_budget_factor),
+            None,
+        )
+
+    def map(self, keyed_items: Iterable[Tuple[Hashable, Any]]) -> Iterator[Outcome]:
+        """ The outcomes of the items (given as (key, item)) in the order they finish, one per attempt. """
+        pending = collections.deque(
+            _Task(key, item, 1, self.limits, None) for key, item in keyed_items
+        )
+        workers = [_Worker(self.fn) for _ in range(min(self.n_processes, len(pending)))]
+        try:
+            while pending or any(worker.task is not None for worker in workers):
+                for worker in workers:
+                    if worker.task is None and pending:
+                        worker.submit(pending.popleft())
+                busy = [worker for worker in workers if worker.task is not None]
+                multiprocessing.connection.wait(
+                    [worker.connection for worker in busy]
+                    + [worker.process.sentinel for worker in busy],
+                    timeout=POLL_INTERVAL_S,
+                )
+                for i, worker in enumerate(workers):
+                    task = worker.task
+                    if task is None:
+                        continue
+                    status = None
+                    if worker.connection.poll():
+                        try:
+                            _, value, error = worker.connection.recv()
+                        except (EOFError, OSError):
+                            status = CRASHED
+                        else:
+                            worker.task = None
+                            yield Outcome(
+                                task.key,
+                                DONE if error is None else FAILED,
+                                value,
+                                error,
+                                time.monotonic() - task.started,
+                                task.attempt,
+                                task.limits,
+                            )
+                            continue
+                    elif not worker.process.is_alive():
+                        status = CRASHED
+                    else:
+                        status = worker.exceeded_limit()
+                    if status is None:
+                        continue
+
+                    duration_s = time.monotonic() - task.started
+                    logging.warning(
+                        "Killing the worker. key=%s status=%s duration_s=%.1f attempt=%d",
+                        task.key,
+                        status,
+                        duration_s,
+                        task.attempt,
+                    )
+                    worker.kill()
+                    workers[i] = _Worker(self.fn)
+                    retry = self._retry(task)
+                    if retry is not None:
+                        logging.info(
+                            "It will be retried with limits=%s. key=%s", retry.limits, task.key
+                        )
+                        pending.append(retry)
+                    yield Outcome(
+                        task.key, status, None, None, duration_s, task.attempt, task.limits
+                    )
+        finally:
+            for worker in workers:
+                if worker.task is None:
+                    worker.stop()
+                else:
+                    worker.kill()
+
+
+class Manifest(object):
+    """
+        Append-only JSON lines file.
+        Each record is appended with a single write (O_APPEND), so the records of concurrent processes are not
+         interleaved, and an interruption loses at most the record being written.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+        self._is_terminated = False
+
+    def _terminate_incomplete_record(self) -> None:
+        """ So that the next record is not appended to an incomplete one. """
+        if self.path.exists() and self.path.stat().st_size > 0:
+            with self.path.open("rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    with self.path.open("ab") as f_:
+                        f_.write(b"\n")
+        self._is_terminated = True
+
+    def append(self, record: dict) -> None:
+        if not self._is_terminated:
+            self._terminate_incomplete_record()
+        line = (json.dumps(record, sort_keys=True) + "\n").encode("utf-8")
+        fd = os.open(str(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def read(self) -> List[dict]:
+        """ The records, without the last one if it was cut by an interruption. """
+        if not self.path.exists():
+            return []
+        records = []
+        with self.path.open("rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    logging.warning("Skipped an incomplete record of %s.", str(self.path))
+        return records
+
+    def clear(self) -> None:
+        with self.path.open("wb"):
+            pass
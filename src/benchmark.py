@@ -0,0 +1,384 @@
+"""
+Module dependencies:
+    all - {core, files_management, prepostprocessing} -> benchmark
+
+Offline benchmark of the algorithm on a fixed corpus of local pages.
+
+Each page is run `repeats` times end to end (`core.MDR`) and phase by phase (`core.compute_distances`,
+ `core.find_data_regions`, `core.find_data_records`), without any precomputed distances, then once more under
+ `tracemalloc` for its peak memory (not timed, tracing slows down the allocations).
+The report (JSON) has the throughput (pages/s), the latency percentiles of each phase, the peak memory and the
+ accuracy of the number of data records found against the pages' labels.
+Two reports can be compared, the differences beyond a tolerance are reported as regressions.
+
+The corpus is given as html files and/or directories of html files, parsed and cleaned like
+ `prepostprocessing.cleanup_html` does (outside of the measures); the labels (number of data records) of the
+ files of a directory are read from its `labels.json` ({file name: number of data records}), if any.
+The pages of the outputs that have a preprocessed html can be used too (`--stored-pages`), labeled with their
+ `n_data_records`.
+Synthetic corpora, e.g. of pages larger than the real ones, are written by `synthetic.py`.
+
+Usage:
+    python benchmark.py run [path/to/page.html path/to/corpus-dir ...] [--stored-pages] [--repeats 3]
+        [--output report.json]
+    python benchmark.py compare base-report.json new-report.json [--tolerance 0.1]
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import logging
+import pathlib
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import core
+import files_management as fm
+import prepostprocessing as ppp
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(levelname)s [%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s",
+)
+
+REPORT_VERSION = 1
+
+DEFAULT_CORPUS = (pathlib.Path(__file__).parent.parent.joinpath("test", "rsrc").absolute(),)
+LABELS_FILENAME = "labels.json"
+
+REPEATS = 3
+MINIMUM_DEPTH = 3
+MAX_TAG_PER_GNODE = 10
+THRESHOLD = 0.3
+TOLERANCE = 0.1
+
+MDR = "mdr"  # end to end
+COMPUTE_DISTANCES = "compute_distances"
+FIND_DATA_REGIONS = "find_data_regions"
+FIND_DATA_RECORDS = "find_data_records"
+PHASES = (MDR, COMPUTE_DISTANCES, FIND_DATA_REGIONS, FIND_DATA_RECORDS)
+
+PERCENTILES = (50, 90, 95, 99)
+
+# metric (path in the report's summary) -> whether higher is better, see `compare`
+COMPARED_METRICS = dict(
+    [(("pages_per_s",), True)]
+    + [
+        (("latency_s", phase, "p{}".format(percentile)), False)
+        for phase in PHASES
+        for percentile in (50, 90)
+    ]
+    + [
+        (("peak_traced_bytes",), False),
+        (("accuracy", "mean_absolute_error"), False),
+        (("accuracy", "exact"), True),
+    ]
+)
+
+
+class Page(object):
+    def __init__(self, name: str, tree: core.HTML_ELEMENT, label: Optional[int]):
+        self.name = name
+        self.tree = tree
+        self.label = label
+
+
+def _parse(filepath: pathlib.Path) -> core.HTML_ELEMENT:
+    """ Like `prepostprocessing.cleanup_html`. """
+    with filepath.open("rb") as file:
+        doc = fm.clean_html(file, ppp.CLEANUP_DROPPED_TAGS).root
+    if fm.preprocessing_profile == fm.PREPROCESSING_PROFILE_PRUNED:
+        core.prune(doc)
+    return doc
+
+
+def load_corpus(paths: List[pathlib.Path]) -> List[Page]:
+    pages = []
+    for path in paths:
+        path = pathlib.Path(path)
+        if path.is_dir():
+            labels_json = path.joinpath(LABELS_FILENAME)
+            labels = json.loads(labels_json.read_text()) if labels_json.exists() else {}
+            for filepath in sorted(path.glob("*.html")):
+                name = "{}/{}".format(path.name, filepath.name)
+                pages.append(Page(name, _parse(filepath), labels.get(filepath.name)))
+        else:
+            assert path.exists(), "Page not found `{}`.".format(path)
+            pages.append(Page(path.name, _parse(path), None))
+    return pages
+
+
+def load_stored_pages() -> List[Page]:
+    return [
+        Page(page_meta.page_id, page_meta.get_preprocessed_html_tree(), page_meta.n_data_records)
+        for page_meta in fm.PageMeta.get_all().values()
+        if page_meta.has_preprocessed_html
+    ]
+
+
+def run_phases(
+    tree: core.HTML_ELEMENT,
+    minimum_depth: int,
+    max_tag_per_gnode: int,
+    thresholds: core.MDREditDistanceThresholds,
+) -> Dict[str, float]:
+    """ The durations of the phases, in seconds. """
+    root = copy.deepcopy(tree)
+    node_namer = core.NodeNamer()
+    node_namer.load(root)
+    distances, data_regions = {}, {}
+
+    start = time.perf_counter()
+    core.compute_distances(root, distances, {}, node_namer, minimum_depth, max_tag_per_gnode)
+    distances_end = time.perf_counter()
+    core.find_data_regions(
+        root,
+        node_namer,
+        minimum_depth,
+        distances,
+        data_regions,
+        thresholds.data_region,
+        max_tag_per_gnode,
+    )
+    data_regions_end = time.perf_counter()
+    core.find_data_records(root, data_regions, distances, node_namer, thresholds, max_tag_per_gnode)
+    data_records_end = time.perf_counter()
+    return {
+        COMPUTE_DISTANCES: distances_end - start,
+        FIND_DATA_REGIONS: data_regions_end - distances_end,
+        FIND_DATA_RECORDS: data_records_end - data_regions_end,
+    }
+
+
+def run_mdr(
+    tree: core.HTML_ELEMENT,
+    minimum_depth: int,
+    max_tag_per_gnode: int,
+    thresholds: core.MDREditDistanceThresholds,
+) -> Tuple[float, int]:
+    """ (duration in seconds, number of data records) """
+    start = time.perf_counter()
+    data_records = core.MDR(tree, minimum_depth, max_tag_per_gnode, thresholds)()
+    return time.perf_counter() - start, len(data_records)
+
+
+def peak_traced_bytes(
+    tree: core.HTML_ELEMENT,
+    minimum_depth: int,
+    max_tag_per_gnode: int,
+    thresholds: core.MDREditDistanceThresholds,
+) -> int:
+    """ The peak of the memory allocated by python during a run (not by the C extensions, e.g. lxml). """
+    tracemalloc.start()
+    try:
+        core.MDR(tree, minimum_depth, max_tag_per_gnode, thresholds)()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_page(
+    page: Page,
+    repeats: int,
+    minimum_depth: int,
+    max_tag_per_gnode: int,
+    thresholds: core.MDREditDistanceThresholds,
+) -> dict:
+    """ The latencies are the ones of each repeat. """
+    latencies = {phase: [] for phase in PHASES}
+    n_records = None
+    try:
+        for _ in range(repeats):
+            duration_s, n_records = run_mdr(page.tree, minimum_depth, max_tag_per_gnode, thresholds)
+            latencies[MDR].append(duration_s)
+            for phase, duration_s in run_phases(
+                page.tree, minimum_depth, max_tag_per_gnode, thresholds
+            ).items():
+                latencies[phase].append(duration_s)
+        peak = peak_traced_bytes(page.tree, minimum_depth, max_tag_per_gnode, thresholds)
+    except Exception as ex:
+        logging.warning("The page failed. page=%s ex=%r", page.name, ex)
+        return {"name": page.name, "label": page.label, "error": repr(ex)}
+    return {
+        "name": page.name,
+        "label": page.label,
+        "n_nodes": sum(1 for _ in page.tree.iter()),
+        "n_records": n_records,
+        "latency_s": latencies,
+        "peak_traced_bytes": peak,
+    }
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    stats = {
+        "p{}".format(percentile): float(value)
+        for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES))
+    }
+    stats.update({"mean": float(np.mean(samples)), "max": float(np.max(samples))})
+    return stats
+
+
+def summarize(pages_results: List[dict]) -> dict:
+    done = [result for result in pages_results if "error" not in result]
+    latencies = {
+        phase: [duration_s for result in done for duration_s in result["latency_s"][phase]]
+        for phase in PHASES
+    }
+    labeled = [result for result in done if result["label"] is not None]
+    errors = np.array([result["n_records"] - result["label"] for result in labeled])
+    return {
+        "n_pages": len(pages_results),
+        "n_failed": len(pages_results) - len(done),
+        "pages_per_s": len(latencies[MDR]) / sum(latencies[MDR]) if latencies[MDR] else None,
+        "latency_s": {phase: _percentiles(latencies[phase]) for phase in PHASES},
+        "peak_traced_bytes": max((result["peak_traced_bytes"] for result in done), default=None),
+        # of the whole process, it includes the corpus (ru_maxrss is in kilobytes on Linux)
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "accuracy": {
+            "n_labeled": len(labeled),
+            "mean_absolute_error": float(np.abs(errors).mean()) if len(labeled) else None,
+            "exact": float((errors == 0).mean()) if len(labeled) else None,
+        },
+    }
+
+
+def run(
+    pages: List[Page],
+    repeats: int = REPEATS,
+    minimum_depth: int = MINIMUM_DEPTH,
+    max_tag_per_gnode: int = MAX_TAG_PER_GNODE,
+    thresholds: core.MDREditDistanceThresholds = core.MDREditDistanceThresholds.all_equal(
+        THRESHOLD
+    ),
+) -> dict:
+    """ The report. """
+    pages_results = []
+    for page in pages:
+        logging.info("Benchmarking page=%s", page.name)
+        pages_results.append(
+            benchmark_page(page, repeats, minimum_depth, max_tag_per_gnode, thresholds)
+        )
+    return {
+        "version": REPORT_VERSION,
+        "created": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "repeats": repeats,
+            "minimum_depth": minimum_depth,
+            "max_tag_per_gnode": max_tag_per_gnode,
+            "thresholds": dict(thresholds._asdict()),
+            "preprocessing_profile": fm.preprocessing_profile,
+        },
+        "summary": summarize(pages_results),
+        "pages": pages_results,
+    }
+
+
+def _metric(summary: dict, path: Tuple[str, ...]) -> Optional[float]:
+    value = summary
+    for name in path:
+        if not isinstance(value, dict) or name not in value:
+            return None
+        value = value[name]
+    return value
+
+
+def compare(base: dict, new: dict, tolerance: float = TOLERANCE) -> dict:
+    """
+    The relative changes of the metrics (see `COMPARED_METRICS`) from the `base` report to the `new` one.
+    A change for the worse bigger than `tolerance` (relative) is a regression.
+    """
+    metrics = {}
+    for path, is_higher_better in COMPARED_METRICS.items():
+        base_value, new_value = _metric(base["summary"], path), _metric(new["summary"], path)
+        if base_value is None or new_value is None:
+            continue
+        change = (new_value - base_value) / base_value if base_value else None
+        if change is None:
+            is_regression = new_value != base_value and (new_value < base_value) == is_higher_better
+        else:
+            is_regression = (-change if is_higher_better else change) > tolerance
+        metrics[".".join(path)] = {
+            "base": base_value,
+            "new": new_value,
+            "change": change,
+            "regression": is_regression,
+        }
+    return {
+        "same_parameters": base["parameters"] == new["parameters"],
+        "same_corpus": [page["name"] for page in base["pages"]]
+        == [page["name"] for page in new["pages"]],
+        "tolerance": tolerance,
+        "metrics": metrics,
+        "regressions": sorted(name for name, metric in metrics.items() if metric["regression"]),
+    }
+
+
+def main_run(args: argparse.Namespace) -> None:
+    pages = load_corpus(args.paths or list(DEFAULT_CORPUS))
+    if args.stored_pages:
+        pages += load_stored_pages()
+    assert pages, "The corpus is empty."
+    # the logs of the algorithm would be measured too
+    logging.getLogger().setLevel(logging.WARNING)
+    report = run(
+        pages,
+        args.repeats,
+        args.minimum_depth,
+        args.max_tag_per_gnode,
+        core.MDREditDistanceThresholds.all_equal(args.threshold),
+    )
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.write_text(text)
+        print(json.dumps(report["summary"], indent=2, sort_keys=True))
+
+
+def main_compare(args: argparse.Namespace) -> None:
+    comparison = compare(
+        json.loads(args.base.read_text()), json.loads(args.new.read_text()), args.tolerance
+    )
+    print(json.dumps(comparison, indent=2, sort_keys=True))
+    if comparison["regressions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the algorithm on local pages.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="benchmark a corpus, the report is JSON")
+    run_parser.add_argument(
+        "paths", type=pathlib.Path, nargs="*", help="html files and directories, default: test/rsrc"
+    )
+    run_parser.add_argument("--stored-pages", action="store_true", help="the preprocessed pages")
+    run_parser.add_argument("--repeats", type=int, default=REPEATS)
+    run_parser.add_argument("--minimum-depth", type=int, default=MINIMUM_DEPTH)
+    run_parser.add_argument("--max-tag-per-gnode", type=int, default=MAX_TAG_PER_GNODE)
+    run_parser.add_argument("--threshold", type=float, default=THRESHOLD, help="all the thresholds")
+    run_parser.add_argument("--output", type=pathlib.Path, default=None, help="default: stdout")
+    run_parser.set_defaults(main=main_run)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two reports, exits with 1 if there are regressions"
+    )
+    compare_parser.add_argument("base", type=pathlib.Path)
+    compare_parser.add_argument("new", type=pathlib.Path)
+    compare_parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative")
+    compare_parser.set_defaults(main=main_compare)
+
+    args = parser.parse_args()
+    args.main(args)
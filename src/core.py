@@ -16,6 +16,7 @@ References:
 """
 
 import copy
+import hashlib
 import logging
 from collections import defaultdict, namedtuple, UserList
 from typing import Set, List, Dict, Union, Optional
@@ -38,6 +39,27 @@ DICT_PARAM_MINIMUM_DEPTH = "minimum_depth"
 HTML_ELEMENT = lxml.html.HtmlElement
 
 NODE_NAME_ATTRIB = "___tag_name___"
+# on the placeholders of the pruned subtrees (see `prune`), the counts of the removed tags, e.g. "div:2 span:3"
+PRUNED_TAGS_ATTRIB = "___pruned_tags___"
+
+# the types of html nodes considered as potential data records, see `should_process_node`
+CANDIDATE_TAGS = (
+    "table",
+    "tr",
+    "th",
+    "td",
+    "thead",
+    "tbody",
+    "tfoot",
+    "form",
+    # [algo-list-elements-considered]
+    # this makes the algo considerably slower
+    "ol",
+    "ul",
+    "li",
+)
+# attributes kept by `prune`, they matter for the structure
+PRUNE_KEPT_ATTRIBS = ("colspan", "rowspan", NODE_NAME_ATTRIB, PRUNED_TAGS_ATTRIB)
 
 logging.basicConfig(
     level=logging.INFO, format="[%(filename)s:%(lineno)s - %(funcName)20s()] %(message)s"
@@ -236,12 +258,20 @@ class NodeNamer(object):
         This class is an utility for finding the node name of a given node's HtmlElement.
         On init it will right the nodes' names sequentially on themselves as an attribute.
         Then, when called again with an HtmlNode, it retrieves this attribute and returns it.
+
+        The names only depend on the sequence of tags in preorder, so they are not saved with the document:
+         they are replayed by `load` and `sidecar` gives what is needed to check that a replay on a reloaded
+         document gives the same names.
         # todo(improvement)(?) change the other naming method to use this
         # improvement
     """
 
+    SIDECAR_VERSION = 1
+
     def __init__(self, for_loaded_file: bool = False):
         self.tag_counts = defaultdict(int)
+        self.n_nodes = 0
+        self._tags_sha1 = hashlib.sha1()
         self._is_loaded = for_loaded_file
 
     def __call__(self, node: HTML_ELEMENT, *args, **kwargs):
@@ -256,18 +286,59 @@ class NodeNamer(object):
             if NODE_NAME_ATTRIB in node.attrib:
                 del node.attrib[NODE_NAME_ATTRIB]
 
-    def load(self, root: HTML_ELEMENT) -> None:
-        """ Write down the name attribute in the nodes of an html tree. """
+    def load(self, root: HTML_ELEMENT, sidecar: Optional[dict] = None) -> None:
+        """
+            Write down the name attribute in the nodes of an html tree.
+            If `sidecar` (see `NodeNamer.sidecar`) is given, the tree must be the one that has been named before.
+        """
         if self._is_loaded:
             return
-        # each tag is named sequentially
+        self._walk(root, set_names=True)
+
+        if sidecar is not None:
+            assert (
+                sidecar == self.sidecar
+            ), "The tree is not the one that has been named. {} != {}".format(sidecar, self.sidecar)
+
+    def _walk(self, root: HTML_ELEMENT, set_names: bool) -> None:
         for node in root.getiterator():
-            tag = node.tag
-            tag_sequential = self.tag_counts[tag]
-            self.tag_counts[tag] += 1
-            node_name = "{0}-{1:0>5}".format(tag, tag_sequential)
-            node.set(NODE_NAME_ATTRIB, node_name)
-            self._is_loaded = True
+            name = self.add_node(node.tag, node.get(PRUNED_TAGS_ATTRIB))
+            if set_names:
+                node.set(NODE_NAME_ATTRIB, name)
+            self._is_loaded = set_names
+
+    def add_node(self, tag, pruned_tags: Optional[str] = None) -> str:
+        """
+            Count the next node of the tree in preorder and return its name, the sidecar of a tree can be built
+             while it is parsed (see `files_management.clean_html`).
+        """
+        # each tag is named sequentially
+        tag_sequential = self.tag_counts[tag]
+        self.tag_counts[tag] += 1
+        # the pruned descendants would come right after it
+        for pruned_tag_count in (pruned_tags or "").split():
+            pruned_tag, count = pruned_tag_count.rsplit(":", 1)
+            self.tag_counts[pruned_tag] += int(count)
+        # comments' and pis' tags are functions, their repr is not stable
+        self._tags_sha1.update((tag if isinstance(tag, str) else tag.__name__).encode() + b"\0")
+        self.n_nodes += 1
+        return "{0}-{1:0>5}".format(tag, tag_sequential)
+
+    @staticmethod
+    def sidecar_of(root: HTML_ELEMENT) -> dict:
+        """ The sidecar of the names that `load` would write down, without writing them. """
+        node_namer = NodeNamer()
+        node_namer._walk(root, set_names=False)
+        return node_namer.sidecar
+
+    @property
+    def sidecar(self) -> dict:
+        """ A compact (json-able) summary of the named tree, it's enough to check a replay of the names. """
+        return {
+            "version": self.SIDECAR_VERSION,
+            "n_nodes": self.n_nodes,
+            "tags_sha1": self._tags_sha1.hexdigest(),
+        }
 
 
 # typing consts
@@ -404,6 +475,9 @@ def compute_distances(
     """
         See pseudo code in Figure 5 in [1].
         It fills in the given `distances` dict reusing the `precomputed` to accelerate if possible.
+        The precomputed distances of a node are reused whatever the parameters they were computed with because
+         the gnode sizes 1..K' are valid for any K' (the max_tag_per_gnode of the precomputed), so only the
+         missing gnode sizes (K'+1..max_tag_per_gnode) and nodes (precomputed as None) are computed.
         todo(improvement) create dry run to get the size of list/dicts and then rerun --> faster by avoiding allocation
     """
 
@@ -414,23 +488,30 @@ def compute_distances(
     if node_depth >= minimum_depth and should_process_node(node):
         # get all possible node_distances of the n-grams of children
         # {gnode_size: {GNode: float}}
-        precomputed_min_depth = precomputed.get(DICT_PARAM_MINIMUM_DEPTH)
         precomputed_max_tag_per_gnode = precomputed.get(DICT_PARAM_TAG_PER_GNODE)
-        # todo(improvement) use as much as possible if it's partially computed...
-        precomputed_is_compatible = (
-            precomputed_min_depth is not None
-            and precomputed_max_tag_per_gnode is not None
-            and precomputed_min_depth <= minimum_depth
-            and precomputed_max_tag_per_gnode >= max_tag_per_gnode
-        )
         precomputed_node_distances = (
-            precomputed.get(node_name) if precomputed_is_compatible else None
+            precomputed.get(node_name) if precomputed_max_tag_per_gnode is not None else None
         )
 
         if precomputed_node_distances is None:
             node_distances = _compare_combinations(node.getchildren(), node_name, max_tag_per_gnode)
-        else:
+        elif precomputed_max_tag_per_gnode >= max_tag_per_gnode:
             node_distances = precomputed_node_distances
+        else:
+            logging.debug(
+                "completing precomputed distances. node_name=%s from_gnode_size=%d",
+                node_name,
+                precomputed_max_tag_per_gnode + 1,
+            )
+            node_distances = dict(precomputed_node_distances)
+            node_distances.update(
+                _compare_combinations(
+                    node.getchildren(),
+                    node_name,
+                    max_tag_per_gnode,
+                    min_gnode_size=precomputed_max_tag_per_gnode + 1,
+                )
+            )
     else:
         logging.debug("skipped (less than min depth = %d)", minimum_depth)
         node_distances = None
@@ -444,7 +525,11 @@ def compute_distances(
 
 
 def _compare_combinations(
-    node_list: List[HTML_ELEMENT], parent_name: str, max_tag_per_gnode: int, only_1b1: bool = False,
+    node_list: List[HTML_ELEMENT],
+    parent_name: str,
+    max_tag_per_gnode: int,
+    only_1b1: bool = False,
+    min_gnode_size: int = 1,
 ) -> NODE_DISTANCES_DICT_FORMAT:
     """
     See pseudo algorithm in Figure 6 in [1].
@@ -455,6 +540,7 @@ def _compare_combinations(
         max_tag_per_gnode:
         only_1b1: it might happen that a node is skipped for performance reasons and it is later needed in the
                   data records finding algorithm. So this allows to compute only the necessary in that case.
+        min_gnode_size: the gnodes smaller than this are skipped (e.g. they have already been computed).
 
     Returns:
 
@@ -478,7 +564,11 @@ def _compare_combinations(
     # 1) for (i = 1; i <= K; i++)  /* start from each node */
     for starting_tag in range(1, max_tag_per_gnode + 1):
         # 2) for (j = i; j <= K; j++) /* comparing different combinations */
-        gnode_size_range = range(starting_tag, max_tag_per_gnode + 1) if not only_1b1 else [1]
+        gnode_size_range = (
+            range(max(starting_tag, min_gnode_size), max_tag_per_gnode + 1)
+            if not only_1b1
+            else [1]
+        )
         for gnode_size in gnode_size_range:  # j
             # 3) if NodeList[i+2*j-1] exists then
             there_are_pairs_to_look = (starting_tag + 2 * gnode_size - 1) < n_nodes + 1
@@ -1143,21 +1233,105 @@ def depth(node: HTML_ELEMENT) -> int:
 
 def should_process_node(node: HTML_ELEMENT):
     """ This defines which types of html nodes will be considered as a potential data record. """
-    return node.tag in (
-        "table",
-        "tr",
-        "th",
-        "td",
-        "thead",
-        "tbody",
-        "tfoot",
-        "form",
-        # [algo-list-elements-considered]
-        # this makes the algo considerably slower
-        "ol",
-        "ul",
-        "li",
+    return node.tag in CANDIDATE_TAGS
+
+
+def count_gnode_pairs(n_children: int, max_tag_per_gnode: int) -> int:
+    """ The number of gnode pairs compared by `_compare_combinations` among `n_children` nodes. """
+    # the pairs of size j start at 0..n_children - 2j
+    return sum(
+        max(0, n_children - 2 * gnode_size + 1) for gnode_size in range(1, max_tag_per_gnode + 1)
+    )
+
+
+TreeStats = namedtuple("TreeStats", ["n_nodes", "max_fanout", "n_gnode_pairs"])
+
+# fanouts: [depth, number of children, number of nodes] of the nodes MDR processes (with 2 children or more)
+TreeProfile = namedtuple("TreeProfile", ["n_nodes", "max_fanout", "fanouts"])
+
+
+def tree_profile(root: HTML_ELEMENT) -> TreeProfile:
+    """
+        What `tree_stats` needs of a tree for any parameters, so it can be saved with the preprocessed html and
+         the stats are computed without parsing it again (see `profile_stats`). It's json-able.
+    """
+    n_nodes, max_fanout, fanouts = 0, 0, defaultdict(int)
+    nodes = [(root, 0)]
+    while nodes:
+        node, node_depth = nodes.pop()
+        children = node.getchildren()
+        n_nodes += 1
+        max_fanout = max(max_fanout, len(children))
+        if len(children) > 1 and should_process_node(node):
+            fanouts[node_depth, len(children)] += 1
+        nodes.extend((child, node_depth + 1) for child in children)
+    return TreeProfile(
+        n_nodes, max_fanout, [[depth, n, count] for (depth, n), count in sorted(fanouts.items())]
+    )
+
+
+def profile_stats(profile: TreeProfile, minimum_depth: int, max_tag_per_gnode: int) -> TreeStats:
+    """ See `tree_stats`. """
+    n_gnode_pairs = sum(
+        count * count_gnode_pairs(n_children, max_tag_per_gnode)
+        for depth, n_children, count in profile.fanouts
+        if depth >= minimum_depth
     )
+    return TreeStats(profile.n_nodes, profile.max_fanout, n_gnode_pairs)
+
+
+def tree_stats(root: HTML_ELEMENT, minimum_depth: int, max_tag_per_gnode: int) -> TreeStats:
+    """
+        Statistics of a tree that estimate the cost of MDR on it, the distances (`compute_distances`) dominate:
+         `n_gnode_pairs` is the number of edit distances it computes.
+    """
+    return profile_stats(tree_profile(root), minimum_depth, max_tag_per_gnode)
+
+
+def _normalize_whitespace(text: Optional[str]) -> Optional[str]:
+    if text is None:
+        return None
+    return " ".join(text.split()) or None
+
+
+def prune(root: HTML_ELEMENT) -> None:
+    """
+        Collapse the subtrees without any candidate tag (see `should_process_node`) into placeholders and
+         normalize the whitespace and the attributes of what's left, the strings compared by MDR get much shorter.
+        A placeholder is the root of the subtree without its content, it keeps its position among its siblings
+         and the counts of the removed tags, so `NodeNamer` gives the nodes the names they'd have without pruning
+         and the data records found on the pruned tree map back to the original one.
+        The tree must not have comments nor processing instructions (see `prepostprocessing.cleanup_html`).
+    """
+    has_candidates = set()
+    for candidate in root.iter(*CANDIDATE_TAGS):
+        for node in [candidate] + list(candidate.iterancestors()):
+            if node in has_candidates:
+                break
+            has_candidates.add(node)
+
+    to_visit = [root]
+    while to_visit:
+        node = to_visit.pop()
+        if node not in has_candidates:
+            pruned_tags = defaultdict(int)
+            for descendant in node.iterdescendants():
+                pruned_tags[descendant.tag] += 1
+            for child in list(node):
+                node.remove(child)
+            node.text = None
+            if pruned_tags:
+                node.set(
+                    PRUNED_TAGS_ATTRIB,
+                    " ".join("{}:{}".format(tag, n) for tag, n in sorted(pruned_tags.items())),
+                )
+        else:
+            node.text = _normalize_whitespace(node.text)
+            to_visit.extend(node)
+        node.tail = _normalize_whitespace(node.tail)
+        for attrib in list(node.attrib):
+            if attrib not in PRUNE_KEPT_ATTRIBS:
+                del node.attrib[attrib]
 
 
 def paint_data_records(data_records_nodes: List[List[HTML_ELEMENT]]):
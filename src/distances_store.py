@@ -0,0 +1,381 @@
+"""
+Module dependencies:
+    all - {core} -> distances_store
+
+Binary format of the precomputed distances (all integers are little-endian):
+
+    header:
+        magic               8s      b"PYMDRDST"
+        version             H
+        minimum_depth       i
+        max_tag_per_gnode   i
+        n_nodes             I
+        index_offset        Q       (since version 2)
+
+    then, for each node (a "record"):
+        name_len            H
+        name                (name_len)s     utf-8
+        n_sizes             h               -1 means that the node's distances are None
+        n_sizes x (gnode_size H, count I)
+        padding to a multiple of 8 bytes
+        n_sizes x (count x d)               float64 arrays, one per gnode size
+
+    then, at `index_offset`, the index of the records (since version 2):
+        n_nodes x (name_len H, name (name_len)s, record_offset Q)
+
+    The distance of the gnode pair of size `j` whose left gnode starts at the child index `s` is stored at the
+     position `s` of the array of size `j` (see `_compare_combinations` in `core`: the pairs of a given size
+     cover all the starts from 0 to n_children - 2j).
+
+    Only the header and the index are read on load, a node's record is decoded the first time it is accessed.
+"""
+
+import mmap
+import os
+import pathlib
+import struct
+import sys
+from collections.abc import Mapping
+from typing import Dict, Iterator, Optional, Union
+
+import core
+
+MAGIC = b"PYMDRDST"
+FORMAT_VERSION = 2
+SUPPORTED_FORMAT_VERSIONS = (1, 2)
+
+_MAGIC_AND_VERSION = struct.Struct("<8sH")
+_HEADERS = {1: struct.Struct("<8sHiiI"), 2: struct.Struct("<8sHiiIQ")}
+_HEADER = _HEADERS[FORMAT_VERSION]
+_INDEX_OFFSET = struct.Struct("<Q")
+_NAME_LEN = struct.Struct("<H")
+_N_SIZES = struct.Struct("<h")
+_SIZE_ENTRY = struct.Struct("<HI")
+_FLOAT = struct.Struct("<d")
+
+_NONE_NODE = -1
+_ALIGNMENT = 8
+
+_PARAM_KEYS = (core.DICT_PARAM_MINIMUM_DEPTH, core.DICT_PARAM_TAG_PER_GNODE)
+
+_NATIVE_IS_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+class DistancesFormatError(Exception):
+    pass
+
+
+def _padding(offset: int) -> int:
+    return (-offset) % _ALIGNMENT
+
+
+def _float_array(buffer, offset: int, count: int):
+    """ Zero-copy view of `count` float64 starting at `offset` (when the platform allows it). """
+    raw = memoryview(buffer)[offset : offset + count * _FLOAT.size]
+    if _NATIVE_IS_LITTLE_ENDIAN:
+        return raw.cast("d")
+    return [value for (value,) in _FLOAT.iter_unpack(raw)]
+
+
+class GNodePairDistances(Mapping):
+    """
+        Read-only `{GNodePair: float}` of all the pairs of gnodes of a given size under a node.
+        The GNodePair objects are only created on demand.
+    """
+
+    __slots__ = ("node_name", "gnode_size", "_values")
+
+    def __init__(self, node_name: str, gnode_size: int, values):
+        self.node_name = node_name
+        self.gnode_size = gnode_size
+        self._values = values
+
+    def _start_of(self, gnode_pair) -> Optional[int]:
+        try:
+            left, right = gnode_pair
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(left, core.GNode) or not isinstance(right, core.GNode):
+            return None
+        size = self.gnode_size
+        is_valid = (
+            left.parent == self.node_name
+            and right.parent == self.node_name
+            and left.end - left.start == size
+            and right.start == left.end
+            and right.end - right.start == size
+            and 0 <= left.start < len(self._values)
+        )
+        return left.start if is_valid else None
+
+    def __getitem__(self, gnode_pair) -> float:
+        start = self._start_of(gnode_pair)
+        if start is None:
+            raise KeyError(gnode_pair)
+        return self._values[start]
+
+    def __contains__(self, gnode_pair) -> bool:
+        return self._start_of(gnode_pair) is not None
+
+    def __iter__(self) -> Iterator[core.GNodePair]:
+        name, size = self.node_name, self.gnode_size
+        for start in range(len(self._values)):
+            yield core.GNodePair(
+                core.GNode(name, start, start + size),
+                core.GNode(name, start + size, start + 2 * size),
+            )
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def values(self):
+        return list(self._values)
+
+    def as_list(self):
+        """ The distances ordered by the start index of the left gnode. """
+        return list(self._values)
+
+
+class NodeDistances(Mapping):
+    """ Read-only `{gnode_size: GNodePairDistances}` of a node, i.e. the `core.NODE_DISTANCES_DICT_FORMAT`. """
+
+    __slots__ = ("node_name", "_sizes")
+
+    def __init__(self, node_name: str, sizes: dict):
+        self.node_name = node_name
+        self._sizes = sizes
+
+    def __getitem__(self, gnode_size: int) -> GNodePairDistances:
+        return self._sizes[gnode_size]
+
+    def __contains__(self, gnode_size) -> bool:
+        return gnode_size in self._sizes
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._sizes)
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+
+class PrecomputedDistances(Mapping):
+    """
+        Read-only `core.DISTANCES_DICT_FORMAT` backed by a memory-mapped distances file.
+        The parameters (`core.DICT_PARAM_MINIMUM_DEPTH` and `core.DICT_PARAM_TAG_PER_GNODE`) are accessible
+         like in the legacy dict (`precomputed.get("minimum_depth")`) but they are not iterated over.
+        A node's distances are decoded the first time they are accessed, the rest of the file is never read.
+    """
+
+    def __init__(self, minimum_depth: int, max_tag_per_gnode: int, offsets: Dict[str, int], buffer):
+        self.minimum_depth = minimum_depth
+        self.max_tag_per_gnode = max_tag_per_gnode
+        self._offsets = offsets
+        self._nodes = {}
+        # keeps the memory map alive while the views are around
+        self._buffer = buffer
+
+    @property
+    def n_loaded_nodes(self) -> int:
+        """ Number of nodes whose record has already been decoded. """
+        return len(self._nodes)
+
+    def node_distances(self, node_name: str) -> Optional[NodeDistances]:
+        """ Decode (only) the record of the node `node_name`. """
+        try:
+            return self._nodes[node_name]
+        except KeyError:
+            pass
+        _, node_distances, _ = _decode_node(self._buffer, self._offsets[node_name])
+        self._nodes[node_name] = node_distances
+        return node_distances
+
+    def __getitem__(self, key: str) -> Union[int, Optional[NodeDistances]]:
+        if key == core.DICT_PARAM_MINIMUM_DEPTH:
+            return self.minimum_depth
+        if key == core.DICT_PARAM_TAG_PER_GNODE:
+            return self.max_tag_per_gnode
+        return self.node_distances(key)
+
+    def __contains__(self, key) -> bool:
+        return key in _PARAM_KEYS or key in self._offsets
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+
+def _node_items(distances: core.DISTANCES_DICT_FORMAT):
+    for node_name, node_distances in distances.items():
+        if node_name in _PARAM_KEYS:
+            continue
+        yield node_name, node_distances
+
+
+def _gnode_size_array(node_name: str, gnode_size: int, pairs_distances) -> list:
+    if isinstance(pairs_distances, GNodePairDistances):
+        return pairs_distances.as_list()
+    by_start = {pair.left.start: dist for pair, dist in pairs_distances.items()}
+    assert set(by_start) == set(range(len(by_start))), (
+        "The distances of a node must cover all the gnode starts. "
+        "node_name={} gnode_size={}".format(node_name, gnode_size)
+    )
+    return [by_start[start] for start in range(len(by_start))]
+
+
+def _encode_node(node_name: str, node_distances, offset: int) -> bytes:
+    """ Encode a node's record that starts at `offset` in the file (the float arrays are aligned). """
+    name = node_name.encode("utf-8")
+    chunks = [_NAME_LEN.pack(len(name)), name]
+
+    if node_distances is None:
+        chunks.append(_N_SIZES.pack(_NONE_NODE))
+        return b"".join(chunks)
+
+    arrays = [
+        (gnode_size, _gnode_size_array(node_name, gnode_size, node_distances[gnode_size]))
+        for gnode_size in sorted(node_distances)
+    ]
+    chunks.append(_N_SIZES.pack(len(arrays)))
+    chunks.extend(_SIZE_ENTRY.pack(gnode_size, len(array)) for gnode_size, array in arrays)
+    chunks.append(b"\x00" * _padding(offset + sum(len(c) for c in chunks)))
+    chunks.extend(struct.pack("<{}d".format(len(array)), *array) for _, array in arrays)
+    return b"".join(chunks)
+
+
+def _encode_index_entry(node_name: str, record_offset: int) -> bytes:
+    name = node_name.encode("utf-8")
+    return _NAME_LEN.pack(len(name)) + name + _INDEX_OFFSET.pack(record_offset)
+
+
+def dump(
+    filepath: pathlib.Path,
+    distances: core.DISTANCES_DICT_FORMAT,
+    minimum_depth: int,
+    max_tag_per_gnode: int,
+) -> None:
+    """ Write the distances in the binary format (atomically: the file is replaced only when complete). """
+    nodes = list(_node_items(distances))
+    tmp_filepath = filepath.with_name(filepath.name + ".tmp")
+    with tmp_filepath.open("wb") as f:
+        # the index offset is only known at the end, the header is rewritten then
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, minimum_depth, max_tag_per_gnode, len(nodes), 0))
+        offset = _HEADER.size
+        index = []
+        for node_name, node_distances in nodes:
+            record = _encode_node(node_name, node_distances, offset)
+            index.append(_encode_index_entry(node_name, offset))
+            f.write(record)
+            offset += len(record)
+        f.write(b"".join(index))
+        f.seek(0)
+        f.write(
+            _HEADER.pack(
+                MAGIC, FORMAT_VERSION, minimum_depth, max_tag_per_gnode, len(nodes), offset
+            )
+        )
+    os.replace(str(tmp_filepath), str(filepath))
+
+
+def _decode_name(buffer, offset: int):
+    """
+    Returns:
+        (name, offset after the name)
+    """
+    (name_len,) = _NAME_LEN.unpack_from(buffer, offset)
+    offset += _NAME_LEN.size
+    return bytes(buffer[offset : offset + name_len]).decode("utf-8"), offset + name_len
+
+
+def _skip_node(buffer, offset: int):
+    """
+    Returns:
+        (node_name, offset of the next node) without decoding the distances
+    """
+    node_name, offset = _decode_name(buffer, offset)
+    (n_sizes,) = _N_SIZES.unpack_from(buffer, offset)
+    offset += _N_SIZES.size
+    if n_sizes == _NONE_NODE:
+        return node_name, offset
+    n_floats = 0
+    for _ in range(n_sizes):
+        n_floats += _SIZE_ENTRY.unpack_from(buffer, offset)[1]
+        offset += _SIZE_ENTRY.size
+    offset += _padding(offset)
+    return node_name, offset + n_floats * _FLOAT.size
+
+
+def _decode_node(buffer, offset: int):
+    """
+    Returns:
+        (node_name, node_distances, offset of the next node)
+    """
+    node_name, offset = _decode_name(buffer, offset)
+    (n_sizes,) = _N_SIZES.unpack_from(buffer, offset)
+    offset += _N_SIZES.size
+
+    if n_sizes == _NONE_NODE:
+        return node_name, None, offset
+
+    entries = []
+    for _ in range(n_sizes):
+        entries.append(_SIZE_ENTRY.unpack_from(buffer, offset))
+        offset += _SIZE_ENTRY.size
+    offset += _padding(offset)
+
+    sizes = {}
+    for gnode_size, count in entries:
+        values = _float_array(buffer, offset, count)
+        sizes[gnode_size] = GNodePairDistances(node_name, gnode_size, values)
+        offset += count * _FLOAT.size
+    return node_name, NodeDistances(node_name, sizes), offset
+
+
+def read_header(buffer) -> tuple:
+    """
+    Returns:
+        (version, minimum_depth, max_tag_per_gnode, n_nodes, index_offset)
+        The `index_offset` is None in the version 1 (no index).
+    """
+    if len(buffer) < _MAGIC_AND_VERSION.size:
+        raise DistancesFormatError("File too short to be a distances file.")
+    magic, version = _MAGIC_AND_VERSION.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise DistancesFormatError("Not a distances file (bad magic number).")
+    if version not in SUPPORTED_FORMAT_VERSIONS:
+        raise DistancesFormatError("Unsupported distances format version `{}`.".format(version))
+    header = _HEADERS[version]
+    if len(buffer) < header.size:
+        raise DistancesFormatError("File too short to be a distances file.")
+    fields = header.unpack_from(buffer, 0)[1:]
+    return fields if version > 1 else fields + (None,)
+
+
+def _read_offsets(buffer, version: int, n_nodes: int, index_offset: Optional[int]) -> Dict[str, int]:
+    offsets = {}
+    if index_offset is None:
+        # version 1: no index, the records have to be scanned (but not decoded)
+        offset = _HEADERS[version].size
+        for _ in range(n_nodes):
+            node_name, next_offset = _skip_node(buffer, offset)
+            offsets[node_name] = offset
+            offset = next_offset
+        return offsets
+
+    offset = index_offset
+    for _ in range(n_nodes):
+        node_name, offset = _decode_name(buffer, offset)
+        (offsets[node_name],) = _INDEX_OFFSET.unpack_from(buffer, offset)
+        offset += _INDEX_OFFSET.size
+    return offsets
+
+
+def load(filepath: pathlib.Path) -> PrecomputedDistances:
+    """ Memory-map a distances file, the distances are read from the disk only when accessed. """
+    with filepath.open("rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    version, minimum_depth, max_tag_per_gnode, n_nodes, index_offset = read_header(buffer)
+    offsets = _read_offsets(buffer, version, n_nodes, index_offset)
+    return PrecomputedDistances(minimum_depth, max_tag_per_gnode, offsets, buffer)
@@ -0,0 +1,345 @@
+"""
+Module dependencies:
+    all - {files_management} -> downloader
+
+Bulk download of the raw htmls with asyncio.
+
+The requests are made with `http.client` in a pool of threads, each host has a pool of keep-alive connections
+ (re-used by its following requests), and the number of concurrent requests is limited per host and overall.
+The request to each host of a redirection holds a slot of that host.
+The timeout and the retries are the ones of `prepostprocessing.download_raw` (10 attempts, waiting
+ 2^attempt seconds (at most 10) between them, 10 seconds of timeout), except that only the server errors (5xx
+ statuses), 408 and 429, and the network errors (connections, timeouts) are retried, the others would happen
+ again.
+
+The pages are written through `PageMeta` (html store and metadata) like `prepostprocessing.download_raw`, the
+ metadata changes are written in batches (see `files_management.MetasBatch`).
+
+Refresh: the validators of the responses (ETag and Last-Modified headers) are kept in the pages' metadata, a
+ refresh makes conditional requests with them, so the pages that didn't change are not downloaded again
+ (304 Not Modified). A page downloaded again with the same content keeps its raw html's hash, so its results
+ stay up-to-date (see `pipeline`).
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import http.client
+import logging
+import sys
+import threading
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+import files_management as fm
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(levelname)s [%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s",
+)
+
+MAX_CONNECTIONS = 32
+MAX_CONNECTIONS_PER_HOST = 4
+TIMEOUT_S = 10
+MAX_ATTEMPTS = 10
+WAIT_MULTIPLIER_S = 1
+WAIT_MAX_S = 10
+MAX_REDIRECTS = 5
+
+# the one of `urllib.request.urlopen`, used until now
+USER_AGENT = "Python-urllib/{}.{}".format(*sys.version_info[:2])
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# the client errors that may not happen again
+RETRYABLE_CLIENT_ERRORS = (408, 429)
+# the network's and the servers' failures (connection errors, timeouts, malformed responses...)
+RETRYABLE_ERRORS = (OSError, http.client.HTTPException, asyncio.TimeoutError)
+
+# outcomes of a page's download
+DOWNLOADED = "downloaded"
+UNCHANGED = "unchanged"  # downloaded again, but the content is the same
+NOT_MODIFIED = "not-modified"  # not downloaded again, the server says it didn't change
+SKIPPED = "skipped"
+FAILED = "failed"
+
+Response = collections.namedtuple("Response", ["url", "status", "headers", "body"])
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, url: str, status: int):
+        super().__init__("HTTP status {} for `{}`.".format(status, url))
+        self.url = url
+        self.status = status
+
+
+class DownloadError(Exception):
+    """ The download failed, after `n_attempts` attempts. """
+
+    def __init__(self, url: str, n_attempts: int):
+        super().__init__("Failed to download `{}` ({} attempts).".format(url, n_attempts))
+        self.url = url
+        self.n_attempts = n_attempts
+
+
+def _origin(url: str) -> Tuple[str, str]:
+    """ (scheme, host[:port]) """
+    parts = urllib.parse.urlsplit(url)
+    return parts.scheme, parts.netloc.rpartition("@")[2]
+
+
+def conditional_headers(page_meta: fm.PageMeta) -> Dict[str, str]:
+    """ The headers of a request only answered with the document if it changed since it was downloaded. """
+    headers = {}
+    if page_meta.etag is not None:
+        headers["If-None-Match"] = page_meta.etag
+    if page_meta.last_modified is not None:
+        headers["If-Modified-Since"] = page_meta.last_modified
+    return headers
+
+
+def response_validators(headers) -> Dict[str, Optional[str]]:
+    """ As keyword arguments of `PageMeta.persist_raw_html`. """
+    return {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified")}
+
+
+def _redirect_url(response: Response) -> Optional[str]:
+    """ The url the response redirects to, None if it's not a redirection. """
+    if response.status in REDIRECT_STATUSES and "Location" in response.headers:
+        return urllib.parse.urljoin(response.url, response.headers["Location"])
+    return None
+
+
+def _is_retryable(ex: Exception) -> bool:
+    """
+    The server errors (5xx statuses), `RETRYABLE_CLIENT_ERRORS` and `RETRYABLE_ERRORS` (but an invalid url).
+    The other statuses are not retried (e.g. the 3xx status of too many redirections), nor the other errors
+     (e.g. an unsupported scheme), they would happen again.
+    """
+    if isinstance(ex, HTTPStatusError):
+        return ex.status >= 500 or ex.status in RETRYABLE_CLIENT_ERRORS
+    return isinstance(ex, RETRYABLE_ERRORS) and not isinstance(ex, http.client.InvalidURL)
+
+
+class Downloader(object):
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+        timeout_s: float = TIMEOUT_S,
+        max_attempts: int = MAX_ATTEMPTS,
+        wait_multiplier_s: float = WAIT_MULTIPLIER_S,
+        wait_max_s: float = WAIT_MAX_S,
+    ):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout_s = timeout_s
+        self.max_attempts = max_attempts
+        self.wait_multiplier_s = wait_multiplier_s
+        self.wait_max_s = wait_max_s
+
+        self._lock = threading.Lock()
+        self._idle_connections = collections.defaultdict(list)  # origin -> connections
+        # only set while running (they belong to the event loop)
+        self._executor = None
+        self._semaphore = None
+        self._hosts_semaphores = None
+
+    # --- blocking part, run in the executor's threads
+
+    def _acquire_connection(
+        self, origin: Tuple[str, str]
+    ) -> Tuple[http.client.HTTPConnection, bool]:
+        """ An idle connection to the origin if there is one, else a new one. (connection, is_reused) """
+        with self._lock:
+            idle_connections = self._idle_connections[origin]
+            if idle_connections:
+                return idle_connections.pop(), True
+        scheme, host = origin
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, timeout=self.timeout_s), False
+        elif scheme == "http":
+            return http.client.HTTPConnection(host, timeout=self.timeout_s), False
+        raise ValueError("Unsupported scheme `{}`.".format(scheme))
+
+    def _release_connection(
+        self, origin: Tuple[str, str], connection: http.client.HTTPConnection
+    ) -> None:
+        with self._lock:
+            idle_connections = self._idle_connections[origin]
+            if len(idle_connections) < self.max_connections_per_host:
+                idle_connections.append(connection)
+                return
+        connection.close()
+
+    def close(self) -> None:
+        """ Close the idle connections. """
+        with self._lock:
+            for connections in self._idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self._idle_connections.clear()
+
+    def _request(self, url: str, headers: Dict[str, str]) -> Response:
+        origin = _origin(url)
+        parts = urllib.parse.urlsplit(url)
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        connection, is_reused = self._acquire_connection(origin)
+        try:
+            connection.request("GET", target, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (ConnectionError, http.client.BadStatusLine):
+            connection.close()
+            if not is_reused:
+                raise
+            # the server closed the idle connection in the meantime, it's not a failed attempt
+            return self._request(url, headers)
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release_connection(origin, connection)
+        return Response(url, response.status, response.headers, body)
+
+    def _get_one(self, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        """ A single request, not following a redirection. Raises `HTTPStatusError` for error statuses. """
+        response = self._request(url, dict({"User-Agent": USER_AGENT}, **(headers or {})))
+        if response.status >= 400:
+            raise HTTPStatusError(url, response.status)
+        return response
+
+    def get(self, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        """ A single attempt, following the redirections. Raises `HTTPStatusError` for error statuses. """
+        for _ in range(MAX_REDIRECTS + 1):
+            response = self._get_one(url, headers)
+            url = _redirect_url(response)
+            if url is None:
+                return response
+        raise HTTPStatusError(response.url, response.status)
+
+    # --- asynchronous part, run in the event loop's thread
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        origin = _origin(url)
+        if origin not in self._hosts_semaphores:
+            self._hosts_semaphores[origin] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._hosts_semaphores[origin]
+
+    def _wait_s(self, attempt: int) -> float:
+        """ Like `retrying`'s exponential wait. """
+        return min(self.wait_multiplier_s * 2 ** attempt, self.wait_max_s)
+
+    async def _fetch_once(self, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        """ Like `get`, each request holds a slot of its own host. """
+        loop = asyncio.get_event_loop()
+        for _ in range(MAX_REDIRECTS + 1):
+            async with self._semaphore, self._host_semaphore(url):
+                response = await loop.run_in_executor(self._executor, self._get_one, url, headers)
+            url = _redirect_url(response)
+            if url is None:
+                return response
+        raise HTTPStatusError(response.url, response.status)
+
+    async def fetch(self, url: str, headers: Optional[Dict[str, str]] = None) -> Response:
+        """ `get` with retries, raises `DownloadError` when they are exhausted. """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # the slots are not kept while waiting before a retry
+                return await self._fetch_once(url, headers)
+            except Exception as ex:
+                if attempt >= self.max_attempts or not _is_retryable(ex):
+                    raise DownloadError(url, attempt) from ex
+                wait_s = self._wait_s(attempt)
+                logging.info(
+                    "Attempt %d failed, retrying in %.1fs. url=%s ex=%r", attempt, wait_s, url, ex
+                )
+                await asyncio.sleep(wait_s)
+
+    async def download(
+        self, page_meta: fm.PageMeta, force_override: bool = False, refresh: bool = False
+    ) -> str:
+        """
+        Download the raw html of a page.
+
+        Args:
+            force_override: download it again if it has already been downloaded
+            refresh: download it again only if it changed (if the validators are known, else like
+             `force_override`)
+        Returns:
+            the outcome, e.g. `DOWNLOADED`
+        """
+        has_raw_html = page_meta.has_raw_html
+        if has_raw_html and not (force_override or refresh):
+            logging.info(
+                "Raw page has already been downloaded, skipped. page_id=%s", page_meta.page_id
+            )
+            return SKIPPED
+
+        logging.info("Requesting the page...  page_id=%s", page_meta.page_id)
+        headers = conditional_headers(page_meta) if has_raw_html and not force_override else {}
+        try:
+            response = await self.fetch(page_meta.url, headers)
+        except DownloadError as ex:
+            logging.warning(
+                "Failed download the page. page_id=%s ex=%s cause=%r",
+                page_meta.page_id,
+                ex,
+                ex.__cause__,
+            )
+            return FAILED
+
+        if response.status == http.client.NOT_MODIFIED:
+            logging.info("Not modified. page_id=%s", page_meta.page_id)
+            return NOT_MODIFIED
+
+        now = datetime.datetime.now()
+        loop = asyncio.get_event_loop()
+        # compressing is not for the event loop's thread
+        sha256 = await loop.run_in_executor(self._executor, fm.htmls_store.put, response.body)
+        previous_sha256 = page_meta.raw_html_sha256 if has_raw_html else None
+        # in the event loop's thread, where the metadata batch is
+        page_meta.persist_raw_html_sha256(
+            sha256, download_datetime=now, **response_validators(response.headers)
+        )
+        logging.info("Done. page_id=%s", page_meta.page_id)
+        return UNCHANGED if sha256 == previous_sha256 else DOWNLOADED
+
+    async def _download_all(
+        self, pages_metas: List[fm.PageMeta], force_override: bool, refresh: bool
+    ) -> Dict[str, str]:
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+        self._hosts_semaphores = {}
+        outcomes = await asyncio.gather(
+            *[self.download(page_meta, force_override, refresh) for page_meta in pages_metas]
+        )
+        return {page_meta.page_id: outcome for page_meta, outcome in zip(pages_metas, outcomes)}
+
+    def download_all(
+        self,
+        pages_metas: List[fm.PageMeta],
+        force_override: bool = False,
+        refresh: bool = False,
+        metas_flush_every: Optional[int] = None,
+    ) -> Dict[str, str]:
+        """ Blocks until all the pages are done (see `download`). Returns the outcomes by page_id. """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.max_connections)
+        try:
+            with fm.MetasBatch(flush_every=metas_flush_every):
+                outcomes = loop.run_until_complete(
+                    self._download_all(pages_metas, force_override, refresh)
+                )
+        finally:
+            self._executor.shutdown()
+            self._executor, self._semaphore, self._hosts_semaphores = None, None, None
+            self.close()
+            asyncio.set_event_loop(None)
+            loop.close()
+        logging.info("Downloads: %s", dict(collections.Counter(outcomes.values())))
+        return outcomes
@@ -0,0 +1,300 @@
+"""
+Module dependencies:
+    all - {files_management, page_bundle} -> evaluation
+
+Evaluation of grids of thresholds against the labeled number of data records of the pages
+ (`PageMeta.n_data_records`).
+
+The number of data records found by each (page, thresholds, max_tags_per_gnode) is collected in a single pass
+ in columns (`RecordCounts`, NumPy arrays), from the bundles' listings (their `n_records` column) without
+ loading the data records themselves, which is only done for the artifacts that don't have it and for the
+ legacy pickles.
+They are then put in a table of pages x parameters (`Grid`), from which the errors, their statistics by
+ parameters (`score`) and the best parameters of each page (`best_per_page`) and of the corpus
+ (`rank_parameters`) are computed all at once.
+
+The label of a page without `n_data_records` is the number of objects of its url in
+ `rsrc/original-websites-stats.csv` (the websites of [1], with the number of data records found by MDR in [1]),
+ if it is there.
+
+Usage:
+    python evaluation.py [--max-tags-per-gnode 10] [--margin 5] [--top 10] [--pages]
+"""
+
+import argparse
+import collections
+import csv
+import pathlib
+import pickle
+import re
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+import files_management as fm
+import page_bundle
+
+REFERENCE_COUNTS_CSV = (
+    pathlib.Path(__file__).parent.parent.joinpath("rsrc", "original-websites-stats.csv").absolute()
+)
+
+MARGIN = 5
+
+# the columns of the parameters of the data records, in `Grid.parameters`
+PARAMETERS = ("data_region", "find_records_1", "find_records_n", "max_tags_per_gnode")
+
+_LEGACY_DATA_RECORDS_RE = re.compile(
+    r"data_records\(dr-th=([0-9.]+),r1-th=([0-9.]+),rn-th=([0-9.]+),max_tags=([0-9]+)\)\.pkl$"
+)
+
+ReferenceCount = collections.namedtuple("ReferenceCount", ["n_objects", "n_mdr"])
+
+# one row per (page, parameters), `page_index` refers to `pages_ids` and `labels` (NaN if unknown)
+RecordCounts = collections.namedtuple(
+    "RecordCounts",
+    [
+        "pages_ids",
+        "labels",
+        "page_index",
+        "data_region",
+        "find_records_1",
+        "find_records_n",
+        "max_tags_per_gnode",
+        "n_records",
+    ],
+)
+
+# `n_records` is (n_pages, n_parameters), NaN where a page was not run with some parameters
+Grid = collections.namedtuple("Grid", ["pages_ids", "labels", "parameters", "n_records"])
+
+# statistics of the errors (n_records - label) of each parameters, over the labeled pages run with them
+Scores = collections.namedtuple(
+    "Scores",
+    ["n_pages", "mean_absolute_error", "root_mean_squared_error", "bias", "exact", "within"],
+)
+
+BestParameters = collections.namedtuple("BestParameters", ["parameters_index", "error"])
+
+
+def _normalized_url(url: str) -> str:
+    return url.strip().rstrip("/").lower()
+
+
+def load_reference_counts(path: pathlib.Path = REFERENCE_COUNTS_CSV) -> Dict[str, ReferenceCount]:
+    """ By (normalized) url. """
+    counts = {}
+    with pathlib.Path(path).open(newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        next(reader)  # header
+        for row in reader:
+            if len(row) < 4:
+                continue
+            _, url, n_objects, n_mdr = row[:4]
+            counts[_normalized_url(url)] = ReferenceCount(int(n_objects), int(n_mdr))
+    return counts
+
+
+def page_label(
+    page_meta: fm.PageMeta, reference_counts: Optional[Dict[str, ReferenceCount]] = None
+) -> Optional[int]:
+    if page_meta.n_data_records is not None:
+        return page_meta.n_data_records
+    reference = (reference_counts or {}).get(_normalized_url(page_meta.url))
+    return reference.n_objects if reference is not None else None
+
+
+def _page_record_counts(page_meta: fm.PageMeta) -> Dict[tuple, int]:
+    """ Number of data records by (data_region, find_records_1, find_records_n, max_tags_per_gnode). """
+    counts = {}
+    for artifact in page_meta.bundle.list(fm.BUNDLE_DATA_RECORDS):
+        params = artifact.params
+        key = (
+            round(params["data_region"], page_bundle.PARAMS_FLOAT_DECIMALS),
+            round(params["find_records_1"], page_bundle.PARAMS_FLOAT_DECIMALS),
+            round(params["find_records_n"], page_bundle.PARAMS_FLOAT_DECIMALS),
+            params["max_tags_per_gnode"],
+        )
+        n_records = artifact.n_records
+        if n_records is None:
+            n_records = len(pickle.loads(page_meta.bundle.get(fm.BUNDLE_DATA_RECORDS, params)))
+        counts[key] = n_records
+
+    for path in fm.results_dir.glob(page_meta.prefix + "data_records(*).pkl"):
+        match = _LEGACY_DATA_RECORDS_RE.search(path.name)
+        if match is None:
+            continue
+        key = tuple(float(group) for group in match.groups()[:3]) + (int(match.group(4)),)
+        if key not in counts:
+            with path.open(mode="rb") as f:
+                counts[key] = len(pickle.load(f))
+    return counts
+
+
+def collect_record_counts(
+    pages_metas: Iterable[fm.PageMeta],
+    max_tags_per_gnode: Optional[int] = None,
+    reference_counts: Optional[Dict[str, ReferenceCount]] = None,
+) -> RecordCounts:
+    """ The numbers of data records found for all the parameters each page was run with (optionally, only one
+     `max_tags_per_gnode`). """
+    pages_ids, labels = [], []
+    columns = collections.defaultdict(list)
+    for page_meta in pages_metas:
+        page_counts = _page_record_counts(page_meta)
+        label = page_label(page_meta, reference_counts)
+        labels.append(np.nan if label is None else label)
+        for (dr, r1, rn, max_tags), n_records in page_counts.items():
+            if max_tags_per_gnode is not None and max_tags != max_tags_per_gnode:
+                continue
+            columns["page_index"].append(len(pages_ids))
+            columns["data_region"].append(dr)
+            columns["find_records_1"].append(r1)
+            columns["find_records_n"].append(rn)
+            columns["max_tags_per_gnode"].append(max_tags)
+            columns["n_records"].append(n_records)
+        pages_ids.append(page_meta.page_id)
+
+    return RecordCounts(
+        pages_ids,
+        np.array(labels, dtype=float),
+        np.array(columns["page_index"], dtype=int),
+        np.array(columns["data_region"], dtype=float),
+        np.array(columns["find_records_1"], dtype=float),
+        np.array(columns["find_records_n"], dtype=float),
+        np.array(columns["max_tags_per_gnode"], dtype=int),
+        np.array(columns["n_records"], dtype=int),
+    )
+
+
+def make_grid(counts: RecordCounts) -> Grid:
+    """ The parameters (rows of `Grid.parameters`, see `PARAMETERS`) are sorted. """
+    parameters = np.column_stack(
+        [
+            counts.data_region,
+            counts.find_records_1,
+            counts.find_records_n,
+            counts.max_tags_per_gnode.astype(float),
+        ]
+    ).reshape(-1, len(PARAMETERS))
+    parameters, parameters_index = np.unique(parameters, axis=0, return_inverse=True)
+    n_records = np.full((len(counts.pages_ids), len(parameters)), np.nan)
+    n_records[counts.page_index, parameters_index.reshape(-1)] = counts.n_records
+    return Grid(counts.pages_ids, counts.labels, parameters, n_records)
+
+
+def errors(grid: Grid) -> np.ndarray:
+    """ n_records - label, NaN where either is unknown. """
+    return grid.n_records - grid.labels[:, np.newaxis]
+
+
+def score(grid: Grid, margin: int = MARGIN) -> Scores:
+    """ The arrays are aligned with the parameters, their statistics are NaN if no labeled page was run with
+     them. """
+    errors_ = errors(grid)
+    is_known = ~np.isnan(errors_)
+    errors_ = np.where(is_known, errors_, 0)
+    n_pages = is_known.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        denominator = np.where(n_pages > 0, n_pages, np.nan)
+        absolute_errors = np.abs(errors_)
+        return Scores(
+            n_pages,
+            absolute_errors.sum(axis=0) / denominator,
+            np.sqrt((errors_ ** 2).sum(axis=0) / denominator),
+            errors_.sum(axis=0) / denominator,
+            (is_known & (errors_ == 0)).sum(axis=0) / denominator,
+            (is_known & (absolute_errors <= margin)).sum(axis=0) / denominator,
+        )
+
+
+def rank_parameters(scores: Scores) -> np.ndarray:
+    """ Indexes of the parameters, best first: the ones run on the most labeled pages, then by mean absolute
+     error. """
+    mean_absolute_error = np.where(
+        np.isnan(scores.mean_absolute_error), np.inf, scores.mean_absolute_error
+    )
+    return np.lexsort((mean_absolute_error, -scores.n_pages))
+
+
+def best_per_page(grid: Grid) -> BestParameters:
+    """ The parameters with the smallest absolute error of each page (the first ones if tied), -1 (and a NaN
+     error) for the pages that are not labeled or not run. """
+    absolute_errors = np.abs(errors(grid))
+    absolute_errors = np.where(np.isnan(absolute_errors), np.inf, absolute_errors)
+    if absolute_errors.shape[1] == 0:
+        n_pages = absolute_errors.shape[0]
+        return BestParameters(np.full(n_pages, -1, dtype=int), np.full(n_pages, np.nan))
+    parameters_index = np.argmin(absolute_errors, axis=1)
+    pages_index = np.arange(len(parameters_index))
+    is_found = np.isfinite(absolute_errors[pages_index, parameters_index])
+    return BestParameters(
+        np.where(is_found, parameters_index, -1),
+        np.where(is_found, errors(grid)[pages_index, parameters_index], np.nan),
+    )
+
+
+def format_parameters(parameters: np.ndarray) -> str:
+    return "dr-th={:.2f} r1-th={:.2f} rn-th={:.2f} max_tags={:d}".format(
+        parameters[0], parameters[1], parameters[2], int(parameters[3])
+    )
+
+
+def main(max_tags_per_gnode: Optional[int], margin: int, top: int, show_pages: bool) -> None:
+    pages_metas = list(fm.PageMeta.get_all().values())
+    counts = collect_record_counts(pages_metas, max_tags_per_gnode, load_reference_counts())
+    grid = make_grid(counts)
+    print(
+        "{} pages ({} labeled), {} parameters, {} runs.".format(
+            len(grid.pages_ids),
+            int((~np.isnan(grid.labels)).sum()),
+            len(grid.parameters),
+            len(counts.n_records),
+        )
+    )
+
+    scores = score(grid, margin)
+    ranking = rank_parameters(scores)
+    print("Best parameters of the corpus:")
+    for index in ranking[:top]:
+        print(
+            "    {}  n_pages={:d} mae={:.2f} rmse={:.2f} bias={:+.2f} "
+            "exact={:.0%} within-{}={:.0%}".format(
+                format_parameters(grid.parameters[index]),
+                scores.n_pages[index],
+                scores.mean_absolute_error[index],
+                scores.root_mean_squared_error[index],
+                scores.bias[index],
+                scores.exact[index],
+                margin,
+                scores.within[index],
+            )
+        )
+
+    if show_pages:
+        best = best_per_page(grid)
+        print("Best parameters of each page:")
+        for page_id, parameters_index, error in zip(
+            grid.pages_ids, best.parameters_index, best.error
+        ):
+            if parameters_index < 0:
+                print("    {}  -".format(page_id))
+            else:
+                print(
+                    "    {}  {}  error={:+d}".format(
+                        page_id, format_parameters(grid.parameters[parameters_index]), int(error)
+                    )
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate the thresholds against the labeled number of data records."
+    )
+    parser.add_argument("--max-tags-per-gnode", type=int, default=None, help="default: all")
+    parser.add_argument("--margin", type=int, default=MARGIN, help="of the `within` score")
+    parser.add_argument("--top", type=int, default=10, help="number of best parameters shown")
+    parser.add_argument(
+        "--pages", action="store_true", help="show the best parameters of each page"
+    )
+    args = parser.parse_args()
+    main(args.max_tags_per_gnode, args.margin, args.top, args.pages)
@@ -1,23 +1,35 @@
 """
 Module dependencies:
-    all - {utils, core} -> files_management
+    all - {utils, core, artifacts_manager, distances_store, html_store, metadata_store, page_bundle} -> files_management
+
+Importing it reads nothing and creates nothing: the configuration is read, the outputs directory is created and
+ the stores are opened when their attributes (e.g. `metas_store`, `raw_htmls_dir`) are first used.
 """
 
+import collections
+import copy
 import datetime
 import functools
 import hashlib
+import json
 import logging
 import pathlib
 import pickle
-from typing import Dict, Optional, Union, List
+import sys
+import threading
+import types
+from typing import BinaryIO, Callable, Dict, Hashable, Iterable, Optional, Union, List
 
 import lxml
 import lxml.etree
 import lxml.html
-import yaml
-from oslo_concurrency import lockutils
 
+import artifacts_manager
 import core
+import distances_store
+import html_store
+import metadata_store
+import page_bundle
 import utils
 
 logging.basicConfig(
@@ -26,21 +38,174 @@ logging.basicConfig(
 )
 
 
+# size of the chunks fed to the html parser, the first one is also used to sniff the encoding
+HTML_READ_CHUNK_SIZE = 64 * 1024
+
+_CHARSET_SNIFF_SIZE = 1024
+_BOMS = (b"\xef\xbb\xbf", b"\xff\xfe", b"\xfe\xff")
+
+
+def _declared_encoding(head: bytes) -> bool:
+    """ True if the beginning of an html file has a BOM or declares its charset (e.g. <meta charset=...>). """
+    return head.startswith(_BOMS) or b"charset" in head[:_CHARSET_SNIFF_SIZE].lower()
+
+
+def parse_html(file: BinaryIO, remove_stuff: bool = False) -> lxml.html.HtmlElement:
+    """
+    Parse an html document in a single pass from a binary file object (read by chunks).
+    The encoding is detected by lxml if the document declares it, otherwise it is assumed to be utf-8
+     (the files written by `PageMeta.persist_html` and the html store don't declare it).
+
+    Args:
+        file: opened in binary mode
+        remove_stuff: remove comments, processing instructions and blank text
+    Returns:
+        root of the html document
+    """
+    head = file.read(HTML_READ_CHUNK_SIZE)
+    parser = lxml.html.HTMLParser(
+        encoding=None if _declared_encoding(head) else "utf-8",
+        remove_comments=remove_stuff,
+        remove_pis=remove_stuff,
+        remove_blank_text=remove_stuff,
+    )
+    chunk = head
+    while chunk:
+        parser.feed(chunk)
+        chunk = file.read(HTML_READ_CHUNK_SIZE)
+    return parser.close()
+
+
+CleanedHtml = collections.namedtuple("CleanedHtml", ["root", "node_names"])
+
+
+def clean_html(file: BinaryIO, dropped_tags: Iterable[str]) -> CleanedHtml:
+    """
+    Parse an html document like `parse_html(file, remove_stuff=True)` and drop the elements of the given tags
+     (with their tail text, like `lxml.etree.strip_elements`) while parsing.
+    An element is dropped once the parser has gone past its tail text (i.e. at the next element's event), so the
+     result does not depend on where the chunks end, and the sidecar of the node names (see
+     `core.NodeNamer.sidecar`) is built from the same events instead of walking the cleaned tree again.
+
+    Args:
+        file: opened in binary mode
+    Returns:
+        root of the cleaned html document and the sidecar of its node names
+    """
+    head = file.read(HTML_READ_CHUNK_SIZE)
+    parser = lxml.etree.HTMLPullParser(
+        events=("start", "end"),
+        encoding=None if _declared_encoding(head) else "utf-8",
+        remove_comments=True,
+        remove_pis=True,
+        remove_blank_text=True,
+    )
+    dropped_tags = frozenset(dropped_tags)
+    node_namer = core.NodeNamer()
+    dropped_depth = 0  # > 0 inside a dropped element
+    ended = None  # the last dropped element, its tail text may still be to come
+
+    def drop_ended() -> None:
+        nonlocal ended
+        if ended is not None and ended.getparent() is not None:
+            ended.getparent().remove(ended)
+        ended = None
+
+    def read_events() -> None:
+        nonlocal dropped_depth, ended
+        for event, element in parser.read_events():
+            drop_ended()
+            if event == "start":
+                if dropped_depth or element.tag in dropped_tags:
+                    dropped_depth += 1
+                else:
+                    node_namer.add_node(element.tag)
+            elif dropped_depth:
+                dropped_depth -= 1
+                if not dropped_depth:
+                    ended = element
+
+    chunk = head
+    while chunk:
+        parser.feed(chunk)
+        read_events()
+        chunk = file.read(HTML_READ_CHUNK_SIZE)
+    root = parser.close()
+    read_events()
+    drop_ended()
+    return CleanedHtml(root, node_namer.sidecar)
+
+
 def open_html_document(filepath: pathlib.Path, remove_stuff: bool) -> lxml.html.HtmlElement:
     """
     Returns:
         root of the html file
     """
-    with filepath.open("r") as file:
-        html_document = lxml.html.fromstring(
-            html=lxml.etree.tostring(lxml.html.parse(file), method="html"),
-            parser=lxml.etree.HTMLParser(
-                remove_comments=remove_stuff,
-                remove_pis=remove_stuff,
-                remove_blank_text=remove_stuff,
-            ),
-        )
-    return html_document
+    with filepath.open("rb") as file:
+        return parse_html(file, remove_stuff)
+
+
+class ParsedTreesCache(object):
+    """
+        Least recently used cache of parsed html trees, bounded by an estimation of their memory usage.
+        The cached trees are never handed out, only deep copies of them (copying is faster than parsing).
+        The keys must change when the file changes (e.g. include its modification time).
+    """
+
+    # rough ratio between the memory used by an lxml tree and the size of the html file it was parsed from
+    MEMORY_PER_FILE_BYTE = 8
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._trees = collections.OrderedDict()  # key -> (root, n_bytes)
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._trees)
+
+    @property
+    def n_bytes(self) -> int:
+        return self._n_bytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._trees.clear()
+            self._n_bytes = 0
+
+    def get(
+        self, key: Hashable, parse: Callable[[], lxml.html.HtmlElement], file_size: int
+    ) -> lxml.html.HtmlElement:
+        """ A copy of the tree cached under `key`, parsed (and cached) with `parse()` if it is missing. """
+        with self._lock:
+            entry = self._trees.get(key)
+            if entry is not None:
+                self._trees.move_to_end(key)
+                return copy.deepcopy(entry[0])
+
+        root = parse()
+        n_bytes = file_size * self.MEMORY_PER_FILE_BYTE
+        if n_bytes > self.max_bytes:
+            return root
+
+        with self._lock:
+            if key not in self._trees:
+                self._trees[key] = (root, n_bytes)
+                self._n_bytes += n_bytes
+            while self._n_bytes > self.max_bytes:
+                _, (_, evicted_n_bytes) = self._trees.popitem(last=False)
+                self._n_bytes -= evicted_n_bytes
+        return copy.deepcopy(root)
+
+
+# number of pages' memory-mapped distances kept open by a process (see `PageMeta.load_precomputed_distances`)
+LOADED_DISTANCES_CACHE_SIZE = 4
+
+
+@functools.lru_cache(maxsize=LOADED_DISTANCES_CACHE_SIZE)
+def _load_distances(filepath: pathlib.Path, file_key: tuple) -> distances_store.PrecomputedDistances:
+    """ `file_key` changes when the file is replaced, so a cached object is never out-of-date. """
+    return distances_store.load(filepath)
 
 
 def make_outputs_dir(in_dir: pathlib.Path):
@@ -53,6 +218,8 @@ def make_outputs_dir(in_dir: pathlib.Path):
     intermediate_results_dir_ = outputs_dir_.joinpath("intermediate_results").absolute()
     results_dir_ = outputs_dir_.joinpath("results").absolute()
     pages_meta_ = outputs_dir_.joinpath("pages-meta.yml").absolute()
+    pages_meta_db_ = outputs_dir_.joinpath("pages-meta.sqlite").absolute()
+    html_store_dir_ = outputs_dir_.joinpath("html_store").absolute()
 
     # create directories
     outputs_dir_.mkdir(parents=False, exist_ok=True)
@@ -60,6 +227,7 @@ def make_outputs_dir(in_dir: pathlib.Path):
     preprocessed_htmls_dir_.mkdir(parents=False, exist_ok=True)
     intermediate_results_dir_.mkdir(parents=False, exist_ok=True)
     results_dir_.mkdir(parents=False, exist_ok=True)
+    html_store_dir_.mkdir(parents=False, exist_ok=True)
 
     # create page's metadata file
     pages_meta_.touch(exist_ok=True)
@@ -73,43 +241,229 @@ def make_outputs_dir(in_dir: pathlib.Path):
         intermediate_results_dir_,
         results_dir_,
         pages_meta_,
+        pages_meta_db_,
+        html_store_dir_,
+    )
+
+
+# --- module attributes initialized on first use (see `_LAZY_ATTRIBUTES`)
+
+_OUTPUTS_DIRS_NAMES = (
+    "outputs_dir",
+    "raw_htmls_dir",
+    "preprocessed_htmls_dir",
+    "intermediate_results_dir",
+    "results_dir",
+    "pages_meta",
+    "pages_meta_db",
+    "html_store_dir",
+)
+
+
+def _outputs_dirs() -> Dict[str, pathlib.Path]:
+    outputs_parent_dir_ = utils.get_config_outputs_parent_dir()
+    logging.info("Outputs parent dir: %s", str(outputs_parent_dir_))
+    dirs = dict(zip(_OUTPUTS_DIRS_NAMES, make_outputs_dir(outputs_parent_dir_)))
+    logging.info("Outputs dir: %s", str(dirs["outputs_dir"]))
+    return dirs
+
+
+def _open_metas_store() -> metadata_store.MetadataStore:
+    """ Open the metadata database, the (legacy) YAML registry is imported when it is created. """
+    pages_meta_db_, pages_meta_ = _get("pages_meta_db"), _get("pages_meta")
+    is_new = not pages_meta_db_.exists()
+    store = metadata_store.MetadataStore(pages_meta_db_)
+    if is_new and pages_meta_.stat().st_size > 0:
+        logging.info("Importing the pages' metadata from %s", str(pages_meta_))
+        store.import_yaml(pages_meta_)
+    return store
+
+
+def export_pages_meta() -> None:
+    """ Write the pages' metadata to the versioned registry (`pages_meta`), see `metadata_store`. """
+    _get("metas_store").export_yaml(_get("pages_meta"))
+    logging.info("Exported the pages' metadata to %s", str(_get("pages_meta")))
+
+
+def _open_htmls_store() -> html_store.HtmlStore:
+    return html_store.HtmlStore(
+        _get("html_store_dir"),
+        codec=utils.get_config_dict().get("html-store-codec", html_store.DEFAULT_CODEC),
+    )
+
+
+PREPROCESSING_PROFILE_DEFAULT = "default"
+PREPROCESSING_PROFILE_PRUNED = "pruned"  # see `core.prune`
+PREPROCESSING_PROFILES = (PREPROCESSING_PROFILE_DEFAULT, PREPROCESSING_PROFILE_PRUNED)
+
+
+def _preprocessing_profile() -> str:
+    profile = utils.get_config_dict().get("preprocessing-profile", PREPROCESSING_PROFILE_DEFAULT)
+    assert profile in PREPROCESSING_PROFILES, "Unknown preprocessing profile `{}`, see {}.".format(
+        profile, PREPROCESSING_PROFILES
+    )
+    return profile
+
+
+def _htmls_kinds() -> Dict[str, str]:
+    """ The kinds of the html store's blobs that are used by the pages. """
+    metas = _get("metas_store").get_all().values()
+    kinds = {
+        meta["preprocessed_html_sha256"]: artifacts_manager.PREPROCESSED_HTML
+        for meta in metas
+        if meta["preprocessed_html_sha256"] is not None
+    }
+    # a raw html cannot be recomputed, it prevails
+    kinds.update(
+        {
+            meta["raw_html_sha256"]: artifacts_manager.RAW_HTML
+            for meta in metas
+            if meta["raw_html_sha256"] is not None
+        }
+    )
+    return kinds
+
+
+def _outputs_budget_bytes() -> Optional[int]:
+    budget_gb = utils.get_config_dict().get("outputs-disk-budget-gb")
+    return None if budget_gb is None else int(budget_gb * 2 ** 30)
+
+
+def _open_artifacts() -> artifacts_manager.ArtifactsManager:
+    return artifacts_manager.ArtifactsManager(
+        _get("outputs_dir"),
+        _outputs_budget_bytes(),
+        _get("artifacts_access"),
+        _htmls_kinds,
+        evict_raw_htmls=bool(utils.get_config_dict().get("evict-raw-htmls", False)),
     )
 
 
-outputs_parent_dir_ = utils.get_config_outputs_parent_dir()
-logging.info("Outputs parent dir: %s", str(outputs_parent_dir_))
-
-(
-    outputs_dir,
-    raw_htmls_dir,
-    preprocessed_htmls_dir,
-    intermediate_results_dir,
-    results_dir,
-    pages_meta,
-) = make_outputs_dir(outputs_parent_dir_)
-logging.info("Outputs dir: %s", str(outputs_dir))
-
-lock_file_prefix = __file__[:-3]
-synchronized = lockutils.synchronized_with_prefix(lock_file_prefix)
-prefixed_cleanup = lockutils.remove_external_lock_file_with_prefix(lock_file_prefix)
-pages_meta_lock_name = "pages_meta"
-lock_path = str(outputs_dir)
-cleanup_pages_meta_lock = functools.partial(
-    prefixed_cleanup, name=pages_meta_lock_name, lock_path=lock_path
+# name --> factory of the attributes that read the configuration or touch the outputs directory
+_LAZY_ATTRIBUTES = dict(
+    {
+        name: (lambda name_=name: _get("_outputs_dirs_by_name")[name_])
+        for name in _OUTPUTS_DIRS_NAMES
+    },
+    _outputs_dirs_by_name=_outputs_dirs,
+    metas_store=_open_metas_store,
+    htmls_store=_open_htmls_store,
+    preprocessing_profile=_preprocessing_profile,
+    artifacts_access=lambda: artifacts_manager.AccessLog(
+        _get("outputs_dir").joinpath("artifacts-access.sqlite")
+    ),
+    artifacts=_open_artifacts,
+    parsed_trees_cache=lambda: ParsedTreesCache(
+        max_bytes=int(utils.get_config_dict().get("parsed-trees-cache-mb", 256) * 2 ** 20)
+    ),
 )
+_lazy_values = {}
+_lazy_lock = threading.RLock()
 
 
-@synchronized(pages_meta_lock_name, external=True, fair=True, lock_path=lock_path)
-def _read_metas_dict() -> dict:
-    with pages_meta.open(mode="r") as f:
-        metas_dict = yaml.load(f, Loader=yaml.FullLoader) or dict()
-    return metas_dict
+def _get(name: str):
+    """
+        A lazy attribute, initialized on first use.
+        An attribute set on the module (e.g. patched by a test) prevails, so the module's functions use this
+         instead of the global name.
+    """
+    value = globals().get(name, _lazy_values)
+    if value is not _lazy_values:
+        return value
+    with _lazy_lock:
+        if name not in _lazy_values:
+            _lazy_values[name] = _LAZY_ATTRIBUTES[name]()
+        value = _lazy_values[name]
+    # the next accesses are plain attribute lookups
+    globals().setdefault(name, value)
+    return value
+
+
+class _LazyModule(types.ModuleType):
+    # `__getattr__` is only called for the attributes that are not (yet) in the module
+    def __getattr__(self, name: str):
+        if name in _LAZY_ATTRIBUTES:
+            return _get(name)
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+
+sys.modules[__name__].__class__ = _LazyModule
+
+_active_batches = threading.local()
+
 
+class MetasBatch(object):
+    """
+        Context manager that collects the changes of registered pages' metadata (e.g. the download datetime)
+         and writes them in a single transaction every `flush_every` changes (if given) and on exit.
+        A change is a dict of the changed fields of a page (and its `page_id`), only those are written. The
+         changes of a page are merged, the last value of each field is kept.
+
+        In worker processes, use `take()` to hand the collected changes over to the parent process instead of
+         writing them, for example:
+
+            def work(page_meta):
+                with MetasBatch() as batch:
+                    prepostprocessing.download_raw(page_meta)
+                    return batch.take()
+
+            with MetasBatch(flush_every=100) as batch:
+                for changes in pool.imap_unordered(work, pages_metas):
+                    batch.extend(changes)
+    """
+
+    def __init__(
+        self, flush_every: Optional[int] = None, store: metadata_store.MetadataStore = None
+    ):
+        self.flush_every = flush_every
+        self.store = store if store is not None else _get("metas_store")
+        self._pending: Dict[str, dict] = {}
 
-@synchronized(pages_meta_lock_name, external=True, fair=True, lock_path=lock_path)
-def _write_metas_dict(metas: dict):
-    with pages_meta.open(mode="w") as f:
-        yaml.dump(metas, f, Dumper=yaml.SafeDumper)
+    @staticmethod
+    def active() -> Optional["MetasBatch"]:
+        """ The innermost batch open in this thread, if any. """
+        stack = getattr(_active_batches, "stack", None)
+        return stack[-1] if stack else None
+
+    def __enter__(self) -> "MetasBatch":
+        if not hasattr(_active_batches, "stack"):
+            _active_batches.stack = []
+        _active_batches.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _active_batches.stack.remove(self)
+        # the changes refer to things that happened (e.g. a page was downloaded), so they're written anyway
+        self.flush()
+
+    def add(self, meta: dict) -> None:
+        self._pending.setdefault(meta["page_id"], {}).update(meta)
+        if self.flush_every is not None and len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def extend(self, metas: List[dict]) -> None:
+        for meta in metas:
+            self.add(meta)
+
+    def take(self) -> List[dict]:
+        """ Remove and return the collected changes (they won't be written by this batch). """
+        pending = list(self._pending.values())
+        self._pending.clear()
+        return pending
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        pending = self.take()
+        logging.info("Writing %d pages' metadata.", len(pending))
+        self.store.update_many(pending)
+
+
+# kinds of the artifacts in the pages' bundles
+BUNDLE_NODE_NAMES = "node_names"
+BUNDLE_TREE_PROFILE = "tree_profile"
+BUNDLE_DATA_REGIONS = "data_regions"
+BUNDLE_DATA_RECORDS = "data_records"
 
 
 class PageMeta(object):
@@ -127,33 +481,34 @@ class PageMeta(object):
     @staticmethod
     def is_registered(url: str) -> bool:
         page_id = PageMeta._page_id(url)
-        metas = _read_metas_dict()
-        return page_id in metas.keys()
+        return _get("metas_store").contains(page_id)
 
     @staticmethod
     def count() -> int:
-        return len(_read_metas_dict())
+        return _get("metas_store").count()
 
     @staticmethod
     def get_all() -> Dict[str, "PageMeta"]:
-        metas_dict = _read_metas_dict()
+        metas_dict = _get("metas_store").get_all()
         all_metas = {
             page_id: PageMeta.from_dict(page_meta_dic)
             for page_id, page_meta_dic in metas_dict.items()
         }
         return all_metas
 
+    @staticmethod
+    def _html_bytes(doc: Union[bytes, lxml.html.HtmlElement]) -> bytes:
+        if isinstance(doc, bytes):
+            return doc
+        elif isinstance(doc, lxml.etree._Element):
+            return lxml.etree.tostring(doc, encoding="utf-8", method="html", pretty_print=True)
+        else:
+            raise TypeError("type `{}` of doc is not supported.".format(type(doc).__name__))
+
     @staticmethod
     def persist_html(html_path: pathlib.Path, doc: Union[bytes, lxml.html.HtmlElement]) -> None:
         with html_path.open("wb") as f:
-            if isinstance(doc, bytes):
-                f.write(doc)
-            elif isinstance(doc, lxml.etree._Element):
-                f.write(
-                    lxml.etree.tostring(doc, encoding="utf-8", method="html", pretty_print=True)
-                )
-            else:
-                raise TypeError("type `{}` of doc is not supported.".format(type(doc).__name__))
+            f.write(PageMeta._html_bytes(doc))
 
     @classmethod
     def register(cls, url: str, n_data_records: int) -> None:
@@ -165,19 +520,14 @@ class PageMeta(object):
 
     @classmethod
     def from_meta_file_by_url(cls, url: str):
-        meta_yaml = _read_metas_dict()
-        page_id = PageMeta._page_id(url)
-        assert page_id in meta_yaml.keys(), "Url has not been registered. url={}".format(url)
-        dic = meta_yaml[page_id]
+        dic = _get("metas_store").get_by_url(url)
+        assert dic is not None, "Url has not been registered. url={}".format(url)
         return cls.from_dict(dic)
 
     @classmethod
     def from_meta_file_by_page_id(cls, page_id: str):
-        meta_yaml = _read_metas_dict()
-        assert page_id in meta_yaml.keys(), "Page id has not been registered. page_id={}".format(
-            page_id
-        )
-        dic = meta_yaml[page_id]
+        dic = _get("metas_store").get(page_id)
+        assert dic is not None, "Page id has not been registered. page_id={}".format(page_id)
         return cls.from_dict(dic)
 
     @classmethod
@@ -188,6 +538,10 @@ class PageMeta(object):
             dic["page_id"],
             dic.get("n_data_records"),
             dic.get("download_datetime"),
+            dic.get("raw_html_sha256"),
+            dic.get("preprocessed_html_sha256"),
+            dic.get("etag"),
+            dic.get("last_modified"),
         )
 
     def __init__(
@@ -197,12 +551,22 @@ class PageMeta(object):
         page_id: str,
         n_data_records: Optional[int],
         download_datetime: Optional[datetime.datetime],
+        raw_html_sha256: Optional[str] = None,
+        preprocessed_html_sha256: Optional[str] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
     ):
         self.date_time = date_time
         self.url = url
         self.page_id = page_id
         self._n_data_records = n_data_records
         self._download_datetime = download_datetime
+        # keys of the htmls in `htmls_store`
+        self.raw_html_sha256 = raw_html_sha256
+        self.preprocessed_html_sha256 = preprocessed_html_sha256
+        # validators (headers) of the response of the raw html's download
+        self.etag = etag
+        self.last_modified = last_modified
 
     @property
     def n_data_records(self) -> Optional[int]:
@@ -220,31 +584,58 @@ class PageMeta(object):
 
     @property
     def raw_html(self) -> pathlib.Path:
-        return raw_htmls_dir.joinpath(self.prefix + "raw.html").absolute()
+        """ Legacy (uncompressed) raw html, see `raw_html_sha256`. """
+        return _get("raw_htmls_dir").joinpath(self.prefix + "raw.html").absolute()
 
     @property
     def preprocessed_html(self) -> pathlib.Path:
-        return preprocessed_htmls_dir.joinpath(self.prefix + "preprocessed.html").absolute()
+        """ Legacy (uncompressed) preprocessed html, see `preprocessed_html_sha256`. """
+        return _get("preprocessed_htmls_dir").joinpath(self.prefix + "preprocessed.html").absolute()
+
+    @property
+    def has_raw_html(self) -> bool:
+        return self._is_in_store(self.raw_html_sha256) or self.raw_html.exists()
+
+    @property
+    def has_preprocessed_html(self) -> bool:
+        return self._is_in_store(self.preprocessed_html_sha256) or self.preprocessed_html.exists()
+
+    @property
+    def node_names_json(self) -> pathlib.Path:
+        """ Legacy sidecar of the nodes' names, see `bundle`. """
+        return _get("preprocessed_htmls_dir").joinpath(self.prefix + "node_names.json").absolute()
 
     @property
-    def named_nodes_html(self) -> pathlib.Path:
-        return preprocessed_htmls_dir.joinpath(self.prefix + "named_nodes.html").absolute()
+    def bundle(self) -> page_bundle.PageBundle:
+        """ The nodes' names, data regions and data records (for all the parameters) of the page. """
+        return page_bundle.PageBundle(
+            _get("intermediate_results_dir").joinpath(self.prefix + "bundle.sqlite").absolute()
+        )
 
     @property
     def distances_pkl(self) -> pathlib.Path:
-        return intermediate_results_dir.joinpath(self.prefix + "distances.pkl").absolute()
+        """ Legacy (pickled dict) format of the distances, see `distances_bin`. """
+        return _get("intermediate_results_dir").joinpath(self.prefix + "distances.pkl").absolute()
+
+    @property
+    def distances_bin(self) -> pathlib.Path:
+        return _get("intermediate_results_dir").joinpath(self.prefix + "distances.bin").absolute()
+
+    @property
+    def has_precomputed_distances(self) -> bool:
+        return self.distances_bin.exists() or self.distances_pkl.exists()
 
     @property
     def colored_html(self) -> pathlib.Path:
-        return results_dir.joinpath(self.prefix + "colored.html").absolute()
+        return _get("results_dir").joinpath(self.prefix + "colored.html").absolute()
 
     @property
     def colored_graph(self) -> pathlib.Path:
-        return results_dir.joinpath(self.prefix + "colored.pdf").absolute()
+        return _get("results_dir").joinpath(self.prefix + "colored.pdf").absolute()
 
     def data_regions_pkl(self, threshold: float, max_tags_per_gnode: int) -> pathlib.Path:
-        """ ATTENTION: the threshold is rounded to 2 decimals only. """
-        return intermediate_results_dir.joinpath(
+        """ Legacy, see `bundle`. ATTENTION: the threshold is rounded to 2 decimals only. """
+        return _get("intermediate_results_dir").joinpath(
             self.prefix
             + "data_regions(th={:.2f},max_tags={}).pkl".format(threshold, max_tags_per_gnode)
         ).absolute()
@@ -252,8 +643,8 @@ class PageMeta(object):
     def data_records_pkl(
         self, thresholds: core.MDREditDistanceThresholds, max_tags_per_gnode: int
     ) -> pathlib.Path:
-        """ ATTENTION: the threshold is rounded to 2 decimals only. """
-        return results_dir.joinpath(
+        """ Legacy, see `bundle`. ATTENTION: the threshold is rounded to 2 decimals only. """
+        return _get("results_dir").joinpath(
             self.prefix
             + "data_records(dr-th={:.2f},r1-th={:.2f},rn-th={:.2f},max_tags={}).pkl".format(
                 thresholds.data_region,
@@ -263,13 +654,27 @@ class PageMeta(object):
             )
         ).absolute()
 
-    def _persist(self, is_new=True):
-        meta_yaml = _read_metas_dict()
-        assert (is_new and self.page_id not in meta_yaml) or (
-            not is_new and self.page_id in meta_yaml
+    def _persist(self, is_new=True, fields: Iterable[str] = ()):
+        """
+        Args:
+            fields: the changed fields of a registered page (keys of `to_dict`), only they are written so that
+             the changes of the other fields by someone else (e.g. another process) are kept
+        """
+        meta = self.to_dict()
+        if not is_new:
+            meta = dict({"page_id": self.page_id}, **{field: meta[field] for field in fields})
+        batch = MetasBatch.active()
+        if not is_new and batch is not None:
+            batch.add(meta)
+            return
+        is_registered = _get("metas_store").contains(self.page_id)
+        assert (is_new and not is_registered) or (
+            not is_new and is_registered
         ), "Url has already been registered. page_id={} url={}".format(self.page_id, self.url)
-        meta_yaml[self.page_id] = self.to_dict()
-        _write_metas_dict(meta_yaml)
+        if is_new:
+            _get("metas_store").insert(meta)
+        else:
+            _get("metas_store").update(meta)
 
     def to_dict(self) -> dict:
         return {
@@ -278,48 +683,209 @@ class PageMeta(object):
             "date_time": self.date_time,
             "n_data_records": self._n_data_records,
             "download_datetime": self._download_datetime,
+            "raw_html_sha256": self.raw_html_sha256,
+            "preprocessed_html_sha256": self.preprocessed_html_sha256,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
         }
 
-    def get_raw_html_tree(self, remove_stuff: bool = False) -> lxml.html.HtmlElement:
-        with self.raw_html.open(mode="r") as file:
-            doc = lxml.html.fromstring(
-                html=lxml.etree.tostring(lxml.html.parse(file), method="html"),
-                parser=lxml.etree.HTMLParser(
-                    remove_comments=remove_stuff,
-                    remove_pis=remove_stuff,
-                    remove_blank_text=remove_stuff,
-                ),
-            )
-        return doc
+    def _persist_html_in_store(self, doc: Union[bytes, lxml.html.HtmlElement]) -> str:
+        return _get("htmls_store").put(PageMeta._html_bytes(doc))
 
-    def get_preprocessed_html_tree(self) -> lxml.html.HtmlElement:
-        with self.preprocessed_html.open(mode="r") as file:
-            doc = lxml.html.fromstring(
-                html=lxml.etree.tostring(lxml.html.parse(file), method="html"),
+    def persist_raw_html(
+        self,
+        doc: Union[bytes, lxml.html.HtmlElement],
+        download_datetime: Optional[datetime.datetime] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            etag, last_modified: headers of the response the document comes from (if any), they are replaced
+             anyway because they describe the previous document
+        """
+        self.persist_raw_html_sha256(
+            self._persist_html_in_store(doc), download_datetime, etag, last_modified
+        )
+
+    def persist_raw_html_sha256(
+        self,
+        sha256: str,
+        download_datetime: Optional[datetime.datetime] = None,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """ Like `persist_raw_html` for a document already put in the html store. """
+        assert sha256 in _get(
+            "htmls_store"
+        ), "The document is not in the html store. sha256={}".format(sha256)
+        self.raw_html_sha256 = sha256
+        fields = ["raw_html_sha256", "etag", "last_modified"]
+        if download_datetime is not None:
+            self._download_datetime = download_datetime
+            fields.append("download_datetime")
+        self.etag = etag
+        self.last_modified = last_modified
+        self._persist(is_new=False, fields=fields)
+
+    def persist_preprocessed_html(self, doc: Union[bytes, lxml.html.HtmlElement]) -> None:
+        sha256 = self._persist_html_in_store(doc)
+        if sha256 != self.preprocessed_html_sha256:
+            # the nodes' names and the tree profile are the ones of the previous document
+            self.bundle.delete(BUNDLE_NODE_NAMES, {})
+            self.bundle.delete(BUNDLE_TREE_PROFILE, {})
+            if self.node_names_json.exists():
+                self.node_names_json.unlink()
+        self.preprocessed_html_sha256 = sha256
+        self._persist(is_new=False, fields=["preprocessed_html_sha256"])
+
+    @staticmethod
+    def _is_in_store(sha256: Optional[str]) -> bool:
+        return sha256 is not None and sha256 in _get("htmls_store")
+
+    @staticmethod
+    def _touch_file(path: pathlib.Path) -> None:
+        """ Record an access to an artifact, see `artifacts_manager`. """
+        _get("artifacts_access").touch(artifacts_manager.file_key(_get("outputs_dir"), path))
+
+    def _touch_bundle_artifact(self, kind: str, params: dict) -> None:
+        _get("artifacts_access").touch(
+            artifacts_manager.bundle_artifact_key(
+                _get("outputs_dir"), self.bundle.db_path, kind, params
             )
-        return doc
+        )
 
-    def get_named_nodes_html_tree(self) -> lxml.html.HtmlElement:
-        with self.named_nodes_html.open(mode="r") as file:
-            doc = lxml.html.fromstring(
-                html=lxml.etree.tostring(lxml.html.parse(file), method="html"),
+    @staticmethod
+    def _open_html(sha256: Optional[str], legacy_filepath: pathlib.Path) -> BinaryIO:
+        if PageMeta._is_in_store(sha256):
+            _get("artifacts_access").touch(artifacts_manager.html_key(sha256))
+            return _get("htmls_store").open(sha256)
+        PageMeta._touch_file(legacy_filepath)
+        return legacy_filepath.open("rb")
+
+    def open_raw_html(self) -> BinaryIO:
+        """ Binary file object of the raw html (decompressed while it is read). """
+        return self._open_html(self.raw_html_sha256, self.raw_html)
+
+    def open_preprocessed_html(self) -> BinaryIO:
+        """ Binary file object of the preprocessed html (decompressed while it is read). """
+        return self._open_html(self.preprocessed_html_sha256, self.preprocessed_html)
+
+    def _get_html_tree(
+        self, sha256: Optional[str], legacy_filepath: pathlib.Path, remove_stuff: bool
+    ) -> lxml.html.HtmlElement:
+        """ The tree is given by `parsed_trees_cache` (it's a copy, so the caller can modify it). """
+        if PageMeta._is_in_store(sha256):
+            _get("artifacts_access").touch(artifacts_manager.html_key(sha256))
+            # the content never changes under a given key
+            key = (sha256, remove_stuff)
+            file_size = (
+                _get("htmls_store").compressed_size(sha256) * html_store.ESTIMATED_COMPRESSION_RATIO
             )
-        return doc
+        else:
+            PageMeta._touch_file(legacy_filepath)
+            stat = legacy_filepath.stat()
+            key = (str(legacy_filepath), remove_stuff, stat.st_mtime_ns, stat.st_size)
+            file_size = stat.st_size
+
+        def parse():
+            with self._open_html(sha256, legacy_filepath) as file:
+                return parse_html(file, remove_stuff)
+
+        return _get("parsed_trees_cache").get(key, parse, file_size)
+
+    def get_raw_html_tree(self, remove_stuff: bool = False) -> lxml.html.HtmlElement:
+        return self._get_html_tree(self.raw_html_sha256, self.raw_html, remove_stuff)
+
+    def get_preprocessed_html_tree(self) -> lxml.html.HtmlElement:
+        return self._get_html_tree(
+            self.preprocessed_html_sha256, self.preprocessed_html, remove_stuff=False
+        )
+
+    @property
+    def has_node_names(self) -> bool:
+        return self.bundle.contains(BUNDLE_NODE_NAMES, {}) or self.node_names_json.exists()
+
+    def persist_node_names(self, sidecar: dict) -> None:
+        """ See `core.NodeNamer.sidecar`. """
+        self.bundle.put(BUNDLE_NODE_NAMES, {}, json.dumps(sidecar).encode("utf-8"))
+
+    def load_node_names(self) -> dict:
+        payload = self.bundle.get(BUNDLE_NODE_NAMES, {})
+        self._touch_bundle_artifact(BUNDLE_NODE_NAMES, {})
+        if payload is None:
+            return json.loads(self.node_names_json.read_text())
+        return json.loads(payload.decode("utf-8"))
+
+    def persist_tree_profile(self, profile: core.TreeProfile) -> None:
+        """ See `core.tree_profile`, of the preprocessed html. """
+        self.bundle.put(BUNDLE_TREE_PROFILE, {}, json.dumps(profile._asdict()).encode("utf-8"))
+
+    def load_tree_profile(self) -> Optional[core.TreeProfile]:
+        """ None if it has not been saved (e.g. preprocessed before it was, or evicted). """
+        payload = self.bundle.get(BUNDLE_TREE_PROFILE, {})
+        if payload is None:
+            return None
+        self._touch_bundle_artifact(BUNDLE_TREE_PROFILE, {})
+        return core.TreeProfile(**json.loads(payload.decode("utf-8")))
 
     def persist_precomputed_distances(
         self, dists: core.DISTANCES_DICT_FORMAT, minimum_depth: int, max_tag_per_gnode: int,
     ):
-        dists["minimum_depth"] = minimum_depth
-        dists["max_tag_per_gnode"] = max_tag_per_gnode
-        with self.distances_pkl.open(mode="wb") as f:
-            pickle.dump(dists, f)
+        distances_store.dump(self.distances_bin, dists, minimum_depth, max_tag_per_gnode)
 
     def load_precomputed_distances(self,) -> core.DISTANCES_DICT_FORMAT:
-        assert self.distances_pkl.exists()
+        """
+        The distances are memory-mapped, see `distances_store.PrecomputedDistances`.
+        They are shared by the calls of a process (they're read-only), so the records decoded for a threshold
+         are not decoded again for the next ones.
+        """
+        if not self.distances_bin.exists():
+            self._convert_legacy_distances()
+        self._touch_file(self.distances_bin)
+        stat = self.distances_bin.stat()
+        return _load_distances(self.distances_bin, (stat.st_ino, stat.st_mtime_ns, stat.st_size))
+
+    def _convert_legacy_distances(self) -> None:
+        """ Rewrite the pickled distances (legacy format) in the binary format. """
+        assert self.distances_pkl.exists(), "Distances have NOT been precomputed!"
+        logging.info("Converting legacy distances format. page_id=%s", self.page_id)
         with self.distances_pkl.open(mode="rb") as f:
             dists = pickle.load(f)
-        assert dists is not None, "None distances... page_id={}".formate(self.page_id)
-        return dists
+        assert dists is not None, "None distances... page_id={}".format(self.page_id)
+        self.persist_precomputed_distances(
+            dists, dists[core.DICT_PARAM_MINIMUM_DEPTH], dists[core.DICT_PARAM_TAG_PER_GNODE]
+        )
+
+    @staticmethod
+    def data_regions_params(threshold: float, max_tags_per_gnode: int) -> dict:
+        return {"threshold": threshold, "max_tags_per_gnode": max_tags_per_gnode}
+
+    @staticmethod
+    def data_records_params(
+        thresholds: core.MDREditDistanceThresholds, max_tags_per_gnode: int
+    ) -> dict:
+        params = dict(thresholds._asdict())
+        params["max_tags_per_gnode"] = max_tags_per_gnode
+        return params
+
+    def has_precomputed_data_regions(self, threshold: float, max_tags_per_gnode: int) -> bool:
+        return (
+            self.bundle.contains(
+                BUNDLE_DATA_REGIONS, self.data_regions_params(threshold, max_tags_per_gnode)
+            )
+            or self.data_regions_pkl(threshold, max_tags_per_gnode).exists()
+        )
+
+    def has_precomputed_data_records(
+        self, thresholds: core.MDREditDistanceThresholds, max_tags_per_gnode: int
+    ) -> bool:
+        return (
+            self.bundle.contains(
+                BUNDLE_DATA_RECORDS, self.data_records_params(thresholds, max_tags_per_gnode)
+            )
+            or self.data_records_pkl(thresholds, max_tags_per_gnode).exists()
+        )
 
     def persist_precomputed_data_regions(
         self,
@@ -332,12 +898,20 @@ class PageMeta(object):
         data_regions["minimum_depth"] = minimum_depth
         data_regions["max_tags_per_gnode"] = max_tags_per_gnode
 
-        with self.data_regions_pkl(distance_threshold, max_tags_per_gnode).open(mode="wb") as f:
-            pickle.dump(data_regions, f)
+        self.bundle.put(
+            BUNDLE_DATA_REGIONS,
+            self.data_regions_params(distance_threshold, max_tags_per_gnode),
+            pickle.dumps(data_regions),
+        )
 
     def load_precomputed_data_regions(
         self, threshold: float, max_tags_per_gnode: int
     ) -> core.DATA_REGION_DICT_FORMAT:
+        params = self.data_regions_params(threshold, max_tags_per_gnode)
+        payload = self.bundle.get(BUNDLE_DATA_REGIONS, params)
+        self._touch_bundle_artifact(BUNDLE_DATA_REGIONS, params)
+        if payload is not None:
+            return pickle.loads(payload)
         data_regions_pkl = self.data_regions_pkl(threshold, max_tags_per_gnode)
         assert data_regions_pkl.exists()
         with data_regions_pkl.open(mode="rb") as f:
@@ -350,12 +924,21 @@ class PageMeta(object):
         thresholds: core.MDREditDistanceThresholds,
         max_tags_per_gnode: int,
     ):
-        with self.data_records_pkl(thresholds, max_tags_per_gnode).open(mode="wb") as f:
-            pickle.dump(data_records, f)
+        self.bundle.put(
+            BUNDLE_DATA_RECORDS,
+            self.data_records_params(thresholds, max_tags_per_gnode),
+            pickle.dumps(data_records),
+            n_records=len(data_records),
+        )
 
     def load_precomputed_data_records(
         self, thresholds: core.MDREditDistanceThresholds, max_tags_per_gnode: int
     ) -> core.DATA_RECORDS:
+        params = self.data_records_params(thresholds, max_tags_per_gnode)
+        payload = self.bundle.get(BUNDLE_DATA_RECORDS, params)
+        self._touch_bundle_artifact(BUNDLE_DATA_RECORDS, params)
+        if payload is not None:
+            return pickle.loads(payload)
         data_records_pkl = self.data_records_pkl(thresholds, max_tags_per_gnode)
         assert data_records_pkl.exists()
         with data_records_pkl.open(mode="rb") as f:
@@ -364,4 +947,4 @@ class PageMeta(object):
 
     def persist_download_datetime(self, download_datetime: datetime.datetime) -> None:
         self._download_datetime = download_datetime
-        self._persist(is_new=False)
+        self._persist(is_new=False, fields=["download_datetime"])
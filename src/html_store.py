@@ -0,0 +1,145 @@
+"""
+Module dependencies:
+    all -> html_store
+
+Content-addressed store of html documents: each document is kept once (compressed), under the sha256 of its
+ (uncompressed) bytes, so the pages downloaded twice or mirrored under other urls don't take more space.
+
+The blobs are `<root>/<first 2 hex digits>/<sha256>.html<extension of the codec>`, the codec used for writing
+ can be changed at any time, the blobs written with the others can still be read.
+
+Usage (statistics of a store):
+    python html_store.py path/to/html_store
+"""
+
+import argparse
+import gzip
+import hashlib
+import logging
+import lzma
+import os
+import pathlib
+import tempfile
+from typing import BinaryIO, Dict
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(levelname)s [%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s",
+)
+
+DEFAULT_CODEC = "gzip"
+# rough ratio between the size of an html document and its compressed size
+ESTIMATED_COMPRESSION_RATIO = 5
+ZSTD_LEVEL = 10
+
+
+class _Codec(object):
+    def __init__(self, extension: str, compress, open_reader):
+        self.extension = extension
+        self.compress = compress
+        self.open_reader = open_reader
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _zstd_open_reader(path: pathlib.Path) -> BinaryIO:
+    return zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+
+
+CODECS = {
+    "gzip": _Codec(".gz", gzip.compress, lambda path: gzip.open(str(path), "rb")),
+    "lzma": _Codec(".xz", lzma.compress, lambda path: lzma.open(str(path), "rb")),
+}
+if zstandard is not None:
+    CODECS["zstd"] = _Codec(".zst", _zstd_compress, _zstd_open_reader)
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class HtmlStore(object):
+    def __init__(self, root_dir: pathlib.Path, codec: str = DEFAULT_CODEC):
+        assert codec in CODECS, "Codec `{}` is not available, choose one of {}.".format(
+            codec, sorted(CODECS)
+        )
+        self.root_dir = pathlib.Path(root_dir)
+        self.codec = codec
+
+    def _path(self, sha256: str, codec: str) -> pathlib.Path:
+        return self.root_dir.joinpath(sha256[:2], sha256 + ".html" + CODECS[codec].extension)
+
+    def find(self, sha256: str) -> pathlib.Path:
+        """ The path of the blob, whatever codec it has been written with. Raises `KeyError` if missing. """
+        # the current codec first, it's the most likely
+        for codec in [self.codec] + [codec for codec in CODECS if codec != self.codec]:
+            path = self._path(sha256, codec)
+            if path.exists():
+                return path
+        raise KeyError(sha256)
+
+    def __contains__(self, sha256: str) -> bool:
+        try:
+            self.find(sha256)
+        except KeyError:
+            return False
+        return True
+
+    def put(self, data: bytes) -> str:
+        """ Store an html document (if it's not there yet), returns its sha256 (the key to open it). """
+        sha256 = digest(data)
+        if sha256 in self:
+            logging.info("The document is already stored. sha256=%s", sha256)
+            return sha256
+
+        path = self._path(sha256, self.codec)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # written aside then moved, so a blob is never seen half written
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(CODECS[self.codec].compress(data))
+            os.replace(tmp_path, str(path))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return sha256
+
+    def open(self, sha256: str) -> BinaryIO:
+        """ A binary file object decompressing the document while it is read. """
+        path = self.find(sha256)
+        codec = next(name for name, codec in CODECS.items() if path.name.endswith(codec.extension))
+        return CODECS[codec].open_reader(path)
+
+    def get(self, sha256: str) -> bytes:
+        with self.open(sha256) as f:
+            return f.read()
+
+    def compressed_size(self, sha256: str) -> int:
+        return self.find(sha256).stat().st_size
+
+    def stats(self) -> Dict[str, int]:
+        n_blobs, n_bytes = 0, 0
+        for path in self.root_dir.glob("??/*.html.*"):
+            n_blobs += 1
+            n_bytes += path.stat().st_size
+        return {"n_blobs": n_blobs, "compressed_bytes": n_bytes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics of an html store.")
+    parser.add_argument("root_dir", type=pathlib.Path)
+    args = parser.parse_args()
+    stats = HtmlStore(args.root_dir).stats()
+    print("blobs: {n_blobs}\ncompressed size: {compressed_bytes} bytes".format(**stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Module dependencies:
+    all -> metadata_store
+
+The pages' metadata are kept in a local SQLite database (in WAL mode so that readers never block the writer).
+Each metadata is a row indexed by `page_id` and `url` and it is updated individually, so registering a page or
+ changing a field doesn't rewrite the whole registry.
+
+The YAML file (`pages-meta.yml`) is the former registry, it can be imported once (see `import_yaml`) and
+ exported for versioning (see `export_yaml`).
+Registering a page only writes the database: the versioned YAML is exported by the training script
+ (`dev/training/preprocess_all.py`) at the end of its runs, or with the command below (see the README).
+
+Usage:
+    python metadata_store.py import path/to/pages-meta.sqlite path/to/pages-meta.yml
+    python metadata_store.py export path/to/pages-meta.sqlite path/to/pages-meta.yml
+"""
+
+import argparse
+import collections
+import datetime
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(levelname)s [%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s",
+)
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# (column name, sql type) of the metadata fields, the order is the one of the table
+COLUMNS = (
+    ("page_id", "TEXT PRIMARY KEY"),
+    ("url", "TEXT NOT NULL UNIQUE"),
+    ("date_time", "TEXT NOT NULL"),
+    ("n_data_records", "INTEGER"),
+    ("download_datetime", "TEXT"),
+    ("raw_html_sha256", "TEXT"),
+    ("preprocessed_html_sha256", "TEXT"),
+    # validators of the raw html's response, for the conditional requests of a refresh
+    ("etag", "TEXT"),
+    ("last_modified", "TEXT"),
+)
+DATETIME_COLUMNS = ("date_time", "download_datetime")
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+
+BUSY_TIMEOUT_MS = 30 * 1000
+
+
+def _datetime_to_sql(value: Optional[datetime.datetime]) -> Optional[str]:
+    return value.strftime(DATETIME_FORMAT) if value is not None else None
+
+
+def _datetime_from_sql(value: Optional[str]) -> Optional[datetime.datetime]:
+    return datetime.datetime.strptime(value, DATETIME_FORMAT) if value is not None else None
+
+
+def _to_sql(name: str, value):
+    return _datetime_to_sql(value) if name in DATETIME_COLUMNS else value
+
+
+def _to_row(meta: dict) -> tuple:
+    return tuple(_to_sql(name, meta.get(name)) for name in COLUMN_NAMES)
+
+
+def _from_row(row: sqlite3.Row) -> dict:
+    return {
+        name: _datetime_from_sql(row[name]) if name in DATETIME_COLUMNS else row[name]
+        for name in COLUMN_NAMES
+    }
+
+
+def _from_row_tuple(row: tuple) -> dict:
+    return _from_row(dict(zip(COLUMN_NAMES, row)))
+
+
+# the cached metadata at the database's `version`
+_Cache = collections.namedtuple("_Cache", ["version", "metas", "urls"])
+
+
+class MetadataStore(object):
+    """
+        Pages' metadata (dicts like `PageMeta.to_dict()`) in a SQLite database.
+
+        The whole table is cached in memory and the reads are served from the cache as long as the database has
+         not changed. Every write transaction increments the version of the database (the `store_version`
+         table), the reads compare it with the one of the cache on a connection of their own thread, without
+         taking the lock of the store: it is only taken to write and to reload the cache.
+        This store's own writes update the cache directly (a new snapshot of it, the readers keep theirs).
+
+        The connections are opened lazily: one that writes, per process (it cannot be shared after a fork)
+         and shared by the threads of the process, and one that reads the version per thread.
+    """
+
+    def __init__(self, db_path: pathlib.Path):
+        self.db_path = pathlib.Path(db_path)
+        self._lock = threading.RLock()
+        self._connection = None
+        self._connection_pid = None
+        self._local = threading.local()  # the thread's connection that reads the version
+        # {page_id: meta} and {url: page_id} of the whole table at a version, never changed once it's set
+        self._cache: Optional[_Cache] = None
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        # isolation_level=None --> autocommit, the transactions are explicit (see `_write_statements`)
+        connection = sqlite3.connect(
+            str(self.db_path),
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA busy_timeout={}".format(BUSY_TIMEOUT_MS))
+        if read_only:
+            connection.execute("PRAGMA query_only=ON")
+            return connection
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages_meta ({})".format(
+                ", ".join("{} {}".format(name, sql_type) for name, sql_type in COLUMNS)
+            )
+        )
+        self._add_missing_columns(connection)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS store_version "
+            "(id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)"
+        )
+        if connection.execute("SELECT version FROM store_version").fetchone() is None:
+            connection.execute("INSERT OR IGNORE INTO store_version VALUES (0, 0)")
+        return connection
+
+    @staticmethod
+    def _add_missing_columns(connection: sqlite3.Connection) -> None:
+        """ Databases created before a column was added get it (empty for the existing rows). """
+        existing = {row["name"] for row in connection.execute("PRAGMA table_info(pages_meta)")}
+        for name, sql_type in COLUMNS:
+            if name not in existing:
+                logging.info("Adding the column `%s` to the pages' metadata.", name)
+                connection.execute("ALTER TABLE pages_meta ADD COLUMN {} {}".format(name, sql_type))
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        with self._lock:
+            pid = os.getpid()
+            if self._connection_pid != pid:
+                self._connection = self._connect()
+                self._connection_pid = pid
+                self._cache = None
+            return self._connection
+
+    def _version(self) -> int:
+        """ The version of the database, read on the thread's connection (without the lock). """
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, "pid", None) != pid:
+            if self._connection_pid != pid:
+                self.connection  # creates the tables
+            local.connection = self._connect(read_only=True)
+            local.pid = pid
+        return local.connection.execute("SELECT version FROM store_version").fetchone()[0]
+
+    def _cached(self) -> "_Cache":
+        """ The metadata of all the pages, reloaded only if the database has been changed by someone else. """
+        cache = self._cache
+        if cache is not None and cache.version == self._version():
+            return cache
+        with self._lock:
+            connection = self.connection
+            # the version and the rows of the same snapshot
+            connection.execute("BEGIN")
+            try:
+                version = connection.execute("SELECT version FROM store_version").fetchone()[0]
+                if self._cache is None or self._cache.version != version:
+                    metas = self._select("ORDER BY page_id")
+                    self._cache = _Cache(
+                        version,
+                        {meta["page_id"]: meta for meta in metas},
+                        {meta["url"]: meta["page_id"] for meta in metas},
+                    )
+            finally:
+                connection.execute("COMMIT")
+            return self._cache
+
+    def _cache_put(self, metas: List[dict], version: int) -> None:
+        """
+        After writing the metas (at `version`), they may only have some of the fields (and the `page_id`) of
+         registered pages.
+        """
+        cache = self._cache
+        if cache is None or cache.version != version - 1:
+            # someone else wrote in the meantime
+            self._cache = None
+            return
+        cache = _Cache(version, dict(cache.metas), dict(cache.urls))
+        for meta in metas:
+            meta = _from_row_tuple(_to_row(dict(cache.metas.get(meta["page_id"], {}), **meta)))
+            cache.metas[meta["page_id"]] = meta
+            cache.urls[meta["url"]] = meta["page_id"]
+        self._cache = cache
+
+    def _write(self, sql: str, rows: List[tuple], metas: Optional[List[dict]] = None) -> int:
+        """ Execute `sql` for each row in a single transaction. Returns the number of changed rows. """
+        return self._write_statements([(sql, row) for row in rows], metas)
+
+    def _write_statements(
+        self, statements: List[Tuple[str, tuple]], metas: Optional[List[dict]] = None
+    ) -> int:
+        """
+        Execute the (sql, row) in a single transaction. Returns the number of changed rows.
+
+        Args:
+            metas: the written metas, put in the cache (else it's reloaded by the next read)
+        """
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                changes = 0
+                for sql, row in statements:
+                    changes += connection.execute(sql, row).rowcount
+                connection.execute("UPDATE store_version SET version = version + 1")
+                version = connection.execute("SELECT version FROM store_version").fetchone()[0]
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            if metas is None:
+                self._cache = None
+            else:
+                self._cache_put(metas, version)
+            return changes
+
+    def _select(self, where: str = "", params: tuple = ()) -> List[dict]:
+        with self._lock:
+            cursor = self.connection.execute(
+                "SELECT {} FROM pages_meta {}".format(", ".join(COLUMN_NAMES), where), params
+            )
+            return [_from_row(row) for row in cursor]
+
+    def contains(self, page_id: str) -> bool:
+        return page_id in self._cached().metas
+
+    def count(self) -> int:
+        return len(self._cached().metas)
+
+    def get(self, page_id: str) -> Optional[dict]:
+        meta = self._cached().metas.get(page_id)
+        return dict(meta) if meta is not None else None
+
+    def get_by_url(self, url: str) -> Optional[dict]:
+        cache = self._cached()
+        page_id = cache.urls.get(url)
+        return dict(cache.metas[page_id]) if page_id is not None else None
+
+    def get_all(self) -> Dict[str, dict]:
+        return {page_id: dict(meta) for page_id, meta in self._cached().metas.items()}
+
+    def insert(self, meta: dict) -> None:
+        """ Raises `sqlite3.IntegrityError` if the page is already registered. """
+        sql = "INSERT INTO pages_meta ({}) VALUES ({})".format(
+            ", ".join(COLUMN_NAMES), ", ".join("?" * len(COLUMN_NAMES))
+        )
+        self._write(sql, [_to_row(meta)], metas=[meta])
+
+    def update(self, meta: dict) -> None:
+        self.update_many([meta])
+
+    def update_many(self, metas: List[dict]) -> None:
+        """
+        Update existing rows in a single transaction.
+        Only the fields in the metas are written (besides the `page_id`), so the other ones keep the values
+         written in the meantime by someone else (e.g. another process).
+        """
+        statements = []
+        for meta in metas:
+            names = [name for name in COLUMN_NAMES[1:] if name in meta]
+            if not names:
+                continue
+            sql = "UPDATE pages_meta SET {} WHERE page_id = ?".format(
+                ", ".join("{} = ?".format(name) for name in names)
+            )
+            row = tuple(_to_sql(name, meta[name]) for name in names) + (meta["page_id"],)
+            statements.append((sql, row))
+        changes = self._write_statements(statements, metas=metas)
+        assert changes == len(statements), "Some of the pages have not been registered."
+
+    def import_yaml(self, yaml_path: pathlib.Path) -> int:
+        """ Insert the metadata of the (legacy) YAML registry that are not in the database yet. """
+        import yaml
+
+        with pathlib.Path(yaml_path).open(mode="r") as f:
+            metas_dict = yaml.load(f, Loader=yaml.FullLoader) or dict()
+        sql = "INSERT OR IGNORE INTO pages_meta ({}) VALUES ({})".format(
+            ", ".join(COLUMN_NAMES), ", ".join("?" * len(COLUMN_NAMES))
+        )
+        n_imported = self._write(sql, [_to_row(meta) for meta in metas_dict.values()])
+        logging.info("Imported %d pages' metadata from %s", n_imported, str(yaml_path))
+        return n_imported
+
+    def export_yaml(self, yaml_path: pathlib.Path) -> None:
+        """ The file is replaced at once, it is never left half written. """
+        import yaml
+
+        yaml_path = pathlib.Path(yaml_path)
+        tmp_path = yaml_path.with_name(yaml_path.name + ".tmp")
+        with tmp_path.open(mode="w") as f:
+            yaml.dump(self.get_all(), f, Dumper=yaml.SafeDumper)
+        os.replace(str(tmp_path), str(yaml_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import/export the pages' metadata from/to YAML.")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("db_path", type=pathlib.Path)
+    parser.add_argument("yaml_path", type=pathlib.Path)
+    args = parser.parse_args()
+
+    store = MetadataStore(args.db_path)
+    if args.command == "import":
+        store.import_yaml(args.yaml_path)
+    else:
+        store.export_yaml(args.yaml_path)
+
+
+if __name__ == "__main__":
+    main()
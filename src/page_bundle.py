@@ -0,0 +1,220 @@
+"""
+Module dependencies:
+    all -> page_bundle
+
+All the intermediate results of a page (nodes' names, data regions and data records for every combination of
+ parameters) are kept in a single SQLite file instead of a file per result, listing, copying and loading pages
+ is then dominated by the number of pages instead of the number of combinations of parameters.
+
+Each result (an "artifact") is a row keyed by its kind and its parameters, written in a transaction, so a
+ bundle is never left with half an artifact.
+The bundle also keeps the stamps of the pipeline's stages (see `pipeline`), keyed the same way.
+The journal is SQLite's default (rollback) one, no other file lives next to a bundle (but during a write).
+
+Usage (list the artifacts of bundles):
+    python page_bundle.py path/to/bundle.sqlite [path/to/other-bundle.sqlite ...]
+"""
+
+import argparse
+import datetime
+import json
+import pathlib
+import sqlite3
+from typing import List, NamedTuple, Optional
+
+BUSY_TIMEOUT_MS = 30 * 1000
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# thresholds are rounded to this number of decimals in the artifacts' keys
+PARAMS_FLOAT_DECIMALS = 2
+
+Artifact = NamedTuple(
+    "Artifact",
+    [
+        ("kind", str),
+        ("params", dict),
+        ("n_bytes", int),
+        ("n_records", Optional[int]),
+        ("created", datetime.datetime),
+    ],
+)
+
+
+def params_key(params: dict) -> str:
+    """ Canonical string of a dict of parameters (sorted, with rounded floats). """
+    return json.dumps(
+        {
+            name: round(value, PARAMS_FLOAT_DECIMALS) if isinstance(value, float) else value
+            for name, value in params.items()
+        },
+        sort_keys=True,
+    )
+
+
+class PageBundle(object):
+    """
+        SQLite file with the artifacts of a page.
+        A connection is opened for each operation (bundles are used briefly and by different processes).
+    """
+
+    def __init__(self, db_path: pathlib.Path):
+        self.db_path = pathlib.Path(db_path)
+
+    def exists(self) -> bool:
+        return self.db_path.exists()
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None --> autocommit, the transactions are explicit
+        connection = sqlite3.connect(
+            str(self.db_path), timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            "kind TEXT NOT NULL, "
+            "params TEXT NOT NULL, "
+            "payload BLOB NOT NULL, "
+            "n_records INTEGER, "
+            "created TEXT NOT NULL, "
+            "PRIMARY KEY (kind, params))"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS stamps ("
+            "stage TEXT NOT NULL, "
+            "params TEXT NOT NULL, "
+            "stamp TEXT NOT NULL, "
+            "PRIMARY KEY (stage, params))"
+        )
+        return connection
+
+    def put(self, kind: str, params: dict, payload: bytes, n_records: Optional[int] = None) -> None:
+        """ Add (or replace) an artifact atomically. """
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute(
+                    "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                    (
+                        kind,
+                        params_key(params),
+                        sqlite3.Binary(payload),
+                        n_records,
+                        datetime.datetime.now().strftime(DATETIME_FORMAT),
+                    ),
+                )
+        finally:
+            connection.close()
+
+    def get(self, kind: str, params: dict) -> Optional[bytes]:
+        if not self.exists():
+            return None
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT payload FROM artifacts WHERE kind = ? AND params = ?",
+                (kind, params_key(params)),
+            ).fetchone()
+        finally:
+            connection.close()
+        return bytes(row[0]) if row is not None else None
+
+    def contains(self, kind: str, params: dict) -> bool:
+        if not self.exists():
+            return False
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT 1 FROM artifacts WHERE kind = ? AND params = ?", (kind, params_key(params)),
+            ).fetchone()
+        finally:
+            connection.close()
+        return row is not None
+
+    def list(self, kind: Optional[str] = None) -> List[Artifact]:
+        """ The artifacts (without their payloads), optionally of a given kind only. """
+        if not self.exists():
+            return []
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT kind, params, length(payload), n_records, created FROM artifacts "
+                + ("WHERE kind = ? " if kind is not None else "")
+                + "ORDER BY kind, params",
+                (kind,) if kind is not None else (),
+            ).fetchall()
+        finally:
+            connection.close()
+        return [
+            Artifact(
+                kind_,
+                json.loads(params),
+                n_bytes,
+                n_records,
+                datetime.datetime.strptime(created, DATETIME_FORMAT),
+            )
+            for kind_, params, n_bytes, n_records, created in rows
+        ]
+
+    def delete(self, kind: str, params: dict) -> bool:
+        if not self.exists():
+            return False
+        connection = self._connect()
+        try:
+            with connection:
+                n_deleted = connection.execute(
+                    "DELETE FROM artifacts WHERE kind = ? AND params = ?",
+                    (kind, params_key(params)),
+                ).rowcount
+        finally:
+            connection.close()
+        return n_deleted > 0
+
+    def vacuum(self) -> None:
+        """ Give the space of the deleted artifacts back to the file system. """
+        connection = self._connect()
+        try:
+            connection.execute("VACUUM")
+        finally:
+            connection.close()
+
+    def put_stamp(self, stage: str, params: dict, stamp: str) -> None:
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO stamps VALUES (?, ?, ?)",
+                    (stage, params_key(params), stamp),
+                )
+        finally:
+            connection.close()
+
+    def get_stamp(self, stage: str, params: dict) -> Optional[str]:
+        if not self.exists():
+            return None
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                "SELECT stamp FROM stamps WHERE stage = ? AND params = ?",
+                (stage, params_key(params)),
+            ).fetchone()
+        finally:
+            connection.close()
+        return row[0] if row is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the artifacts of pages' bundles.")
+    parser.add_argument("bundles", type=pathlib.Path, nargs="+")
+    args = parser.parse_args()
+    for bundle_path in args.bundles:
+        print(bundle_path)
+        for artifact in PageBundle(bundle_path).list():
+            print(
+                "    {:<15} {:<90} {:>10} bytes  n_records={}".format(
+                    artifact.kind, params_key(artifact.params), artifact.n_bytes, artifact.n_records
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Module dependencies:
+    all - {core, files_management, page_bundle} -> pipeline
+
+Make-like tracking of the stages of the preprocessing (see `prepostprocessing`):
+
+    raw html -> cleanup -> distances -> data regions (per threshold) -> data records (per thresholds)
+                       \\_______________/______________________________/
+
+When a stage runs, it records a stamp of what its result was computed from (in the page's bundle): the hash of
+ the stage's name, code version and parameters and of the identities of its inputs.
+A result is stale when the stamp that would be recorded now differs from the recorded one, i.e. when an input
+ or the code changed.
+The identities of the htmls are their content hashes and the ones of the other results are their recorded
+ stamps, so a change of the cleanup that does not change a page's preprocessed html doesn't make its results
+ stale.
+A stage whose upstream results are not up-to-date themselves can't run (`check`) nor be recorded (`record`),
+ its status is `STALE_UPSTREAM`: its upstream stages must run first.
+The cleanup's stamp also has the preprocessing profile (`preprocessing-profile` in config.yml), changing it
+ makes the preprocessed htmls stale.
+"""
+
+import collections
+import functools
+import hashlib
+import json
+import logging
+import pathlib
+from typing import Dict, List, Optional, Tuple
+
+import core
+import files_management as fm
+import page_bundle
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(levelname)s [%(filename)s:%(lineno)s - %(funcName)20s() ] %(message)s",
+)
+
+CLEANUP = "cleanup"
+DISTANCES = "distances"
+DATA_REGIONS = "data_regions"
+DATA_RECORDS = "data_records"
+
+# bump the version of a stage when a change of its code changes its results, they'll become stale
+STAGES_VERSIONS = {
+    CLEANUP: 1,
+    DISTANCES: 1,
+    DATA_REGIONS: 1,
+    DATA_RECORDS: 1,
+}
+
+# statuses of a stage's result
+UP_TO_DATE = "up-to-date"
+MISSING = "missing"
+STALE = "stale"
+UNSTAMPED = "unstamped"  # computed before the stamps existed, it is adopted as it is
+MISSING_INPUTS = "missing-inputs"
+STALE_UPSTREAM = "stale-upstream"  # an upstream result is not up-to-date
+UPSTREAM_WILL_RUN = "upstream-will-run"  # only in plans, it'll be stale if the upstream result changes
+
+Step = collections.namedtuple("Step", ["page_id", "stage", "params", "status"])
+
+
+def data_regions_params(threshold: float, max_tags_per_gnode: int) -> dict:
+    return fm.PageMeta.data_regions_params(threshold, max_tags_per_gnode)
+
+
+def data_records_params(
+    thresholds: core.MDREditDistanceThresholds, max_tags_per_gnode: int
+) -> dict:
+    return fm.PageMeta.data_records_params(thresholds, max_tags_per_gnode)
+
+
+def _upstream(stage: str, params: dict) -> List[Tuple[str, dict]]:
+    """ The stages (with their parameters) whose results are used by the given one. """
+    if stage == CLEANUP:
+        return []
+    elif stage == DISTANCES:
+        return [(CLEANUP, {})]
+    elif stage == DATA_REGIONS:
+        return [(CLEANUP, {}), (DISTANCES, {})]
+    elif stage == DATA_RECORDS:
+        return [
+            (CLEANUP, {}),
+            (DISTANCES, {}),
+            (DATA_REGIONS, data_regions_params(params["data_region"], params["max_tags_per_gnode"])),
+        ]
+    raise ValueError("Unknown stage `{}`.".format(stage))
+
+
+@functools.lru_cache(maxsize=1024)
+def _file_sha256(path: pathlib.Path, mtime_ns: int, size: int) -> str:
+    sha256 = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(fm.HTML_READ_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _html_identity(sha256: Optional[str], legacy_filepath: pathlib.Path) -> Optional[str]:
+    """ The content hash of an html, the legacy (not in the store) files are hashed. """
+    if sha256 is not None and sha256 in fm.htmls_store:
+        return sha256
+    if legacy_filepath.exists():
+        stat = legacy_filepath.stat()
+        return _file_sha256(legacy_filepath, stat.st_mtime_ns, stat.st_size)
+    return None
+
+
+def _output_exists(page_meta: fm.PageMeta, stage: str, params: dict) -> bool:
+    if stage == CLEANUP:
+        return page_meta.has_preprocessed_html
+    elif stage == DISTANCES:
+        return page_meta.has_precomputed_distances
+    elif stage == DATA_REGIONS:
+        return page_meta.has_precomputed_data_regions(
+            params["threshold"], params["max_tags_per_gnode"]
+        )
+    elif stage == DATA_RECORDS:
+        return page_meta.has_precomputed_data_records(
+            core.MDREditDistanceThresholds(
+                params["data_region"], params["find_records_1"], params["find_records_n"]
+            ),
+            params["max_tags_per_gnode"],
+        )
+    raise ValueError("Unknown stage `{}`.".format(stage))
+
+
+def output_sha256(page_meta: fm.PageMeta, stage: str, params: dict) -> Optional[str]:
+    """ The content hash of the stage's result, None if it is missing (or only in a legacy file). """
+    if stage == CLEANUP:
+        return _html_identity(page_meta.preprocessed_html_sha256, page_meta.preprocessed_html)
+    elif stage == DISTANCES:
+        path = page_meta.distances_bin
+        if not path.exists():
+            return None
+        stat = path.stat()
+        return _file_sha256(path, stat.st_mtime_ns, stat.st_size)
+    elif stage in (DATA_REGIONS, DATA_RECORDS):
+        kind = fm.BUNDLE_DATA_REGIONS if stage == DATA_REGIONS else fm.BUNDLE_DATA_RECORDS
+        payload = page_meta.bundle.get(kind, params)
+        return None if payload is None else hashlib.sha256(payload).hexdigest()
+    raise ValueError("Unknown stage `{}`.".format(stage))
+
+
+def _recorded_stamp(page_meta: fm.PageMeta, stage: str, params: dict) -> Optional[str]:
+    """ The stamp recorded with the stage's result, the one it'd be adopted with if it is unstamped. """
+    recorded_stamp = page_meta.bundle.get_stamp(stage, params)
+    if recorded_stamp is None and _output_exists(page_meta, stage, params):
+        return stamp(page_meta, stage, params)
+    return recorded_stamp
+
+
+def stamp(page_meta: fm.PageMeta, stage: str, params: dict) -> Optional[str]:
+    """
+        The stamp of the stage's result if it was computed now (from the upstream results as they were
+         recorded), None if an input is missing.
+    """
+    if stage == CLEANUP:
+        inputs = {"raw_html": _html_identity(page_meta.raw_html_sha256, page_meta.raw_html)}
+    else:
+        inputs = {}
+        for upstream_stage, upstream_params in _upstream(stage, params):
+            if upstream_stage == CLEANUP:
+                inputs["preprocessed_html"] = _html_identity(
+                    page_meta.preprocessed_html_sha256, page_meta.preprocessed_html
+                )
+            else:
+                inputs[upstream_stage] = _recorded_stamp(page_meta, upstream_stage, upstream_params)
+    if any(identity is None for identity in inputs.values()):
+        return None
+
+    stamped = {
+        "stage": stage,
+        "version": STAGES_VERSIONS[stage],
+        "params": json.loads(page_bundle.params_key(params)),
+        "inputs": inputs,
+    }
+    if stage == CLEANUP and fm.preprocessing_profile != fm.PREPROCESSING_PROFILE_DEFAULT:
+        # not in the stamps of the default profile, so they stayed valid when the profiles were introduced
+        stamped["profile"] = fm.preprocessing_profile
+    return hashlib.sha256(json.dumps(stamped, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _is_upstream_up_to_date(page_meta: fm.PageMeta, stage: str, params: dict) -> bool:
+    return all(
+        status(page_meta, upstream_stage, upstream_params) in (UP_TO_DATE, UNSTAMPED)
+        for upstream_stage, upstream_params in _upstream(stage, params)
+    )
+
+
+def status(page_meta: fm.PageMeta, stage: str, params: dict) -> str:
+    current_stamp = stamp(page_meta, stage, params)
+    if current_stamp is None:
+        return MISSING_INPUTS
+    if not _is_upstream_up_to_date(page_meta, stage, params):
+        return STALE_UPSTREAM
+    if not _output_exists(page_meta, stage, params):
+        return MISSING
+    recorded_stamp = page_meta.bundle.get_stamp(stage, params)
+    if recorded_stamp is None:
+        return UNSTAMPED
+    return UP_TO_DATE if recorded_stamp == current_stamp else STALE
+
+
+def record(page_meta: fm.PageMeta, stage: str, params: dict) -> None:
+    """ To be called once the stage's result has been persisted, its upstream results must be up-to-date. """
+    for upstream_stage, upstream_params in _upstream(stage, params):
+        upstream_status = check(page_meta, upstream_stage, upstream_params)
+        assert upstream_status == UP_TO_DATE, (
+            "The upstream result is not up-to-date, its stage must run first. "
+            "page_id={} stage={} upstream_stage={} upstream_status={}".format(
+                page_meta.page_id, stage, upstream_stage, upstream_status
+            )
+        )
+    current_stamp = stamp(page_meta, stage, params)
+    assert current_stamp is not None, "The inputs are missing. page_id={} stage={}".format(
+        page_meta.page_id, stage
+    )
+    page_meta.bundle.put_stamp(stage, params, current_stamp)
+
+
+def check(page_meta: fm.PageMeta, stage: str, params: dict) -> str:
+    """
+        Like `status`, but the unstamped results are adopted (their stamp is recorded) and up-to-date.
+        To be called before running the stage, it refuses to if an upstream result is not up-to-date.
+    """
+    stage_status = status(page_meta, stage, params)
+    assert stage_status != STALE_UPSTREAM, (
+        "An upstream result is not up-to-date, its stage must run first. "
+        "page_id={} stage={} params={}".format(page_meta.page_id, stage, params)
+    )
+    if stage_status == UNSTAMPED:
+        logging.info(
+            "Adopting a result computed before the stamps. page_id=%s stage=%s params=%s",
+            page_meta.page_id,
+            stage,
+            params,
+        )
+        record(page_meta, stage, params)
+        stage_status = UP_TO_DATE
+    return stage_status
+
+
+def plan(pages: List[fm.PageMeta], stages: List[Tuple[str, dict]]) -> List[Step]:
+    """
+        What would run (dry-run) for the given stages (and parameters), in the order they are given.
+        Nothing is written.
+    """
+    steps = []
+    for page_meta in pages:
+        will_run = set()
+        for stage, params in stages:
+            stage_status = status(page_meta, stage, params)
+            upstream_will_run = any(
+                (upstream_stage, page_bundle.params_key(upstream_params)) in will_run
+                for upstream_stage, upstream_params in _upstream(stage, params)
+            )
+            if upstream_will_run and stage_status in (
+                UP_TO_DATE,
+                UNSTAMPED,
+                MISSING_INPUTS,
+                STALE_UPSTREAM,
+            ):
+                stage_status = UPSTREAM_WILL_RUN
+            if stage_status in (MISSING, STALE, UPSTREAM_WILL_RUN):
+                will_run.add((stage, page_bundle.params_key(params)))
+            steps.append(Step(page_meta.page_id, stage, params, stage_status))
+    return steps
+
+
+def summarize(steps: List[Step]) -> Dict[str, Dict[str, int]]:
+    """ {stage: {status: number of steps}} """
+    summary = collections.defaultdict(collections.Counter)
+    for step in steps:
+        summary[step.stage][step.status] += 1
+    return {stage: dict(counts) for stage, counts in summary.items()}
@@ -1,23 +1,24 @@
 """
 Module dependencies:
-    all - {core, files_management, utils} -> prepostprocessing
+    all - {core, downloader, files_management, pipeline, utils} -> prepostprocessing
+
+The stages skip the results that are up-to-date and recompute the stale ones, see `pipeline`.
+Importing it is cheap: nothing is read nor created until it's used (see `files_management`), and the download's
+ dependencies are imported by `download_raw`.
 
 """
 
 import datetime
 import logging
-import urllib
-import urllib.request
-import urllib.response
 from typing import Tuple
 
 import lxml
 import lxml.etree
 import lxml.html
-import retrying
 
 import core
 import files_management as fm
+import pipeline
 
 
 logging.basicConfig(
@@ -27,12 +28,24 @@ logging.basicConfig(
 
 SEC = 1000  # in ms
 
-all_metas = fm.PageMeta.get_all()
+# dropped with their content (and tail text) by the cleanup
+CLEANUP_DROPPED_TAGS = ("script", "style", "meta")
+
+
+def download_raw(
+    page_meta: fm.PageMeta, force_override: bool = False, refresh: bool = False
+) -> None:
+    """ See `downloader.Downloader.download` for `refresh` (and to download many pages). """
+    # only needed to download, they are slow to import
+    import urllib.error
+    import urllib.request
 
+    import retrying
+
+    import downloader
 
-def download_raw(page_meta: fm.PageMeta, force_override: bool = False) -> None:
     logging.info("page_id=%s", page_meta.page_id)
-    exists = page_meta.raw_html.exists()
+    exists = page_meta.has_raw_html
 
     if exists:
         logging.info(
@@ -40,12 +53,16 @@ def download_raw(page_meta: fm.PageMeta, force_override: bool = False) -> None:
         )
         if force_override:
             logging.info("It will be overwritten. page_id=%s", page_meta.page_id)
+        elif refresh:
+            logging.info("It will be overwritten if it changed. page_id=%s", page_meta.page_id)
         else:
             logging.info("Operation skipped. page_id=%s", page_meta.page_id)
             return
     else:
         logging.info("Raw page will be downloaded. page_id=%s", page_meta.page_id)
 
+    headers = downloader.conditional_headers(page_meta) if exists and not force_override else {}
+
     @retrying.retry(
         stop_max_attempt_number=10,
         wait_exponential_multiplier=SEC,
@@ -54,32 +71,44 @@ def download_raw(page_meta: fm.PageMeta, force_override: bool = False) -> None:
     )
     def call_url():
         logging.info("Requesting the page...  page_id=%s", page_meta.page_id)
-        response = urllib.request.urlopen(page_meta.url, timeout=10)
+        request = urllib.request.Request(page_meta.url, headers=headers)
+        try:
+            response = urllib.request.urlopen(request, timeout=10)
+        except urllib.error.HTTPError as ex:
+            if ex.code == 304:
+                return None
+            raise
         page_binary = response.read()
-        return page_binary
+        return page_binary, response.headers
 
     try:
-        page = call_url()
+        response = call_url()
     except retrying.RetryError:
         logging.warning(
             "Failed download the page, returning. page_id=%s", page_meta.page_id,
         )
         return
 
-    logging.info("Writing down the file. page_id=%s", page_meta.page_id)
-    fm.PageMeta.persist_html(page_meta.raw_html, page)
+    if response is None:
+        logging.info("Not modified, returning. page_id=%s", page_meta.page_id)
+        return
 
-    logging.info("Saving download time in metadata file. page_id=%s", page_meta.page_id)
+    logging.info(
+        "Storing the page and saving download time in metadata. page_id=%s", page_meta.page_id
+    )
+    page, response_headers = response
     now = datetime.datetime.now()
-    page_meta.persist_download_datetime(now)
+    page_meta.persist_raw_html(
+        page, download_datetime=now, **downloader.response_validators(response_headers)
+    )
     logging.info("Done. page_id=%s", page_meta.page_id)
 
 
 def cleanup_html(page_meta: fm.PageMeta, force_override: bool = False) -> None:
     logging.info("page_id=%s", page_meta.page_id)
-    exists = page_meta.preprocessed_html.exists()
+    status = pipeline.check(page_meta, pipeline.CLEANUP, {})
 
-    if exists:
+    if status == pipeline.UP_TO_DATE:
         logging.info(
             "Page has already been preprocessed. page_id=%s", page_meta.page_id,
         )
@@ -88,22 +117,31 @@ def cleanup_html(page_meta: fm.PageMeta, force_override: bool = False) -> None:
         else:
             logging.info("Operation skipped. page_id=%s", page_meta.page_id)
             return
+    elif status == pipeline.STALE:
+        logging.info(
+            "The preprocessed page is stale, it will be recomputed. page_id=%s", page_meta.page_id
+        )
     else:
         logging.info("Raw page will be preprocessed. page_id=%s", page_meta.page_id)
 
     logging.info(
-        "Opening raw html file by removing stuff. page_id=%s", page_meta.page_id,
-    )
-    doc = fm.open_html_document(page_meta.raw_html, remove_stuff=True)
-    logging.info(
-        "Stripping <meta>, <script>, and <style> tags. page_id=%s", page_meta.page_id,
+        "Cleaning the raw html (removing stuff and <meta>, <script> and <style> tags). page_id=%s",
+        page_meta.page_id,
     )
-    lxml.etree.strip_elements(doc, "script")
-    lxml.etree.strip_elements(doc, "style")
-    lxml.etree.strip_elements(doc, "meta")
-
-    logging.info("Writing down the file. page_id=%s", page_meta.page_id)
-    fm.PageMeta.persist_html(page_meta.preprocessed_html, doc)
+    with page_meta.open_raw_html() as file:
+        doc, node_names = fm.clean_html(file, CLEANUP_DROPPED_TAGS)
+    if fm.preprocessing_profile == fm.PREPROCESSING_PROFILE_PRUNED:
+        logging.info("Pruning the subtrees without candidate tags. page_id=%s", page_meta.page_id)
+        core.prune(doc)
+        # the pruned nodes are not in the tree anymore
+        node_names = core.NodeNamer.sidecar_of(doc)
+
+    logging.info("Storing the preprocessed page. page_id=%s", page_meta.page_id)
+    page_meta.persist_preprocessed_html(doc)
+    page_meta.persist_node_names(node_names)
+    # read by the scheduling of the batches, so they don't parse the pages again
+    page_meta.persist_tree_profile(core.tree_profile(doc))
+    pipeline.record(page_meta, pipeline.CLEANUP, {})
 
     logging.info("Done. page_id=%s", page_meta.page_id)
 
@@ -112,25 +150,37 @@ def precompute_distances(
     page_meta: fm.PageMeta, minimum_depth, max_tag_per_gnode, force_override: bool = False
 ):
     logging.info("page_id=%s", page_meta.page_id)
-    exists = page_meta.distances_pkl.exists()
+    status = pipeline.check(page_meta, pipeline.DISTANCES, {})
+    precomputed = {}
 
-    if exists:
+    if status == pipeline.STALE:
+        logging.info(
+            "The distances are stale, they will be recomputed. page_id=%s", page_meta.page_id
+        )
+    elif status == pipeline.UP_TO_DATE:
         logging.info(
             "Distances have already been precomputed, checking parameters... page_id=%s",
             page_meta.page_id,
         )
         precomputed = page_meta.load_precomputed_distances()
-        precomputed_minimum_depth = precomputed["minimum_depth"]
-        precomputed_max_tag_per_gnode = precomputed["max_tag_per_gnode"]
+        precomputed_minimum_depth = precomputed[core.DICT_PARAM_MINIMUM_DEPTH]
+        precomputed_max_tag_per_gnode = precomputed[core.DICT_PARAM_TAG_PER_GNODE]
         precomputed_was_more_restrictive = (
             precomputed_max_tag_per_gnode < max_tag_per_gnode
             or precomputed_minimum_depth > minimum_depth
         )
         if force_override:
             logging.info("It will be overwritten. page_id=%s", page_meta.page_id)
+            precomputed = {}
         elif precomputed_was_more_restrictive:
+            # the result covers both the previous and the requested parameters
+            minimum_depth = min(minimum_depth, precomputed_minimum_depth)
+            max_tag_per_gnode = max(max_tag_per_gnode, precomputed_max_tag_per_gnode)
             logging.info(
-                "The previously computed was more restrictive. It'll be overwritten. page_id=%s",
+                "The previously computed was more restrictive. It'll be completed up to "
+                "minimum_depth=%d max_tag_per_gnode=%d. page_id=%s",
+                minimum_depth,
+                max_tag_per_gnode,
                 page_meta.page_id,
             )
         else:
@@ -143,10 +193,13 @@ def precompute_distances(
 
     logging.info("Computing distances. page_id=%s", page_meta.page_id)
     distances = {}
-    core.compute_distances(doc, distances, {}, node_namer, minimum_depth, max_tag_per_gnode)
+    core.compute_distances(
+        doc, distances, precomputed, node_namer, minimum_depth, max_tag_per_gnode
+    )
 
     logging.info("Persisting distances. page_id=%s", page_meta.page_id)
     page_meta.persist_precomputed_distances(distances, minimum_depth, max_tag_per_gnode)
+    pipeline.record(page_meta, pipeline.DISTANCES, {})
 
     logging.info("Done. page_id=%s", page_meta.page_id)
 
@@ -160,11 +213,19 @@ def precompute_data_regions(
 ):
     logging.info("page_id=%s", page_meta.page_id)
 
-    assert page_meta.distances_pkl.exists(), "Distances have NOT been precomputed!"
+    assert page_meta.has_precomputed_distances, "Distances have NOT been precomputed!"
 
-    exists = page_meta.data_regions_pkl(threshold, max_tags_per_gnode).exists()
+    stage_params = pipeline.data_regions_params(threshold, max_tags_per_gnode)
+    status = pipeline.check(page_meta, pipeline.DATA_REGIONS, stage_params)
 
-    if exists:
+    if status == pipeline.STALE:
+        logging.info(
+            "The data regions are stale, they will be recomputed. page_id=%s th=%.2f max_tags=%d",
+            page_meta.page_id,
+            threshold,
+            max_tags_per_gnode,
+        )
+    elif status == pipeline.UP_TO_DATE:
         logging.info(
             "The data regions have already been precomputed, checking parameters... page_id=%s th=%.2f max_tags=%d",
             page_meta.page_id,
@@ -236,6 +297,7 @@ def precompute_data_regions(
     page_meta.persist_precomputed_data_regions(
         data_regions, threshold, minimum_depth, max_tags_per_gnode
     )
+    pipeline.record(page_meta, pipeline.DATA_REGIONS, stage_params)
 
     logging.info(
         "Done. page_id=%s th=%.2f max_tags=%d", page_meta.page_id, threshold, max_tags_per_gnode
@@ -250,14 +312,22 @@ def precompute_data_records(
 ):
     logging.info("page_id=%s", page_meta.page_id)
 
-    assert page_meta.distances_pkl.exists(), "Distances have NOT been precomputed!"
-    assert page_meta.data_regions_pkl(
+    assert page_meta.has_precomputed_distances, "Distances have NOT been precomputed!"
+    assert page_meta.has_precomputed_data_regions(
         thresholds.data_region, max_tags_per_gnode
     ), "Data regions have NOT been precomputed!"
 
-    exists = page_meta.data_records_pkl(thresholds, max_tags_per_gnode).exists()
+    stage_params = pipeline.data_records_params(thresholds, max_tags_per_gnode)
+    status = pipeline.check(page_meta, pipeline.DATA_RECORDS, stage_params)
 
-    if exists:
+    if status == pipeline.STALE:
+        logging.info(
+            "The data records are stale, they will be recomputed. page_id=%s th=%s max_tags=%d",
+            page_meta.page_id,
+            thresholds,
+            max_tags_per_gnode,
+        )
+    elif status == pipeline.UP_TO_DATE:
         logging.info(
             "The data records have already been precomputed. page_id=%s th=%s max_tags=%d",
             page_meta.page_id,
@@ -320,6 +390,7 @@ def precompute_data_records(
         max_tags_per_gnode,
     )
     page_meta.persist_precomputed_data_records(data_records, thresholds, max_tags_per_gnode)
+    pipeline.record(page_meta, pipeline.DATA_RECORDS, stage_params)
 
     logging.info(
         "Done. page_id=%s th=%s max_tags=%d", page_meta.page_id, thresholds, max_tags_per_gnode
@@ -327,33 +398,24 @@ def precompute_data_records(
 
 
 def get_named_nodes_html(page_meta: fm.PageMeta) -> Tuple[core.NodeNamer, lxml.html.HtmlElement]:
+    """ The nodes' names are replayed on the preprocessed html, see `core.NodeNamer`. """
+    assert page_meta.has_preprocessed_html
+    logging.info("Opening preprocessed html. page_id=%s", page_meta.page_id)
+    root = page_meta.get_preprocessed_html_tree()
+    node_namer = core.NodeNamer()
 
-    if page_meta.named_nodes_html.exists():
-        logging.info(
-            "Loading the named nodes html. page_id=%s", page_meta.page_id,
-        )
-        root = page_meta.get_named_nodes_html_tree()
-
-        logging.info("Loading node namer. page_id=%s", page_meta.page_id)
-        node_namer = core.NodeNamer(for_loaded_file=True)
+    if page_meta.has_node_names:
+        logging.info("Replaying the node names. page_id=%s", page_meta.page_id)
+        node_namer.load(root, page_meta.load_node_names())
 
     else:
         logging.info(
-            "Named nodes have NOT been saved, computing it. page_id=%s", page_meta.page_id,
+            "Node names have NOT been saved, computing them. page_id=%s", page_meta.page_id,
         )
-
-        assert page_meta.preprocessed_html.exists()
-        logging.info("Opening preprocessed html. page_id=%s", page_meta.page_id)
-        root = page_meta.get_preprocessed_html_tree()
-
-        logging.info("Loading node namer. page_id=%s", page_meta.page_id)
-        node_namer = core.NodeNamer()
         node_namer.load(root)
 
-        logging.info(
-            "Saving named nodes html. page_id=%s", page_meta.page_id,
-        )
-        fm.PageMeta.persist_html(page_meta.named_nodes_html, root)
+        logging.info("Saving node names. page_id=%s", page_meta.page_id)
+        page_meta.persist_node_names(node_namer.sidecar)
     return node_namer, root
 
 
@@ -0,0 +1,220 @@
+"""
+Module dependencies:
+    all -> synthetic
+
+Seeded generator of synthetic html pages with a known number of data records, for the benchmarks (see
+ `benchmark`) and the tests, with shapes beyond the ones of the real pages.
+
+A page is `html > body > div * depth` and then its data regions: tables of rows (`tr`) or lists of items (`li`),
+ `fanout` of them in each region, consecutive runs of `record_period` of them make a record (its gnode size),
+ e.g. a fanout of 20 with a period of 2 is a region of 10 records (an incomplete last run is not a record).
+The tags of a record are different from each other (their number of cells grows along the record), so that a
+ period of k is not found as records of size 1.
+Each record's first cell has `nesting` levels of tables/lists in it (alternating with the region's kind), of
+ `_NESTED_FANOUT` items each, every item is a record of its own (nested regions are data regions too).
+The number of data records of a page (its label) counts the ones of the regions and of the nested regions.
+
+The noise changes the structure of a tag of a record with the probability `noise_rate`: a cell is removed or an
+ extra one is added. The texts are random words of `text_length` characters.
+
+MDR (`core.MDR` with the defaults of `benchmark`) finds the label of the pages without noise and with a
+ `record_period` of 1 with all its thresholds at `MDR_THRESHOLD` (and above), but not at lower thresholds
+ (e.g. none at 0.3): the edit distances of `core` are similarity ratios, the lower the threshold the stricter.
+ The records of a longer period are not found as such, MDR counts their parts (tags or cells), so the pages of
+ a corpus are only labeled if MDR is expected to find their label (see `is_labeled`), the others are only timed.
+
+Usage (write a corpus for `benchmark.py`, one page per combination of the values, with its `labels.json`):
+    python synthetic.py path/to/corpus-dir [--fanout 10 100 1000] [--record-period 1 2 3] [--depth 3]
+        [--n-regions 1] [--noise-rate 0] [--text-length 8] [--nesting 0] [--kind table] [--seed 0]
+    python benchmark.py run path/to/corpus-dir --threshold 0.9
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import pathlib
+import random
+import string
+
+import lxml
+import lxml.etree
+import lxml.html
+
+TABLE = "table"
+LIST = "list"
+MIXED = "mixed"  # the regions alternate between tables and lists
+KINDS = (TABLE, LIST, MIXED)
+
+# the tags of a region, of its records' tags and of their cells, by kind
+_TAGS = {TABLE: ("table", "tr", "td"), LIST: ("ul", "li", "span")}
+
+# of the tables/lists nested in the records
+_NESTED_FANOUT = 3
+
+# the thresholds at which MDR finds the labels (see above)
+MDR_THRESHOLD = 0.9
+
+PageParams = collections.namedtuple(
+    "PageParams",
+    [
+        "depth",
+        "fanout",
+        "record_period",
+        "n_regions",
+        "noise_rate",
+        "text_length",
+        "nesting",
+        "kind",
+        "seed",
+    ],
+)
+DEFAULT_PARAMS = PageParams(
+    depth=3,
+    fanout=20,
+    record_period=1,
+    n_regions=1,
+    noise_rate=0.0,
+    text_length=8,
+    nesting=0,
+    kind=TABLE,
+    seed=0,
+)
+
+SyntheticPage = collections.namedtuple("SyntheticPage", ["params", "root", "n_data_records"])
+
+
+def _text(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def _other_kind(kind: str) -> str:
+    return LIST if kind == TABLE else TABLE
+
+
+def _nested(rng: random.Random, kind: str, levels: int, text_length: int) -> lxml.html.HtmlElement:
+    region_tag, item_tag, cell_tag = _TAGS[kind]
+    region = lxml.html.Element(region_tag)
+    for _ in range(_NESTED_FANOUT):
+        item = lxml.etree.SubElement(region, item_tag)
+        cell = lxml.etree.SubElement(item, cell_tag)
+        if levels > 1:
+            cell.append(_nested(rng, _other_kind(kind), levels - 1, text_length))
+        else:
+            cell.text = _text(rng, text_length)
+    return region
+
+
+def _region(rng: random.Random, kind: str, params: PageParams) -> lxml.html.HtmlElement:
+    region_tag, item_tag, cell_tag = _TAGS[kind]
+    region = lxml.html.Element(region_tag)
+    for index in range(params.fanout):
+        position = index % params.record_period
+        item = lxml.etree.SubElement(region, item_tag)
+        n_cells = position + 1
+        if rng.random() < params.noise_rate:
+            n_cells += 1 if n_cells == 1 or rng.random() < 0.5 else -1
+        for cell_index in range(n_cells):
+            cell = lxml.etree.SubElement(item, cell_tag)
+            if cell_index == 0 and position == 0 and params.nesting > 0:
+                cell.append(_nested(rng, _other_kind(kind), params.nesting, params.text_length))
+            else:
+                cell.text = _text(rng, params.text_length)
+    return region
+
+
+def generate_page(params: PageParams = DEFAULT_PARAMS) -> SyntheticPage:
+    """ The same parameters (including the seed) give the same page. """
+    assert params.kind in KINDS, "Unknown kind `{}`, see {}.".format(params.kind, KINDS)
+    assert params.fanout >= 0 and params.record_period >= 1 and params.depth >= 0
+    rng = random.Random(params.seed)
+    root = lxml.html.Element("html")
+    parent = lxml.etree.SubElement(root, "body")
+    for _ in range(params.depth):
+        parent = lxml.etree.SubElement(parent, "div")
+
+    kinds = (TABLE, LIST) if params.kind == MIXED else (params.kind,)
+    for region_index in range(params.n_regions):
+        # the regions are separated, so they are not taken for a single one
+        container = lxml.etree.SubElement(parent, "div")
+        container.text = _text(rng, params.text_length)
+        container.append(_region(rng, kinds[region_index % len(kinds)], params))
+
+    return SyntheticPage(params, root, n_data_records(params))
+
+
+def n_data_records(params: PageParams) -> int:
+    """ Of the regions and of the regions nested in them. """
+    n_records = params.fanout // params.record_period
+    # the first item of an incomplete last run has nested regions too
+    n_nesting_items = -(-params.fanout // params.record_period)
+    n_nested_records = sum(_NESTED_FANOUT ** level for level in range(1, params.nesting + 1))
+    return params.n_regions * (n_records + n_nesting_items * n_nested_records)
+
+
+def is_labeled(params: PageParams) -> bool:
+    """ If MDR is expected to find the number of data records of the page (see above). """
+    return params.record_period == 1 and params.noise_rate == 0
+
+
+def to_html(page: SyntheticPage) -> bytes:
+    return lxml.html.tostring(page.root, doctype="<!DOCTYPE html>")
+
+
+def page_name(params: PageParams) -> str:
+    return (
+        "synthetic-{kind}-depth={depth}-fanout={fanout}-period={record_period}-regions={n_regions}"
+        "-noise={noise_rate}-text={text_length}-nesting={nesting}-seed={seed}".format(
+            **params._asdict()
+        )
+    )
+
+
+def write_corpus(directory: pathlib.Path, params_list: list) -> None:
+    """
+    The pages as html files and their number of data records in `labels.json` (see `benchmark`), only for the
+     pages that are labeled (see `is_labeled`).
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    labels = {}
+    for params in params_list:
+        page = generate_page(params)
+        filename = page_name(params) + ".html"
+        directory.joinpath(filename).write_bytes(to_html(page))
+        if is_labeled(params):
+            labels[filename] = page.n_data_records
+    directory.joinpath("labels.json").write_text(json.dumps(labels, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic pages for the benchmarks.")
+    parser.add_argument("directory", type=pathlib.Path)
+    parser.add_argument("--depth", type=int, nargs="+", default=[DEFAULT_PARAMS.depth])
+    parser.add_argument("--fanout", type=int, nargs="+", default=[DEFAULT_PARAMS.fanout])
+    parser.add_argument(
+        "--record-period", type=int, nargs="+", default=[DEFAULT_PARAMS.record_period]
+    )
+    parser.add_argument("--n-regions", type=int, nargs="+", default=[DEFAULT_PARAMS.n_regions])
+    parser.add_argument("--noise-rate", type=float, nargs="+", default=[DEFAULT_PARAMS.noise_rate])
+    parser.add_argument("--text-length", type=int, nargs="+", default=[DEFAULT_PARAMS.text_length])
+    parser.add_argument("--nesting", type=int, nargs="+", default=[DEFAULT_PARAMS.nesting])
+    parser.add_argument("--kind", choices=KINDS, nargs="+", default=[DEFAULT_PARAMS.kind])
+    parser.add_argument("--seed", type=int, nargs="+", default=[DEFAULT_PARAMS.seed])
+    args = parser.parse_args()
+    write_corpus(
+        args.directory,
+        [
+            PageParams(*values)
+            for values in itertools.product(
+                args.depth,
+                args.fanout,
+                args.record_period,
+                args.n_regions,
+                args.noise_rate,
+                args.text_length,
+                args.nesting,
+                args.kind,
+                args.seed,
+            )
+        ],
+    )
@@ -1,8 +1,12 @@
 """
 Module dependencies:
     all -> utils
+
+`graphviz` (only for the html graphs) and `yaml` (only for the config) are imported when they are first used,
+ importing this module (e.g. through `core`) is cheap.
 """
 
+import functools
 import os
 import pathlib
 import pprint
@@ -13,8 +17,6 @@ from typing import List, Optional, Dict
 import lxml
 import lxml.etree
 import lxml.html
-import graphviz
-import yaml
 
 DOT_NAMING_OPTION_HIERARCHICAL = "hierarchical"
 DOT_NAMING_OPTION_SEQUENTIAL = "sequential"
@@ -43,7 +45,7 @@ def generate_random_colors(n: int) -> List[str]:
 
 def html_to_dot_sequential_name(
     root: lxml.html.HtmlElement, graph_name: str, with_text: bool = False
-) -> graphviz.Digraph:
+) -> "graphviz.Digraph":
     """
     The names of the nodes are defined by `{tag}-{seq - 1}`, where:
         tag: the html tag of the node
@@ -62,6 +64,8 @@ def html_to_dot_sequential_name(
                        -> div-1 -> div-2 -> span-0
                                          -> span-1
     """
+    import graphviz
+
     graph = graphviz.Digraph(name=graph_name)
     tag_counts = defaultdict(int)
 
@@ -88,7 +92,7 @@ def html_to_dot_sequential_name(
 
 def html_to_dot_hierarchical_name(
     root: lxml.html.HtmlElement, graph_name: str, with_text=False
-) -> graphviz.Digraph:
+) -> "graphviz.Digraph":
     """
     The names of the nodes are defined by `{tag}-{index-path-to-node}`, where:
         tag: the html tag of the node
@@ -109,6 +113,8 @@ def html_to_dot_hierarchical_name(
         graph_name: parameter passed to the graphviz method
         with_text: if True, the pure text in the deepest node is also included in the graph as an extra node.
     """
+    import graphviz
+
     graph = graphviz.Digraph(name=graph_name)
 
     def add_node(
@@ -145,7 +151,7 @@ def html_to_dot_hierarchical_name(
 
 def html_to_dot(
     root, graph_name="html-graph", name_option=DOT_NAMING_OPTION_HIERARCHICAL, with_text=False,
-) -> graphviz.Digraph:
+) -> "graphviz.Digraph":
     """
     Args:
         root:
@@ -181,7 +187,11 @@ class FormatPrinter(pprint.PrettyPrinter):
 project_path = pathlib.Path(os.path.realpath(__file__)).parent.parent.absolute()
 
 
+@functools.lru_cache(maxsize=1)
 def get_config_dict() -> dict:
+    """ Read once per process, don't modify it. """
+    import yaml
+
     config = project_path.joinpath("config.yml").absolute()
     with config.open("r") as f:
         config_dict = yaml.load(f, Loader=yaml.FullLoader)
@@ -1,4 +1,11 @@
-from unittest import TestCase
+from unittest import TestCase, mock
+
+import artifacts_manager
+import files_management
+import html_store
+import prepostprocessing
+from src.api import main
+from test import helpers
 
 
 class TestApi(TestCase):
@@ -10,3 +17,30 @@ class TestApi(TestCase):
 
     def test_save_page_execute(self):
         self.fail()
+
+    def test_outputs_budget_sees_the_stages_accesses(self):
+        """ The eviction ranks the artifacts by the accesses the stages record in the same access log. """
+        self.assertIs(main.fm, prepostprocessing.fm)
+        tmp_dir = helpers.patch_outputs(self)
+        with mock.patch.object(files_management, "outputs_dir", tmp_dir):
+            artifacts = files_management._open_artifacts()
+        # where the artifacts manager looks for it
+        store = html_store.HtmlStore(tmp_dir.joinpath("html_store"))
+        for patch in (
+            mock.patch.object(main.fm, "artifacts", artifacts),
+            mock.patch.object(files_management, "htmls_store", store),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        page_meta = files_management.PageMeta.register("https://a.com", 1)
+        page_meta.persist_raw_html(b"<html><body><p>a</p><p>b</p></body></html>")
+        prepostprocessing.cleanup_html(page_meta)
+
+        key = artifacts_manager.html_key(page_meta.raw_html_sha256)
+        accesses = main.fm.artifacts.access_log.get_all()
+        self.assertIn(key, accesses)
+        self.assertEqual(
+            accesses[key],
+            {artifact.key: artifact.last_access for artifact in main.fm.artifacts.scan()}[key],
+        )
@@ -0,0 +1,49 @@
+import pathlib
+import tempfile
+from unittest import TestCase, mock
+
+import artifacts_manager
+import files_management
+import html_store
+import metadata_store
+
+
+def patch_outputs(test_case: TestCase) -> pathlib.Path:
+    """
+    Point the outputs of `files_management` (directories, html store, pages' metadata and artifacts' access
+     log) to a new temporary directory, until the end of the test.
+
+    Returns:
+        the temporary directory
+    """
+    tmp_dir = tempfile.TemporaryDirectory()
+    test_case.addCleanup(tmp_dir.cleanup)
+    tmp_path = pathlib.Path(tmp_dir.name)
+    patches = [
+        mock.patch.object(files_management, name, tmp_path)
+        for name in (
+            "raw_htmls_dir",
+            "preprocessed_htmls_dir",
+            "intermediate_results_dir",
+            "results_dir",
+        )
+    ]
+    patches += [
+        mock.patch.object(
+            files_management, "htmls_store", html_store.HtmlStore(tmp_path.joinpath("store"))
+        ),
+        mock.patch.object(
+            files_management,
+            "metas_store",
+            metadata_store.MetadataStore(tmp_path.joinpath("pages-meta.sqlite")),
+        ),
+        mock.patch.object(
+            files_management,
+            "artifacts_access",
+            artifacts_manager.AccessLog(tmp_path.joinpath("artifacts-access.sqlite")),
+        ),
+    ]
+    for patch in patches:
+        patch.start()
+        test_case.addCleanup(patch.stop)
+    return tmp_path
@@ -0,0 +1,168 @@
+import pathlib
+import tempfile
+from unittest import TestCase
+
+import artifacts_manager
+import html_store
+import page_bundle
+
+
+class TestArtifactsManager(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.outputs_dir = pathlib.Path(self._tmp_dir.name)
+        for name in ("raw_htmls", "preprocessed_htmls", "intermediate_results", "results"):
+            self.outputs_dir.joinpath(name).mkdir()
+        self.access_log = artifacts_manager.AccessLog(
+            self.outputs_dir.joinpath("artifacts-access.sqlite")
+        )
+        self.htmls_store = html_store.HtmlStore(self.outputs_dir.joinpath("html_store"))
+        self.htmls_kinds = {}
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _manager(self, budget_bytes, evict_raw_htmls=False):
+        return artifacts_manager.ArtifactsManager(
+            self.outputs_dir,
+            budget_bytes,
+            self.access_log,
+            lambda: self.htmls_kinds,
+            evict_raw_htmls=evict_raw_htmls,
+        )
+
+    def _write(self, relative_path: str, n_bytes: int) -> pathlib.Path:
+        path = self.outputs_dir.joinpath(relative_path)
+        path.write_bytes(b"x" * n_bytes)
+        return path
+
+    def _populate(self):
+        self._write("raw_htmls/p0-raw.html", 1000)
+        self._write("results/p0-colored.html", 1000)
+        self._write("intermediate_results/p0-distances.bin", 1000)
+        self._write("intermediate_results/p1-distances.bin", 1000)
+        self.htmls_kinds[self.htmls_store.put(b"<html>preprocessed</html>")] = (
+            artifacts_manager.PREPROCESSED_HTML
+        )
+        self.htmls_store.put(b"<html>orphan</html>")
+        bundle = page_bundle.PageBundle(
+            self.outputs_dir.joinpath("intermediate_results/p0-bundle.sqlite")
+        )
+        bundle.put("data_records", {"threshold": 0.3}, b"r" * 500, n_records=2)
+        bundle.put("data_regions", {"threshold": 0.3}, b"r" * 500)
+
+    def test_scan(self):
+        self._populate()
+        kinds = sorted(artifact.kind for artifact in self._manager(None).scan())
+        self.assertEqual(
+            kinds,
+            sorted(
+                [
+                    artifacts_manager.RAW_HTML,
+                    artifacts_manager.RESULT,
+                    artifacts_manager.DISTANCES,
+                    artifacts_manager.DISTANCES,
+                    artifacts_manager.PREPROCESSED_HTML,
+                    artifacts_manager.ORPHAN_HTML,
+                    artifacts_manager.DATA_RECORDS,
+                    artifacts_manager.DATA_REGIONS,
+                ]
+            ),
+        )
+
+    def test_no_budget(self):
+        self._populate()
+        self.assertEqual(self._manager(None).plan_eviction(), [])
+
+    def test_cheapest_and_least_recently_used_first(self):
+        self._populate()
+        self.access_log.touch("intermediate_results/p0-distances.bin", now=2e9)
+        self.access_log.touch("intermediate_results/p1-distances.bin", now=1e9)
+
+        manager = self._manager(budget_bytes=0)
+        evicted = manager.plan_eviction()
+        self.assertEqual(
+            [artifact.kind for artifact in evicted],
+            [
+                artifacts_manager.ORPHAN_HTML,
+                artifacts_manager.RESULT,
+                artifacts_manager.PREPROCESSED_HTML,
+                artifacts_manager.DATA_RECORDS,
+                artifacts_manager.DATA_REGIONS,
+                artifacts_manager.DISTANCES,
+                artifacts_manager.DISTANCES,
+            ],
+        )
+        self.assertEqual(evicted[-2].key, "intermediate_results/p1-distances.bin")
+
+    def test_enforce_budget(self):
+        self._populate()
+        manager = self._manager(budget_bytes=None)
+        manager.scan()  # creates the access log
+        manager.budget_bytes = manager.n_bytes_on_disk() - 1500
+        evicted = manager.enforce_budget()
+        self.assertEqual(
+            [artifact.kind for artifact in evicted],
+            [
+                artifacts_manager.ORPHAN_HTML,
+                artifacts_manager.RESULT,
+                artifacts_manager.PREPROCESSED_HTML,
+                artifacts_manager.DATA_RECORDS,
+            ],
+        )
+        self.assertFalse(self.outputs_dir.joinpath("results/p0-colored.html").exists())
+        bundle = page_bundle.PageBundle(
+            self.outputs_dir.joinpath("intermediate_results/p0-bundle.sqlite")
+        )
+        self.assertEqual([artifact.kind for artifact in bundle.list()], ["data_regions"])
+        self.assertTrue(self.outputs_dir.joinpath("raw_htmls/p0-raw.html").exists())
+        self.assertGreaterEqual(sum(artifact.n_bytes for artifact in evicted), 1500)
+
+    def test_enforce_budget_in_background(self):
+        self._populate()
+        manager = self._manager(budget_bytes=None)
+        self.assertIsNone(manager.enforce_budget_in_background(0))
+        manager.scan()  # creates the access log
+        manager.budget_bytes = manager.n_bytes_on_disk() - 1500
+
+        # a single eviction at a time
+        with manager._enforcing:
+            self.assertIsNone(manager.enforce_budget_in_background(0))
+        thread = manager.enforce_budget_in_background(60)
+        self.assertIsNotNone(thread)
+        self.assertIsNone(manager.enforce_budget_in_background(60))
+        thread.join(timeout=60)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(self.outputs_dir.joinpath("results/p0-colored.html").exists())
+        bundle = page_bundle.PageBundle(
+            self.outputs_dir.joinpath("intermediate_results/p0-bundle.sqlite")
+        )
+        self.assertEqual([artifact.kind for artifact in bundle.list()], ["data_regions"])
+        # not running anymore, but it was just done
+        self.assertIsNone(manager.enforce_budget_in_background(60))
+
+    def test_raw_htmls_are_kept(self):
+        self._populate()
+        kinds = [artifact.kind for artifact in self._manager(budget_bytes=0).plan_eviction()]
+        self.assertNotIn(artifacts_manager.RAW_HTML, kinds)
+        kinds = [
+            artifact.kind
+            for artifact in self._manager(budget_bytes=0, evict_raw_htmls=True).plan_eviction()
+        ]
+        self.assertEqual(kinds[-1], artifacts_manager.RAW_HTML)
+
+    def test_access_log_resolution(self):
+        self.access_log.touch("a", now=1000)
+        self.access_log.touch("a", now=1000 + artifacts_manager.ACCESS_RESOLUTION_S - 1)
+        self.assertEqual(self.access_log.get_all(), {"a": 1000})
+        self.access_log.touch("a", now=1000 + artifacts_manager.ACCESS_RESOLUTION_S)
+        self.assertEqual(
+            self.access_log.get_all(), {"a": 1000 + artifacts_manager.ACCESS_RESOLUTION_S}
+        )
+
+    def test_report(self):
+        self._populate()
+        report = self._manager(budget_bytes=0).report()
+        self.assertIn(artifacts_manager.DISTANCES, report)
+        self.assertIn("to evict: 7 artifacts", report)
+
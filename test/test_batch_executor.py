@@ -0,0 +1,117 @@
+import os
+import pathlib
+import tempfile
+import time
+from unittest import TestCase
+
+import batch_executor
+
+
+def _work(item):
+    """ Stand-in for the pages' tasks. """
+    kind, arg = item
+    if kind == "sleep":
+        time.sleep(arg)
+    elif kind == "raise":
+        raise ValueError(arg)
+    elif kind == "allocate":
+        data = bytearray(arg)
+        # touch the pages, so they are resident
+        for i in range(0, len(data), 4096):
+            data[i] = 1
+        time.sleep(5)
+    elif kind == "exit":
+        os._exit(1)
+    return kind, arg, os.getpid()
+
+
+class TestWatchdogExecutor(TestCase):
+    def _map(self, items, **kwargs):
+        executor = batch_executor.WatchdogExecutor(_work, 2, **kwargs)
+        return {outcome.key: outcome for outcome in executor.map(enumerate(items))}
+
+    def test_map(self):
+        outcomes = self._map([("sleep", 0)] * 6)
+        self.assertEqual(set(range(6)), set(outcomes))
+        self.assertTrue(all(outcome.status == batch_executor.DONE for outcome in outcomes.values()))
+        # the workers are re-used
+        self.assertLessEqual(len({outcome.value[2] for outcome in outcomes.values()}), 2)
+
+    def test_exception(self):
+        outcomes = self._map([("raise", "boom"), ("sleep", 0)])
+        self.assertEqual(batch_executor.FAILED, outcomes[0].status)
+        self.assertIn("boom", outcomes[0].error)
+        self.assertEqual(batch_executor.DONE, outcomes[1].status)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        outcomes = self._map(
+            [("sleep", 60), ("sleep", 0), ("sleep", 0)],
+            limits=batch_executor.Limits(max_wall_time_s=0.5, max_rss_bytes=None),
+        )
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertEqual(batch_executor.TIMEOUT, outcomes[0].status)
+        self.assertEqual(batch_executor.DONE, outcomes[1].status)
+        self.assertEqual(batch_executor.DONE, outcomes[2].status)
+
+    def test_out_of_memory(self):
+        if batch_executor.rss_bytes(os.getpid()) is None:
+            self.skipTest("The memory cannot be read on this platform.")
+        outcomes = self._map(
+            [("allocate", 512 * 2**20), ("sleep", 0)],
+            limits=batch_executor.Limits(max_wall_time_s=None, max_rss_bytes=256 * 2**20),
+        )
+        self.assertEqual(batch_executor.OUT_OF_MEMORY, outcomes[0].status)
+        self.assertEqual(batch_executor.DONE, outcomes[1].status)
+
+    def test_crash(self):
+        outcomes = self._map([("exit", None), ("sleep", 0)])
+        self.assertEqual(batch_executor.CRASHED, outcomes[0].status)
+        self.assertEqual(batch_executor.DONE, outcomes[1].status)
+
+    def test_retry_with_bigger_budget(self):
+        executor = batch_executor.WatchdogExecutor(
+            _work,
+            2,
+            limits=batch_executor.Limits(max_wall_time_s=0.5, max_rss_bytes=None),
+            retry_budget_factor=10,
+        )
+        outcomes = list(executor.map([("slow", ("sleep", 1)), ("too-slow", ("sleep", 60))]))
+        slow = [outcome for outcome in outcomes if outcome.key == "slow"]
+        self.assertEqual(
+            [(batch_executor.TIMEOUT, 1), (batch_executor.DONE, 2)],
+            [(outcome.status, outcome.attempt) for outcome in slow],
+        )
+        self.assertEqual(5, slow[1].limits.max_wall_time_s)
+        # retried only once
+        self.assertEqual(
+            [batch_executor.TIMEOUT, batch_executor.TIMEOUT],
+            [outcome.status for outcome in outcomes if outcome.key == "too-slow"],
+        )
+
+
+class TestManifest(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+        self.manifest = batch_executor.Manifest(
+            pathlib.Path(self._tmp_dir.name).joinpath("manifest.jsonl")
+        )
+
+    def test_append_read(self):
+        self.assertEqual([], self.manifest.read())
+        self.manifest.append({"key": 1, "status": batch_executor.DONE})
+        self.manifest.append({"key": 2, "status": batch_executor.TIMEOUT})
+        self.assertEqual(
+            [{"key": 1, "status": "done"}, {"key": 2, "status": "timeout"}], self.manifest.read()
+        )
+        self.manifest.clear()
+        self.assertEqual([], self.manifest.read())
+
+    def test_incomplete_record(self):
+        self.manifest.append({"key": 1})
+        with self.manifest.path.open("ab") as f:
+            f.write(b'{"key": 2, "sta')
+        self.assertEqual([{"key": 1}], self.manifest.read())
+        batch_executor.Manifest(self.manifest.path).append({"key": 3})
+        self.assertEqual([{"key": 1}, {"key": 3}], self.manifest.read())
@@ -0,0 +1,75 @@
+import json
+import pathlib
+import shutil
+import tempfile
+from unittest import TestCase
+
+import benchmark
+import core
+
+RESOURCES_DIRECTORY = "./rsrc"
+
+
+class TestBenchmark(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp_dir.cleanup)
+        self.corpus_dir = pathlib.Path(self._tmp_dir.name).joinpath("corpus")
+        self.corpus_dir.mkdir()
+        shutil.copy(
+            str(pathlib.Path(RESOURCES_DIRECTORY).joinpath("table-0.html")),
+            str(self.corpus_dir.joinpath("table-0.html")),
+        )
+
+    def test_run(self):
+        pages = benchmark.load_corpus([self.corpus_dir])
+        thresholds = core.MDREditDistanceThresholds.all_equal(benchmark.THRESHOLD)
+        _, n_records = benchmark.run_mdr(pages[0].tree, 3, 10, thresholds)
+        self.corpus_dir.joinpath(benchmark.LABELS_FILENAME).write_text(
+            json.dumps({"table-0.html": n_records + 1})
+        )
+        pages = benchmark.load_corpus([self.corpus_dir])
+        self.assertEqual(["corpus/table-0.html"], [page.name for page in pages])
+        self.assertEqual(n_records + 1, pages[0].label)
+
+        report = benchmark.run(pages, repeats=2)
+        # machine-readable
+        report = json.loads(json.dumps(report))
+        summary = report["summary"]
+        self.assertEqual(1, summary["n_pages"])
+        self.assertEqual(0, summary["n_failed"])
+        self.assertGreater(summary["pages_per_s"], 0)
+        for phase in benchmark.PHASES:
+            self.assertEqual(2, len(report["pages"][0]["latency_s"][phase]))
+            self.assertLessEqual(
+                summary["latency_s"][phase]["p50"], summary["latency_s"][phase]["max"]
+            )
+        self.assertGreater(summary["peak_traced_bytes"], 0)
+        self.assertEqual(
+            {"n_labeled": 1, "mean_absolute_error": 1.0, "exact": 0.0}, summary["accuracy"]
+        )
+
+    def test_compare(self):
+        base = {
+            "parameters": {"repeats": 3},
+            "pages": [{"name": "a.html"}],
+            "summary": {
+                "pages_per_s": 10.0,
+                "latency_s": {"mdr": {"p50": 0.1, "p90": 0.2}},
+                "peak_traced_bytes": 1000,
+                "accuracy": {"mean_absolute_error": 0.0, "exact": 1.0},
+            },
+        }
+        new = json.loads(json.dumps(base))
+        new["summary"]["pages_per_s"] = 9.5
+        new["summary"]["latency_s"]["mdr"]["p90"] = 0.3
+        new["summary"]["accuracy"]["mean_absolute_error"] = 0.5
+
+        comparison = benchmark.compare(base, new, tolerance=0.1)
+        self.assertTrue(comparison["same_parameters"])
+        self.assertTrue(comparison["same_corpus"])
+        self.assertAlmostEqual(-0.05, comparison["metrics"]["pages_per_s"]["change"])
+        self.assertEqual(
+            ["accuracy.mean_absolute_error", "latency_s.mdr.p90"], comparison["regressions"]
+        )
+        self.assertEqual([], benchmark.compare(base, base)["regressions"])
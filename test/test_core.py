@@ -1,4 +1,5 @@
 import copy
+import json
 import pathlib
 from typing import Dict, Tuple, Set
 from unittest import TestCase
@@ -230,6 +231,55 @@ class TestMDR(TestCase):
         self.assertIn(((2, 3), (3, 4)), index_pairs)
         self.assertNotIn(((3, 4), (4, 5)), index_pairs)
 
+    def test__compute_distances_reuses_precomputed(self):
+        table_0 = self._get_table_0()
+        node_namer = core.NodeNamer()
+        node_namer.load(table_0)
+
+        expected = {}
+        core.compute_distances(table_0, expected, {}, node_namer, 3, 10)
+
+        # sizes 1..K' of a less permissive precomputed are kept, only the missing ones are computed
+        precomputed = {}
+        core.compute_distances(table_0, precomputed, {}, node_namer, 4, 1)
+        marker = -1.0
+        precomputed = {
+            name: {size: {pair: marker for pair in pairs} for size, pairs in node_dists.items()}
+            if node_dists is not None
+            else None
+            for name, node_dists in precomputed.items()
+        }
+        precomputed[core.DICT_PARAM_MINIMUM_DEPTH] = 4
+        precomputed[core.DICT_PARAM_TAG_PER_GNODE] = 1
+
+        distances = {}
+        core.compute_distances(table_0, distances, precomputed, node_namer, 3, 10)
+
+        self.assertEqual(set(distances), set(expected))
+        # table-00000 is at depth 3: not precomputed, fully computed
+        self.assertEqual(distances["table-00000"], expected["table-00000"])
+        # tr-00000 is at depth 4: size 1 reused
+        self.assertTrue(all(d == marker for d in distances["tr-00000"][1].values()))
+        for name, node_dists in expected.items():
+            if node_dists is None:
+                self.assertIsNone(distances[name])
+                continue
+            self.assertEqual(set(distances[name]), set(node_dists), name)
+            for size in node_dists:
+                if size > 1:
+                    self.assertEqual(distances[name][size], node_dists[size])
+
+    def test__compare_combinations_min_gnode_size(self):
+        table_10 = lxml.html.fromstring(
+            "<table>{}</table>".format("".join("<tr><td>{}</td></tr>".format(i) for i in range(10)))
+        )
+        all_sizes = core._compare_combinations(table_10.getchildren(), "table-00000", 10)
+        from_3 = core._compare_combinations(
+            table_10.getchildren(), "table-00000", 10, min_gnode_size=3
+        )
+        self.assertEqual(set(from_3), {3, 4, 5})
+        self.assertEqual(from_3, {size: all_sizes[size] for size in (3, 4, 5)})
+
     def test__compare_combinations(self):
         def get_html_table(n_rows):
             html_str = "<table>"
@@ -617,7 +667,116 @@ class TestNodeNamer(TestCase):
     def test_call(self):
         self.fail()
 
+    def test_load_replay(self):
+        """ The names replayed on a reloaded tree are the same and the sidecar checks it. """
+        html_str = "<html><body><table><tr><td>1</td><td>2</td></tr></table></body></html>"
+        root = lxml.html.fromstring(html_str)
+        node_namer = core.NodeNamer()
+        node_namer.load(root)
+        sidecar = json.loads(json.dumps(node_namer.sidecar))
+        self.assertEqual(sidecar["n_nodes"], 6)
+
+        reloaded = lxml.html.fromstring(lxml.html.tostring(root))
+        core.NodeNamer.cleanup_all(reloaded)
+        replayed_namer = core.NodeNamer()
+        replayed_namer.load(reloaded, sidecar)
+        self.assertEqual(
+            [node_namer(node) for node in root.iter()],
+            [replayed_namer(node) for node in reloaded.iter()],
+        )
+        self.assertEqual(replayed_namer(reloaded.body[0][0][1]), "td-00001")
+
+        other = lxml.html.fromstring(html_str.replace("<td>2</td>", "<th>2</th>"))
+        self.assertRaises(AssertionError, core.NodeNamer().load, other, sidecar)
+
+    def test_sidecar_of(self):
+        root = lxml.html.fromstring("<html><body><ul><li>1</li><li>2</li></ul></body></html>")
+        sidecar = core.NodeNamer.sidecar_of(root)
+        self.assertEqual(len(root.xpath("//*[@{}]".format(core.NODE_NAME_ATTRIB))), 0)
+        node_namer = core.NodeNamer()
+        node_namer.load(root)
+        self.assertEqual(sidecar, node_namer.sidecar)
+
+
+class TestPrune(TestCase):
+    HTML_STR = (
+        "<html><body>"
+        "<div class='header'><p>a <span>b</span></p><p>c</p></div>"
+        "<table id='t'><tr><td colspan='2' style='x'>  1 \n  <b>x</b> </td></tr><tr><td>2</td></tr></table>"
+        "<div><span>d</span></div>"
+        "</body></html>"
+    )
+
+    def test_prune(self):
+        root = lxml.html.fromstring(self.HTML_STR)
+        core.prune(root)
+        header, table, footer = root.body
+        self.assertEqual(len(header), 0)
+        self.assertEqual(header.attrib, {core.PRUNED_TAGS_ATTRIB: "p:2 span:1"})
+        self.assertEqual(footer.get(core.PRUNED_TAGS_ATTRIB), "span:1")
+        self.assertEqual(table.attrib, {})
+        td = table[0][0]
+        self.assertEqual(td.attrib, {"colspan": "2"})
+        self.assertEqual(td.text, "1")
+        self.assertEqual(td[0].get(core.PRUNED_TAGS_ATTRIB), None)
+        self.assertEqual(len(root.xpath("//table//td")), 2)
+
+    def test_names_are_kept(self):
+        """ The nodes left have the names they have in the tree before pruning. """
+        root = lxml.html.fromstring(self.HTML_STR)
+        pruned = copy.deepcopy(root)
+        core.prune(pruned)
+
+        node_namer, pruned_node_namer = core.NodeNamer(), core.NodeNamer()
+        node_namer.load(root)
+        pruned_node_namer.load(pruned)
+        tree, pruned_tree = root.getroottree(), pruned.getroottree()
+        for node in pruned.iter():
+            self.assertEqual(
+                pruned_node_namer(node), node_namer(tree.xpath(pruned_tree.getpath(node))[0])
+            )
+        self.assertEqual(pruned_node_namer(pruned.body[2]), "div-00001")
+        self.assertEqual(pruned_node_namer(pruned.body[1][1][0]), "td-00001")
+
 
 class Test(TestCase):
     def test_paint_data_records(self):
         self.fail()
+
+    def test_tree_stats(self):
+        """ The number of gnode pairs is the number of distances actually computed. """
+        table_0_filepath = pathlib.Path(RESOURCES_DIRECTORY).joinpath("table-0.html").absolute()
+        generated = lxml.html.fromstring(
+            "<html><body>"
+            + "".join(
+                "<ul>{0}</ul><div><ul>{0}</ul></div>".format("<li>a</li>" * n_children)
+                for n_children in (0, 1, 7, 30)
+            )
+            + "</body></html>"
+        )
+        for root in (files_management.open_html_document(table_0_filepath, True), generated):
+            node_namer = core.NodeNamer()
+            node_namer.load(root)
+            for minimum_depth, max_tag_per_gnode in ((0, 10), (3, 4)):
+                distances = {}
+                core.compute_distances(
+                    root, distances, {}, node_namer, minimum_depth, max_tag_per_gnode
+                )
+                stats = core.tree_stats(root, minimum_depth, max_tag_per_gnode)
+                self.assertEqual(
+                    stats.n_gnode_pairs,
+                    sum(
+                        len(pairs)
+                        for node_distances in distances.values()
+                        if node_distances
+                        for pairs in node_distances.values()
+                    ),
+                )
+                self.assertEqual(stats.n_nodes, len(list(root.iter())))
+                # the saved profile gives the same stats
+                saved = json.dumps(core.tree_profile(root)._asdict())
+                profile = core.TreeProfile(**json.loads(saved))
+                self.assertEqual(
+                    core.profile_stats(profile, minimum_depth, max_tag_per_gnode), stats
+                )
+                self.assertEqual(stats.max_fanout, max(len(node) for node in root.iter()))
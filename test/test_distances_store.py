@@ -0,0 +1,163 @@
+import pathlib
+import tempfile
+from unittest import TestCase
+
+import core
+import distances_store
+import files_management
+
+
+RESOURCES_DIRECTORY = "./rsrc"
+
+
+# noinspection PyArgumentList
+class TestDistancesStore(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        table_0_filepath = pathlib.Path(RESOURCES_DIRECTORY).joinpath("table-0.html").absolute()
+        table_0 = files_management.open_html_document(table_0_filepath, remove_stuff=False)
+        node_namer = core.NodeNamer()
+        node_namer.load(table_0)
+        cls._distances = {}
+        core.compute_distances(table_0, cls._distances, {}, node_namer, 3, 10)
+
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.filepath = pathlib.Path(self._tmp_dir.name).joinpath("distances.bin")
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        distances_store.dump(self.filepath, self._distances, 3, 10)
+        loaded = distances_store.load(self.filepath)
+
+        self.assertEqual(loaded.minimum_depth, 3)
+        self.assertEqual(loaded.max_tag_per_gnode, 10)
+        self.assertEqual(loaded.get(core.DICT_PARAM_MINIMUM_DEPTH), 3)
+        self.assertEqual(loaded.get(core.DICT_PARAM_TAG_PER_GNODE), 10)
+        self.assertEqual(set(loaded), set(self._distances))
+
+        for node_name, node_distances in self._distances.items():
+            if node_distances is None:
+                self.assertIsNone(loaded[node_name])
+            else:
+                self.assertEqual(
+                    {size: dict(pairs) for size, pairs in loaded[node_name].items()},
+                    node_distances,
+                )
+
+    def test_ignores_legacy_parameter_keys(self):
+        distances = dict(self._distances)
+        distances[core.DICT_PARAM_MINIMUM_DEPTH] = 3
+        distances[core.DICT_PARAM_TAG_PER_GNODE] = 10
+        distances_store.dump(self.filepath, distances, 2, 5)
+        loaded = distances_store.load(self.filepath)
+        self.assertEqual(len(loaded), len(self._distances))
+        self.assertEqual(loaded.minimum_depth, 2)
+        self.assertEqual(loaded.max_tag_per_gnode, 5)
+
+    def test_gnode_pair_lookup(self):
+        distances_store.dump(self.filepath, self._distances, 3, 10)
+        table = distances_store.load(self.filepath)["table-00000"]
+
+        pair = core.GNodePair(core.GNode("table-00000", 0, 2), core.GNode("table-00000", 2, 4))
+        self.assertIn(pair, table[2])
+        self.assertEqual(table[2][pair], self._distances["table-00000"][2][pair])
+
+        out_of_range = core.GNodePair(
+            core.GNode("table-00000", 1, 3), core.GNode("table-00000", 3, 5)
+        )
+        not_adjacent = core.GNodePair(
+            core.GNode("table-00000", 0, 1), core.GNode("table-00000", 2, 3)
+        )
+        other_parent = core.GNodePair(core.GNode("tr-00000", 0, 1), core.GNode("tr-00000", 1, 2))
+        self.assertNotIn(out_of_range, table[2])
+        self.assertNotIn(not_adjacent, table[1])
+        self.assertNotIn(other_parent, table[1])
+        self.assertRaises(KeyError, table[1].__getitem__, other_parent)
+        self.assertRaises(KeyError, table.__getitem__, 3)
+
+    def test_bad_file(self):
+        self.filepath.write_bytes(b"not a distances file at all")
+        self.assertRaises(distances_store.DistancesFormatError, distances_store.load, self.filepath)
+
+    def test_mdr_with_loaded_distances(self):
+        table_0_filepath = pathlib.Path(RESOURCES_DIRECTORY).joinpath("table-0.html").absolute()
+        table_0 = files_management.open_html_document(table_0_filepath, remove_stuff=False)
+        expected = core.MDR.with_defaults(table_0)()
+
+        distances_store.dump(self.filepath, self._distances, 3, 10)
+        loaded = distances_store.load(self.filepath)
+        actual = core.MDR.with_defaults(table_0, loaded)()
+        self.assertEqual(expected, actual)
+
+    def test_lazy_loading(self):
+        distances_store.dump(self.filepath, self._distances, 3, 10)
+        loaded = distances_store.load(self.filepath)
+        self.assertEqual(loaded.n_loaded_nodes, 0)
+        self.assertIn("table-00000", loaded)
+        self.assertEqual(loaded.n_loaded_nodes, 0)
+
+        loaded.node_distances("table-00000")
+        loaded.get("tr-00001")
+        self.assertEqual(loaded.n_loaded_nodes, 2)
+        self.assertIs(loaded["table-00000"], loaded.node_distances("table-00000"))
+        self.assertEqual(loaded.n_loaded_nodes, 2)
+
+    def test_version_1_without_index(self):
+        distances_store.dump(self.filepath, self._distances, 3, 10)
+        data = self.filepath.read_bytes()
+        _, _, _, n_nodes, index_offset = distances_store.read_header(data)
+        # the v1 header is 8 bytes shorter, so the records keep their alignment
+        v1_header = distances_store._HEADERS[1].pack(distances_store.MAGIC, 1, 3, 10, n_nodes)
+        v1_filepath = self.filepath.with_name("distances-v1.bin")
+        v1_filepath.write_bytes(v1_header + data[distances_store._HEADER.size : index_offset])
+
+        loaded = distances_store.load(v1_filepath)
+        self.assertEqual(set(loaded), set(self._distances))
+        self.assertEqual(
+            {size: dict(pairs) for size, pairs in loaded["table-00000"].items()},
+            self._distances["table-00000"],
+        )
+
+    def test_dump_completed_distances(self):
+        """ Distances completed from a loaded file mix views and dicts, they must be writable. """
+        table_0_filepath = pathlib.Path(RESOURCES_DIRECTORY).joinpath("table-0.html").absolute()
+        table_0 = files_management.open_html_document(table_0_filepath, remove_stuff=False)
+        node_namer = core.NodeNamer()
+        node_namer.load(table_0)
+
+        partial = {}
+        core.compute_distances(table_0, partial, {}, node_namer, 3, 1)
+        distances_store.dump(self.filepath, partial, 3, 1)
+
+        completed = {}
+        core.compute_distances(
+            table_0, completed, distances_store.load(self.filepath), node_namer, 3, 10
+        )
+        completed_filepath = self.filepath.with_name("completed.bin")
+        distances_store.dump(completed_filepath, completed, 3, 10)
+
+        loaded = distances_store.load(completed_filepath)
+        for node_name, node_distances in self._distances.items():
+            if node_distances is not None:
+                self.assertEqual(
+                    {size: dict(pairs) for size, pairs in loaded[node_name].items()},
+                    node_distances,
+                )
+
+    def test_loaded_distances_are_shared(self):
+        def load():
+            stat = self.filepath.stat()
+            return files_management._load_distances(
+                self.filepath, (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            )
+
+        distances_store.dump(self.filepath, self._distances, 3, 10)
+        loaded = load()
+        self.assertIs(load(), loaded)
+        # replaced, e.g. recomputed with other parameters
+        distances_store.dump(self.filepath, self._distances, 2, 10)
+        self.assertIsNot(load(), loaded)
+        self.assertEqual(load().minimum_depth, 2)
@@ -0,0 +1,235 @@
+import collections
+import http.client
+import http.server
+import socket
+import socketserver
+import threading
+import time
+from unittest import TestCase
+
+import downloader
+import files_management
+from test import helpers
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """ Stand-in for the pages' hosts, see `TestDownloader.setUp`. """
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.n_connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.n_requests[self.path] += 1
+            n_requests = self.server.n_requests[self.path]
+            self.server.n_concurrent += 1
+            self.server.max_concurrent = max(self.server.max_concurrent, self.server.n_concurrent)
+        try:
+            if self.path.startswith("/page/"):
+                time.sleep(0.05)
+                self._send(200, "<html><body>{}</body></html>".format(self.path).encode("utf-8"))
+            elif self.path == "/flaky":
+                if n_requests <= 2:
+                    self._send(500)
+                else:
+                    self._send(200, b"<html><body>flaky</body></html>")
+            elif self.path == "/redirect":
+                self._send(302, headers=[("Location", "/page/redirected")])
+            elif self.path == "/loop":
+                self._send(302, headers=[("Location", "/loop")])
+            elif self.path.startswith("/redirect/"):
+                # to another host, e.g. /redirect/127.0.0.1:8000/page/0
+                location = "http://" + self.path[len("/redirect/") :]
+                self._send(302, headers=[("Location", location)])
+            elif self.path == "/validated":
+                etag = '"v{}"'.format(self.server.version)
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, headers=[("ETag", etag)])
+                else:
+                    body = "<html><body>v{}</body></html>".format(self.server.version)
+                    self._send(200, body.encode("utf-8"), headers=[("ETag", etag)])
+            elif self.path == "/broken":
+                self._send(503)
+            else:
+                self._send(404)
+        finally:
+            with self.server.lock:
+                self.server.n_concurrent -= 1
+
+
+class TestDownloader(TestCase):
+    def _start_server(self) -> _Server:
+        server = _Server(("127.0.0.1", 0), _Handler)
+        server.lock = threading.Lock()
+        server.n_connections = 0
+        server.n_requests = collections.Counter()
+        server.n_concurrent = 0
+        server.max_concurrent = 0
+        server.version = 1  # of /validated
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def setUp(self):
+        self.server = self._start_server()
+        self.base_url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+        helpers.patch_outputs(self)
+
+        self.downloader = downloader.Downloader(
+            max_connections=8,
+            max_connections_per_host=2,
+            timeout_s=5,
+            max_attempts=3,
+            wait_multiplier_s=0.01,
+            wait_max_s=0.05,
+        )
+
+    def _register(self, path):
+        return files_management.PageMeta.register(self.base_url + path, 1)
+
+    def test_download_all(self):
+        pages_metas = [self._register("/page/{}".format(i)) for i in range(6)]
+        outcomes = self.downloader.download_all(pages_metas, metas_flush_every=2)
+
+        self.assertEqual(
+            {page_meta.page_id: downloader.DOWNLOADED for page_meta in pages_metas}, outcomes
+        )
+        saved_metas = files_management.PageMeta.get_all()
+        for page_meta in pages_metas:
+            saved_meta = saved_metas[page_meta.page_id]
+            self.assertIsNotNone(saved_meta.download_datetime)
+            self.assertTrue(saved_meta.has_raw_html)
+            with saved_meta.open_raw_html() as f:
+                self.assertIn(page_meta.url[len(self.base_url) :].encode("utf-8"), f.read())
+
+    def test_per_host_concurrency_and_keep_alive(self):
+        pages_metas = [self._register("/page/{}".format(i)) for i in range(8)]
+        self.downloader.download_all(pages_metas)
+        self.assertEqual(8, sum(self.server.n_requests.values()))
+        self.assertLessEqual(self.server.max_concurrent, 2)
+        self.assertLessEqual(self.server.n_connections, 2)
+
+    def test_skip_downloaded(self):
+        page_meta = self._register("/page/0")
+        self.downloader.download_all([page_meta])
+        page_meta = files_management.PageMeta.get_all()[page_meta.page_id]
+        self.assertEqual(
+            {page_meta.page_id: downloader.SKIPPED}, self.downloader.download_all([page_meta])
+        )
+        # same content
+        self.assertEqual(
+            {page_meta.page_id: downloader.UNCHANGED},
+            self.downloader.download_all([page_meta], force_override=True),
+        )
+        self.assertEqual(2, self.server.n_requests["/page/0"])
+
+    def test_retries(self):
+        page_meta = self._register("/flaky")
+        self.assertEqual(
+            {page_meta.page_id: downloader.DOWNLOADED}, self.downloader.download_all([page_meta])
+        )
+        self.assertEqual(3, self.server.n_requests["/flaky"])
+
+    def test_failures(self):
+        broken = self._register("/broken")
+        missing = self._register("/missing")
+        outcomes = self.downloader.download_all([broken, missing])
+        self.assertEqual(
+            {broken.page_id: downloader.FAILED, missing.page_id: downloader.FAILED}, outcomes
+        )
+        # the server errors are retried, the client errors aren't
+        self.assertEqual(3, self.server.n_requests["/broken"])
+        self.assertEqual(1, self.server.n_requests["/missing"])
+        self.assertFalse(files_management.PageMeta.get_all()[broken.page_id].has_raw_html)
+
+    def test_not_retried(self):
+        """ Too many redirections and the errors that are not the network's would happen again. """
+        loop = self._register("/loop")
+        self.assertEqual({loop.page_id: downloader.FAILED}, self.downloader.download_all([loop]))
+        self.assertEqual(downloader.MAX_REDIRECTS + 1, self.server.n_requests["/loop"])
+
+        self.assertFalse(downloader._is_retryable(ValueError("Unsupported scheme `ftp`.")))
+        self.assertFalse(downloader._is_retryable(http.client.InvalidURL()))
+        self.assertFalse(downloader._is_retryable(downloader.HTTPStatusError("url", 302)))
+        self.assertTrue(downloader._is_retryable(ConnectionRefusedError()))
+        self.assertTrue(downloader._is_retryable(socket.timeout()))
+        self.assertTrue(downloader._is_retryable(http.client.RemoteDisconnected()))
+        self.assertTrue(downloader._is_retryable(downloader.HTTPStatusError("url", 429)))
+
+    def test_redirect(self):
+        response = self.downloader.get(self.base_url + "/redirect")
+        self.assertEqual(200, response.status)
+        self.assertEqual(self.base_url + "/page/redirected", response.url)
+        self.assertIn(b"/page/redirected", response.body)
+
+    def test_redirect_to_another_host(self):
+        """ The requests redirected to a host hold its slots, not the ones of the first host. """
+        target = self._start_server()
+        target_host = "127.0.0.1:{}".format(target.server_address[1])
+        pages_metas = []
+        for i in range(4):
+            base_url = "http://127.0.0.1:{}".format(self._start_server().server_address[1])
+            pages_metas += [
+                files_management.PageMeta.register(
+                    "{}/redirect/{}/page/{}-{}".format(base_url, target_host, i, j), 1
+                )
+                for j in range(2)
+            ]
+        outcomes = self.downloader.download_all(pages_metas)
+        self.assertEqual(
+            {page_meta.page_id: downloader.DOWNLOADED for page_meta in pages_metas}, outcomes
+        )
+        self.assertEqual(8, sum(target.n_requests.values()))
+        self.assertLessEqual(target.max_concurrent, 2)
+
+    def test_refresh(self):
+        page_meta = self._register("/validated")
+        self.downloader.download_all([page_meta])
+        page_meta = files_management.PageMeta.get_all()[page_meta.page_id]
+        self.assertEqual('"v1"', page_meta.etag)
+        first_sha256 = page_meta.raw_html_sha256
+
+        outcomes = self.downloader.download_all([page_meta], refresh=True)
+        self.assertEqual({page_meta.page_id: downloader.NOT_MODIFIED}, outcomes)
+        self.assertEqual(
+            first_sha256,
+            files_management.PageMeta.get_all()[page_meta.page_id].raw_html_sha256,
+        )
+
+        self.server.version = 2
+        outcomes = self.downloader.download_all([page_meta], refresh=True)
+        self.assertEqual({page_meta.page_id: downloader.DOWNLOADED}, outcomes)
+        page_meta = files_management.PageMeta.get_all()[page_meta.page_id]
+        self.assertEqual('"v2"', page_meta.etag)
+        self.assertNotEqual(first_sha256, page_meta.raw_html_sha256)
+
+    def test_refresh_without_validators(self):
+        page_meta = self._register("/page/0")
+        self.downloader.download_all([page_meta])
+        page_meta = files_management.PageMeta.get_all()[page_meta.page_id]
+        self.assertIsNone(page_meta.etag)
+        outcomes = self.downloader.download_all([page_meta], refresh=True)
+        self.assertEqual({page_meta.page_id: downloader.UNCHANGED}, outcomes)
+        self.assertEqual(2, self.server.n_requests["/page/0"])
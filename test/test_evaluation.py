@@ -0,0 +1,87 @@
+import pickle
+from unittest import TestCase
+
+import numpy as np
+
+import core
+import evaluation
+import files_management
+from test import helpers
+
+
+class TestEvaluation(TestCase):
+    def setUp(self):
+        helpers.patch_outputs(self)
+
+    @staticmethod
+    def _register(url, n_data_records):
+        files_management.PageMeta.register(url, n_data_records)
+        return next(
+            page_meta
+            for page_meta in files_management.PageMeta.get_all().values()
+            if page_meta.url == url
+        )
+
+    def test_grid(self):
+        th = core.MDREditDistanceThresholds.all_equal
+        page_a = self._register("http://a.com/page", 4)
+        page_b = self._register("http://b.com/page", 10)
+        page_a.persist_precomputed_data_records([None] * 3, th(0.1), 10)
+        page_a.persist_precomputed_data_records([None] * 4, th(0.2), 10)
+        page_a.persist_precomputed_data_records([None] * 4, th(0.2), 5)
+        page_b.persist_precomputed_data_records([None] * 20, th(0.1), 10)
+        # stored without its number of records
+        page_b.bundle.put(
+            files_management.BUNDLE_DATA_RECORDS,
+            page_b.data_records_params(th(0.2), 10),
+            pickle.dumps([None] * 9),
+        )
+        # legacy pickle
+        with page_b.data_records_pkl(th(0.3), 10).open(mode="wb") as f:
+            pickle.dump([None] * 10, f)
+
+        counts = evaluation.collect_record_counts([page_a, page_b], max_tags_per_gnode=10)
+        self.assertEqual([page_a.page_id, page_b.page_id], counts.pages_ids)
+        self.assertEqual(5, len(counts.n_records))
+
+        grid = evaluation.make_grid(counts)
+        np.testing.assert_array_equal(
+            [[0.1, 0.1, 0.1, 10], [0.2, 0.2, 0.2, 10], [0.3, 0.3, 0.3, 10]], grid.parameters
+        )
+        np.testing.assert_array_equal([[3, 4, np.nan], [20, 9, 10]], grid.n_records)
+
+        scores = evaluation.score(grid, margin=1)
+        np.testing.assert_array_equal([2, 2, 1], scores.n_pages)
+        np.testing.assert_allclose([5.5, 0.5, 0], scores.mean_absolute_error)
+        np.testing.assert_allclose([4.5, -0.5, 0], scores.bias)
+        np.testing.assert_allclose([0, 0.5, 1], scores.exact)
+        np.testing.assert_allclose([0.5, 1, 1], scores.within)
+        # the ones run on all the pages first
+        np.testing.assert_array_equal([1, 0, 2], evaluation.rank_parameters(scores))
+
+        best = evaluation.best_per_page(grid)
+        np.testing.assert_array_equal([1, 2], best.parameters_index)
+        np.testing.assert_array_equal([0, 0], best.error)
+
+    def test_unlabeled(self):
+        th = core.MDREditDistanceThresholds.all_equal
+        labeled = self._register("http://www.powells.com/", None)
+        unlabeled = self._register("http://c.com/page", None)
+        labeled.persist_precomputed_data_records([None] * 5, th(0.1), 10)
+
+        reference_counts = evaluation.load_reference_counts()
+        self.assertEqual((4, 4), reference_counts["http://www.powells.com"])
+        grid = evaluation.make_grid(
+            evaluation.collect_record_counts(
+                [labeled, unlabeled], reference_counts=reference_counts
+            )
+        )
+        np.testing.assert_array_equal([4, np.nan], grid.labels)
+        self.assertEqual(1, evaluation.score(grid).n_pages[0])
+        best = evaluation.best_per_page(grid)
+        np.testing.assert_array_equal([0, -1], best.parameters_index)
+        np.testing.assert_array_equal([1, np.nan], best.error)
+
+        empty = evaluation.make_grid(evaluation.collect_record_counts([unlabeled]))
+        self.assertEqual((1, 0), empty.n_records.shape)
+        np.testing.assert_array_equal([-1], evaluation.best_per_page(empty).parameters_index)
@@ -1,12 +1,147 @@
-from unittest import TestCase
+import copy
+import datetime
+import io
+import json
+import pathlib
+import tempfile
+from unittest import TestCase, mock
+
+import lxml.etree
+import lxml.html
+import yaml
+
+import core
+import files_management
+import metadata_store
+from test import helpers
+
+RESOURCES_DIRECTORY = "./rsrc"
 
 
 class Test(TestCase):
     def test_open_html_document(self):
-        self.fail()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = pathlib.Path(tmp_dir).joinpath("page.html")
+            filepath.write_bytes(
+                "<html><head><!-- comment --></head><body><p>é</p>  <p>ü</p></body></html>".encode(
+                    "utf-8"
+                )
+            )
+            doc = files_management.open_html_document(filepath, remove_stuff=False)
+            self.assertIsInstance(doc, lxml.html.HtmlElement)
+            self.assertEqual(doc.tag, "html")
+            self.assertEqual(len(doc.xpath("//comment()")), 1)
+            self.assertEqual(doc.text_content(), "é  ü")
+
+            doc = files_management.open_html_document(filepath, remove_stuff=True)
+            self.assertEqual(len(doc.xpath("//comment()")), 0)
+            self.assertEqual(doc.text_content(), "é  ü")
+
+    def test_open_html_document_declared_encoding(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = pathlib.Path(tmp_dir).joinpath("page.html")
+            filepath.write_bytes(
+                '<html><head><meta charset="iso-8859-1"></head><body><p>é</p></body></html>'.encode(
+                    "iso-8859-1"
+                )
+            )
+            doc = files_management.open_html_document(filepath, remove_stuff=True)
+            self.assertEqual(doc.body.text_content(), "é")
+
+    def test_clean_html(self):
+        """ Same as parsing then stripping the elements, also across the chunks fed to the parser. """
+        html_str = (
+            "<html><head><meta charset='utf-8'><style>p {}</style><title>t</title></head><body>"
+            + "<p>a<script>x</script>tail<!-- c --><b>b</b></p>" * 3000
+            + "<div>c<meta>d</div></body></html>"
+        )
+        html_bytes = html_str.encode("utf-8")
+        self.assertGreater(len(html_bytes), files_management.HTML_READ_CHUNK_SIZE)
+
+        doc, node_names = files_management.clean_html(
+            io.BytesIO(html_bytes), ("script", "style", "meta")
+        )
+        expected = files_management.parse_html(io.BytesIO(html_bytes), remove_stuff=True)
+        lxml.etree.strip_elements(expected, "script", "style", "meta")
+        self.assertEqual(lxml.etree.tostring(doc), lxml.etree.tostring(expected))
+        self.assertEqual(len(doc.xpath("//script|//style|//meta|//comment()")), 0)
+        self.assertEqual(doc.xpath("string(//p[1])"), "ab")
+        self.assertEqual(node_names, core.NodeNamer.sidecar_of(expected))
+
+    def test_clean_html_chunks(self):
+        """ The same wherever the chunks fed to the parser end. """
+        html_bytes = (
+            b"<html><head><style>p {}</style></head><body>"
+            b"<p>a<script>x</script>tail<b>b</b><meta>tail</p>"
+            b"<div>c<style></style>d</div></body></html>"
+        )
+        expected = files_management.parse_html(io.BytesIO(html_bytes), remove_stuff=True)
+        lxml.etree.strip_elements(expected, "script", "style", "meta")
+        expected_node_names = core.NodeNamer.sidecar_of(expected)
+        expected = lxml.etree.tostring(expected)
+        for chunk_size in range(1, len(html_bytes) + 1):
+            with mock.patch.object(files_management, "HTML_READ_CHUNK_SIZE", chunk_size):
+                doc, node_names = files_management.clean_html(
+                    io.BytesIO(html_bytes), ("script", "style", "meta")
+                )
+            self.assertEqual(lxml.etree.tostring(doc), expected, "chunk_size={}".format(chunk_size))
+            self.assertEqual(node_names, expected_node_names, "chunk_size={}".format(chunk_size))
+
+    def test_export_pages_meta(self):
+        tmp_dir = helpers.patch_outputs(self)
+        yaml_path = tmp_dir.joinpath("pages-meta.yml")
+        with mock.patch.object(files_management, "pages_meta", yaml_path):
+            files_management.PageMeta.register("https://a.com", 3)
+            files_management.export_pages_meta()
+        with yaml_path.open() as f:
+            exported = yaml.load(f, Loader=yaml.FullLoader)
+        self.assertEqual(["https://a.com"], [meta["url"] for meta in exported.values()])
+        self.assertEqual([3], [meta["n_data_records"] for meta in exported.values()])
+
+    def test_lazy_attributes(self):
+        calls = []
+        factory = lambda: calls.append(1) or object()
+        self.addCleanup(files_management._lazy_values.pop, "lazy_test_attribute", None)
+        self.addCleanup(vars(files_management).pop, "lazy_test_attribute", None)
+
+        with mock.patch.dict(files_management._LAZY_ATTRIBUTES, lazy_test_attribute=factory):
+            value = files_management.lazy_test_attribute
+            self.assertIs(files_management._get("lazy_test_attribute"), value)
+            self.assertIs(files_management.lazy_test_attribute, value)
+            self.assertEqual(len(calls), 1)
+            # a patched attribute prevails
+            with mock.patch.object(files_management, "lazy_test_attribute", "patched"):
+                self.assertEqual(files_management._get("lazy_test_attribute"), "patched")
+            self.assertIs(files_management._get("lazy_test_attribute"), value)
+            self.assertEqual(len(calls), 1)
+        with self.assertRaises(AttributeError):
+            files_management.not_an_attribute
 
 
 class TestPageMeta(TestCase):
+    def setUp(self):
+        helpers.patch_outputs(self)
+
+    @staticmethod
+    def _names(root) -> list:
+        return [node.get(core.NODE_NAME_ATTRIB) for node in root.iter()]
+
+    def _preprocessed_page(self):
+        """ A page with a preprocessed html, and the names of its nodes. """
+        page_meta = files_management.PageMeta.register("https://a.com/table-0", 3)
+        raw_html = pathlib.Path(RESOURCES_DIRECTORY).joinpath("table-0.html").read_bytes()
+        doc = files_management.clean_html(io.BytesIO(raw_html), ("script", "style", "meta")).root
+        page_meta.persist_preprocessed_html(doc)
+        named_doc = copy.deepcopy(doc)
+        core.NodeNamer().load(named_doc)
+        return page_meta, doc, self._names(named_doc)
+
+    def _replayed_names(self, page_meta) -> list:
+        """ Replayed on the reparsed preprocessed html. """
+        root = page_meta.get_preprocessed_html_tree()
+        core.NodeNamer().load(root, page_meta.load_node_names())
+        return self._names(root)
+
     def test__page_id(self):
         self.fail()
 
@@ -49,8 +184,14 @@ class TestPageMeta(TestCase):
     def test_preprocessed_html(self):
         self.fail()
 
-    def test_named_nodes_html(self):
-        self.fail()
+    def test_node_names_json(self):
+        """ The legacy sidecar is still replayed. """
+        page_meta, doc, names = self._preprocessed_page()
+        self.assertFalse(page_meta.has_node_names)
+        page_meta.node_names_json.write_text(json.dumps(core.NodeNamer.sidecar_of(doc)))
+        self.assertTrue(page_meta.has_node_names)
+        self.assertFalse(page_meta.bundle.contains(files_management.BUNDLE_NODE_NAMES, {}))
+        self.assertEqual(names, self._replayed_names(page_meta))
 
     def test_distances_pkl(self):
         self.fail()
@@ -83,8 +224,41 @@ class TestPageMeta(TestCase):
     def test_get_preprocessed_html_tree(self):
         self.fail()
 
-    def test_get_named_nodes_html_tree(self):
-        self.fail()
+    def test_persist_node_names(self):
+        page_meta, doc, names = self._preprocessed_page()
+        page_meta.persist_node_names(core.NodeNamer.sidecar_of(doc))
+        self.assertTrue(page_meta.has_node_names)
+        self.assertTrue(page_meta.bundle.contains(files_management.BUNDLE_NODE_NAMES, {}))
+        self.assertFalse(page_meta.node_names_json.exists())
+        self.assertEqual(names, self._replayed_names(page_meta))
+        self.assertIsNone(doc.get(core.NODE_NAME_ATTRIB))
+
+        # they are the names of the previous document
+        page_meta.persist_preprocessed_html(b"<html><body><p>other</p></body></html>")
+        self.assertFalse(page_meta.has_node_names)
+
+    def test_tree_profile(self):
+        page_meta, doc, _ = self._preprocessed_page()
+        self.assertIsNone(page_meta.load_tree_profile())
+        page_meta.persist_tree_profile(core.tree_profile(doc))
+        self.assertEqual(core.tree_profile(doc), page_meta.load_tree_profile())
+
+        # it's the profile of the previous document
+        page_meta.persist_preprocessed_html(b"<html><body><p>other</p></body></html>")
+        self.assertIsNone(page_meta.load_tree_profile())
+
+    def test_load_node_names(self):
+        """ The bundle's sidecar prevails over the legacy one, a sidecar of another tree fails the replay. """
+        page_meta, doc, names = self._preprocessed_page()
+        other_doc = lxml.html.fromstring("<html><body><p>other</p></body></html>")
+        page_meta.node_names_json.write_text(json.dumps(core.NodeNamer.sidecar_of(other_doc)))
+        page_meta.persist_node_names(core.NodeNamer.sidecar_of(doc))
+        self.assertEqual(core.NodeNamer.sidecar_of(doc), page_meta.load_node_names())
+        self.assertEqual(names, self._replayed_names(page_meta))
+
+        page_meta.persist_node_names(core.NodeNamer.sidecar_of(other_doc))
+        with self.assertRaises(AssertionError):
+            self._replayed_names(page_meta)
 
     def test_persist_precomputed_distances(self):
         self.fail()
@@ -106,3 +280,114 @@ class TestPageMeta(TestCase):
 
     def test_persist_download_datetime(self):
         self.fail()
+
+
+class TestMetasBatch(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.store = metadata_store.MetadataStore(
+            pathlib.Path(self._tmp_dir.name).joinpath("pages-meta.sqlite")
+        )
+        self.metas = [
+            files_management.PageMeta(
+                datetime.datetime(2020, 3, 24), "https://{}.com".format(i), str(i), None, None
+            )
+            for i in range(5)
+        ]
+        for meta in self.metas:
+            self.store.insert(meta.to_dict())
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def _download_datetimes(self):
+        return [meta["download_datetime"] for meta in self.store.get_all().values()]
+
+    def test_flush_on_exit(self):
+        now = datetime.datetime.now()
+        with files_management.MetasBatch(store=self.store) as batch:
+            self.assertIs(files_management.MetasBatch.active(), batch)
+            for meta in self.metas:
+                meta._download_datetime = now
+                batch.add(meta.to_dict())
+            self.assertEqual(self._download_datetimes(), [None] * 5)
+        self.assertIsNone(files_management.MetasBatch.active())
+        self.assertEqual(self._download_datetimes(), [now] * 5)
+
+    def test_flush_every(self):
+        now = datetime.datetime.now()
+        with files_management.MetasBatch(flush_every=2, store=self.store) as batch:
+            for meta in self.metas[:3]:
+                meta._download_datetime = now
+                batch.add(meta.to_dict())
+            self.assertEqual(self._download_datetimes(), [now, now, None, None, None])
+
+    def test_only_changed_fields_are_written(self):
+        """ A stale copy of a page's metadata doesn't overwrite the fields changed by another writer. """
+        now = datetime.datetime.now()
+        other_writer = metadata_store.MetadataStore(self.store.db_path)
+        with mock.patch.object(files_management, "metas_store", self.store):
+            with files_management.MetasBatch(store=self.store):
+                self.metas[0].persist_download_datetime(now)
+                other_writer.update({"page_id": "0", "preprocessed_html_sha256": "abc"})
+            other_writer.update({"page_id": "0", "etag": '"v1"'})
+            self.metas[0].persist_download_datetime(now)
+        meta = self.store.get("0")
+        self.assertEqual(now, meta["download_datetime"])
+        self.assertEqual("abc", meta["preprocessed_html_sha256"])
+        self.assertEqual('"v1"', meta["etag"])
+        self.assertEqual(meta, other_writer.get("0"))
+
+    def test_take(self):
+        now = datetime.datetime.now()
+        with files_management.MetasBatch(store=self.store) as batch:
+            self.metas[0]._download_datetime = now
+            batch.add(self.metas[0].to_dict())
+            batch.add(self.metas[0].to_dict())
+            taken = batch.take()
+        self.assertEqual(len(taken), 1)
+        self.assertEqual(self._download_datetimes(), [None] * 5)
+
+
+class TestParsedTreesCache(TestCase):
+    def setUp(self):
+        self.n_parses = 0
+
+    def _parse(self):
+        self.n_parses += 1
+        return lxml.html.fromstring("<html><body><table><tr><td>1</td></tr></table></body></html>")
+
+    def test_get_hands_out_copies(self):
+        cache = files_management.ParsedTreesCache(max_bytes=10 ** 6)
+        first = cache.get("key", self._parse, 100)
+        second = cache.get("key", self._parse, 100)
+        self.assertEqual(self.n_parses, 1)
+        self.assertIsNot(first, second)
+        self.assertEqual(lxml.html.tostring(first), lxml.html.tostring(second))
+
+        first.body.clear()
+        third = cache.get("key", self._parse, 100)
+        self.assertEqual(lxml.html.tostring(third), lxml.html.tostring(second))
+
+    def test_eviction(self):
+        per_file = files_management.ParsedTreesCache.MEMORY_PER_FILE_BYTE
+        cache = files_management.ParsedTreesCache(max_bytes=2 * 100 * per_file)
+        cache.get("a", self._parse, 100)
+        cache.get("b", self._parse, 100)
+        cache.get("a", self._parse, 100)  # "b" becomes the least recently used
+        cache.get("c", self._parse, 100)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.n_bytes, 2 * 100 * per_file)
+        self.assertEqual(self.n_parses, 3)
+
+        cache.get("a", self._parse, 100)
+        self.assertEqual(self.n_parses, 3)
+        cache.get("b", self._parse, 100)
+        self.assertEqual(self.n_parses, 4)
+
+    def test_too_big_to_cache(self):
+        cache = files_management.ParsedTreesCache(max_bytes=10)
+        cache.get("a", self._parse, 100)
+        cache.get("a", self._parse, 100)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(self.n_parses, 2)
@@ -0,0 +1,53 @@
+import pathlib
+import tempfile
+from unittest import TestCase
+
+import files_management
+import html_store
+
+
+HTML = "<html><body><table><tr><td>é</td></tr></table></body></html>".encode("utf-8") * 50
+
+
+class TestHtmlStore(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.root_dir = pathlib.Path(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_put_and_get(self):
+        for codec in html_store.CODECS:
+            store = html_store.HtmlStore(self.root_dir.joinpath(codec), codec=codec)
+            sha256 = store.put(HTML)
+            self.assertEqual(sha256, html_store.digest(HTML))
+            self.assertIn(sha256, store)
+            self.assertEqual(store.get(sha256), HTML)
+            self.assertLess(store.compressed_size(sha256), len(HTML))
+
+    def test_content_addressed(self):
+        store = html_store.HtmlStore(self.root_dir)
+        self.assertEqual(store.put(HTML), store.put(HTML))
+        store.put(HTML + b"<!-- other -->")
+        self.assertEqual(store.stats()["n_blobs"], 2)
+        self.assertNotIn(html_store.digest(b"missing"), store)
+        self.assertRaises(KeyError, store.open, html_store.digest(b"missing"))
+
+    def test_read_other_codec(self):
+        sha256 = html_store.HtmlStore(self.root_dir, codec="lzma").put(HTML)
+        store = html_store.HtmlStore(self.root_dir, codec="gzip")
+        self.assertEqual(store.get(sha256), HTML)
+        self.assertEqual(store.put(HTML), sha256)
+        self.assertEqual(store.stats()["n_blobs"], 1)
+
+    def test_parse_from_store(self):
+        store = html_store.HtmlStore(self.root_dir)
+        sha256 = store.put(HTML)
+        with store.open(sha256) as file:
+            doc = files_management.parse_html(file)
+        self.assertEqual(len(doc.xpath("//td")), 50)
+        self.assertEqual(doc.xpath("//td")[0].text, "é")
+
+    def test_unknown_codec(self):
+        self.assertRaises(AssertionError, html_store.HtmlStore, self.root_dir, "rar")
@@ -0,0 +1,174 @@
+import datetime
+import pathlib
+import sqlite3
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+import yaml
+
+import metadata_store
+
+
+class TestMetadataStore(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.tmp_dir = pathlib.Path(self._tmp_dir.name)
+        self.store = metadata_store.MetadataStore(self.tmp_dir.joinpath("pages-meta.sqlite"))
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    @staticmethod
+    def _meta(page_id: str, url: str, n_data_records=None, download_datetime=None) -> dict:
+        return {
+            "page_id": page_id,
+            "url": url,
+            "date_time": datetime.datetime(2020, 3, 24, 0, 46, 17, 124207),
+            "n_data_records": n_data_records,
+            "download_datetime": download_datetime,
+            "raw_html_sha256": None,
+            "preprocessed_html_sha256": None,
+            "etag": None,
+            "last_modified": None,
+        }
+
+    def test_insert_and_get(self):
+        meta = self._meta("0d6-30e-a27", "https://a.com", 24)
+        self.store.insert(meta)
+
+        self.assertTrue(self.store.contains("0d6-30e-a27"))
+        self.assertFalse(self.store.contains("000-000-000"))
+        self.assertEqual(self.store.count(), 1)
+        self.assertEqual(self.store.get("0d6-30e-a27"), meta)
+        self.assertEqual(self.store.get_by_url("https://a.com"), meta)
+        self.assertIsNone(self.store.get("000-000-000"))
+        self.assertIsNone(self.store.get_by_url("https://b.com"))
+        self.assertEqual(self.store.get_all(), {"0d6-30e-a27": meta})
+
+    def test_insert_twice(self):
+        self.store.insert(self._meta("0d6-30e-a27", "https://a.com"))
+        self.assertRaises(
+            sqlite3.IntegrityError, self.store.insert, self._meta("0d6-30e-a27", "https://a.com")
+        )
+
+    def test_update(self):
+        self.store.insert(self._meta("0d6-30e-a27", "https://a.com"))
+        self.store.insert(self._meta("175-a19-e24", "https://b.com"))
+        now = datetime.datetime.now()
+        updated = self._meta("0d6-30e-a27", "https://a.com", 3, now)
+        self.store.update(updated)
+
+        self.assertEqual(self.store.get("0d6-30e-a27"), updated)
+        self.assertIsNone(self.store.get("175-a19-e24")["download_datetime"])
+        self.assertRaises(
+            AssertionError, self.store.update, self._meta("000-000-000", "https://c.com")
+        )
+
+    def test_import_and_export_yaml(self):
+        metas = {
+            "0d6-30e-a27": self._meta("0d6-30e-a27", "https://a.com", 24),
+            "175-a19-e24": self._meta(
+                "175-a19-e24", "https://b.com", 21, datetime.datetime(2020, 4, 3, 21, 26, 9, 958933)
+            ),
+        }
+        yaml_path = self.tmp_dir.joinpath("pages-meta.yml")
+        with yaml_path.open("w") as f:
+            yaml.dump(metas, f, Dumper=yaml.SafeDumper)
+
+        self.assertEqual(self.store.import_yaml(yaml_path), 2)
+        self.assertEqual(self.store.import_yaml(yaml_path), 0)
+        self.assertEqual(self.store.get_all(), metas)
+
+        exported_path = self.tmp_dir.joinpath("exported.yml")
+        self.store.export_yaml(exported_path)
+        with exported_path.open("r") as f:
+            self.assertEqual(yaml.load(f, Loader=yaml.FullLoader), metas)
+
+    def test_cache_sees_other_connections_changes(self):
+        other_store = metadata_store.MetadataStore(self.store.db_path)
+        self.store.insert(self._meta("0d6-30e-a27", "https://a.com"))
+        self.assertEqual(self.store.count(), 1)
+        self.assertEqual(other_store.count(), 1)
+
+        other_store.insert(self._meta("175-a19-e24", "https://b.com"))
+        self.assertTrue(self.store.contains("175-a19-e24"))
+        self.assertEqual(self.store.get_by_url("https://b.com")["page_id"], "175-a19-e24")
+
+        now = datetime.datetime.now()
+        other_store.update(self._meta("0d6-30e-a27", "https://a.com", 7, now))
+        self.assertEqual(self.store.get("0d6-30e-a27")["download_datetime"], now)
+        self.assertEqual(self.store.get("0d6-30e-a27")["n_data_records"], 7)
+
+    def test_cache_hits_take_no_lock(self):
+        self.store.insert(self._meta("0d6-30e-a27", "https://a.com"))
+        self.store.count()
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with self.store._lock:
+                locked.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold_lock, daemon=True)
+        holder.start()
+        locked.wait()
+        try:
+            reads = []
+            reader = threading.Thread(
+                target=lambda: reads.append(self.store.get("0d6-30e-a27")), daemon=True
+            )
+            reader.start()
+            reader.join(timeout=5)
+            self.assertFalse(reader.is_alive())
+            self.assertEqual(["https://a.com"], [meta["url"] for meta in reads])
+        finally:
+            release.set()
+            holder.join()
+
+    def test_own_writes_update_the_cache(self):
+        self.store.insert(self._meta("0d6-30e-a27", "https://a.com"))
+        self.store.count()
+        with mock.patch.object(self.store, "_select", wraps=self.store._select) as select:
+            self.store.insert(self._meta("175-a19-e24", "https://b.com"))
+            self.store.update({"page_id": "0d6-30e-a27", "n_data_records": 3})
+            self.assertEqual(3, self.store.get_by_url("https://a.com")["n_data_records"])
+            self.assertEqual(2, self.store.count())
+            self.assertEqual(0, select.call_count)
+
+            # another writer in between
+            metadata_store.MetadataStore(self.store.db_path).update(
+                {"page_id": "175-a19-e24", "n_data_records": 5}
+            )
+            self.store.update({"page_id": "0d6-30e-a27", "n_data_records": 4})
+            self.assertEqual(5, self.store.get("175-a19-e24")["n_data_records"])
+            self.assertEqual(4, self.store.get("0d6-30e-a27")["n_data_records"])
+            self.assertEqual(1, select.call_count)
+
+    def test_cache_returns_copies(self):
+        self.store.insert(self._meta("0d6-30e-a27", "https://a.com"))
+        self.store.get("0d6-30e-a27")["url"] = "changed"
+        self.store.get_all()["0d6-30e-a27"]["url"] = "changed"
+        self.assertEqual(self.store.get("0d6-30e-a27")["url"], "https://a.com")
+
+    def test_add_missing_columns(self):
+        db_path = self.tmp_dir.joinpath("old.sqlite")
+        connection = sqlite3.connect(str(db_path))
+        connection.execute(
+            "CREATE TABLE pages_meta (page_id TEXT PRIMARY KEY, url TEXT NOT NULL UNIQUE, "
+            "date_time TEXT NOT NULL, n_data_records INTEGER, download_datetime TEXT)"
+        )
+        connection.execute(
+            "INSERT INTO pages_meta VALUES ('0d6-30e-a27', 'https://a.com', "
+            "'2020-03-24 00:46:17.124207', 24, NULL)"
+        )
+        connection.commit()
+        connection.close()
+
+        store = metadata_store.MetadataStore(db_path)
+        self.assertEqual(store.get("0d6-30e-a27"), self._meta("0d6-30e-a27", "https://a.com", 24))
+        updated = self._meta("0d6-30e-a27", "https://a.com", 24)
+        updated["raw_html_sha256"] = "ab" * 32
+        updated["etag"] = '"5e7a"'
+        store.update(updated)
+        self.assertEqual(store.get("0d6-30e-a27"), updated)
@@ -0,0 +1,66 @@
+import pathlib
+import sqlite3
+import tempfile
+from unittest import TestCase
+
+import page_bundle
+
+
+class TestPageBundle(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.bundle = page_bundle.PageBundle(
+            pathlib.Path(self._tmp_dir.name).joinpath("bundle.sqlite")
+        )
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_missing_bundle(self):
+        self.assertFalse(self.bundle.contains("data_regions", {}))
+        self.assertIsNone(self.bundle.get("data_regions", {}))
+        self.assertEqual(self.bundle.list(), [])
+        self.assertFalse(self.bundle.exists())
+
+    def test_put_and_get(self):
+        params = {"threshold": 0.3, "max_tags_per_gnode": 10}
+        self.bundle.put("data_regions", params, b"regions")
+        self.bundle.put("data_records", params, b"records", n_records=4)
+
+        self.assertTrue(self.bundle.contains("data_regions", params))
+        self.assertEqual(self.bundle.get("data_regions", params), b"regions")
+        self.assertEqual(self.bundle.get("data_records", params), b"records")
+        self.assertIsNone(
+            self.bundle.get("data_regions", {"threshold": 0.4, "max_tags_per_gnode": 10})
+        )
+
+        # same key whatever the order of the parameters and the float rounding
+        other_params = {"max_tags_per_gnode": 10, "threshold": 0.1 + 0.2}
+        self.assertEqual(self.bundle.get("data_regions", other_params), b"regions")
+
+        self.bundle.put("data_regions", params, b"other regions")
+        self.assertEqual(self.bundle.get("data_regions", params), b"other regions")
+
+    def test_list_and_delete(self):
+        for th in (0.3, 0.2):
+            self.bundle.put("data_records", {"threshold": th}, b"records", n_records=3)
+        self.bundle.put("node_names", {}, b"{}")
+
+        artifacts = self.bundle.list()
+        self.assertEqual([a.kind for a in artifacts], ["data_records", "data_records", "node_names"])
+        self.assertEqual(artifacts[0].params, {"threshold": 0.2})
+        self.assertEqual(artifacts[0].n_bytes, len(b"records"))
+        self.assertEqual(artifacts[0].n_records, 3)
+        self.assertIsNone(artifacts[2].n_records)
+        self.assertEqual(len(self.bundle.list("node_names")), 1)
+
+        self.assertTrue(self.bundle.delete("data_records", {"threshold": 0.3}))
+        self.assertFalse(self.bundle.delete("data_records", {"threshold": 0.3}))
+        self.assertEqual(len(self.bundle.list("data_records")), 1)
+
+    def test_failed_put_leaves_bundle_unchanged(self):
+        self.bundle.put("data_regions", {}, b"regions")
+        self.assertRaises(sqlite3.IntegrityError, self.bundle.put, None, {}, b"no kind")
+        self.assertEqual(len(self.bundle.list()), 1)
+        self.bundle.put("data_records", {}, b"records")
+        self.assertEqual(len(self.bundle.list()), 2)
@@ -0,0 +1,140 @@
+import datetime
+import pathlib
+from unittest import TestCase, mock
+
+import core
+import files_management
+import pipeline
+import prepostprocessing
+from test import helpers
+
+RESOURCES_DIRECTORY = "./rsrc"
+
+
+class TestPipeline(TestCase):
+    def setUp(self):
+        helpers.patch_outputs(self)
+
+        self.page_meta = files_management.PageMeta.register("https://a.com/table-0", 3)
+        self.raw_html = pathlib.Path(RESOURCES_DIRECTORY).joinpath("table-0.html").read_bytes()
+        self.page_meta.persist_raw_html(self.raw_html)
+
+        self.thresholds = core.MDREditDistanceThresholds.all_equal(0.3)
+        self.stages = [
+            (pipeline.CLEANUP, {}),
+            (pipeline.DISTANCES, {}),
+            (pipeline.DATA_REGIONS, pipeline.data_regions_params(0.3, 10)),
+            (pipeline.DATA_RECORDS, pipeline.data_records_params(self.thresholds, 10)),
+        ]
+
+    def _run_all(self):
+        prepostprocessing.cleanup_html(self.page_meta)
+        prepostprocessing.precompute_distances(self.page_meta, 0, 10)
+        prepostprocessing.precompute_data_regions(self.page_meta, 0.3, 3, 10)
+        prepostprocessing.precompute_data_records(self.page_meta, self.thresholds, 10)
+
+    def _statuses(self):
+        return [step.status for step in pipeline.plan([self.page_meta], self.stages)]
+
+    def test_plan_from_scratch(self):
+        self.assertEqual(
+            self._statuses(),
+            [pipeline.MISSING] + [pipeline.UPSTREAM_WILL_RUN] * 3,
+        )
+
+    def test_up_to_date_after_run(self):
+        self._run_all()
+        self.assertEqual(self._statuses(), [pipeline.UP_TO_DATE] * 4)
+
+    def test_code_version_makes_downstream_stale(self):
+        self._run_all()
+        with mock.patch.dict(pipeline.STAGES_VERSIONS, {pipeline.DISTANCES: 2}):
+            self.assertEqual(
+                self._statuses(),
+                [pipeline.UP_TO_DATE, pipeline.STALE]
+                + [pipeline.UPSTREAM_WILL_RUN, pipeline.UPSTREAM_WILL_RUN],
+            )
+            self.assertEqual(
+                [pipeline.status(self.page_meta, *stage) for stage in self.stages[2:]],
+                [pipeline.STALE_UPSTREAM] * 2,
+            )
+            self._run_all()
+            self.assertEqual(self._statuses(), [pipeline.UP_TO_DATE] * 4)
+
+    def test_raw_change_without_preprocessed_change(self):
+        self._run_all()
+        # the comments are removed by the cleanup
+        self.page_meta.persist_raw_html(self.raw_html + b"<!-- a comment -->")
+        self.assertEqual(
+            self._statuses(),
+            [pipeline.STALE] + [pipeline.UPSTREAM_WILL_RUN] * 3,
+        )
+
+        prepostprocessing.cleanup_html(self.page_meta)
+        self.assertEqual(self._statuses(), [pipeline.UP_TO_DATE] * 4)
+
+    def test_upstream_change_with_only_downstream_recomputed(self):
+        self._run_all()
+        self.page_meta.persist_raw_html(self.raw_html.replace(b"</table>", b"</table><p>new</p>"))
+        self.assertEqual(
+            [pipeline.status(self.page_meta, *stage) for stage in self.stages],
+            [pipeline.STALE] + [pipeline.STALE_UPSTREAM] * 3,
+        )
+        # the downstream stages refuse to run before the cleanup
+        with self.assertRaises(AssertionError):
+            prepostprocessing.precompute_distances(self.page_meta, 0, 10, force_override=True)
+        with self.assertRaises(AssertionError):
+            pipeline.record(self.page_meta, pipeline.DISTANCES, {})
+
+        prepostprocessing.cleanup_html(self.page_meta)
+        prepostprocessing.precompute_distances(self.page_meta, 0, 10)
+        # computed from the previous distances
+        self.assertEqual(
+            [pipeline.status(self.page_meta, *stage) for stage in self.stages],
+            [pipeline.UP_TO_DATE, pipeline.UP_TO_DATE, pipeline.STALE, pipeline.STALE_UPSTREAM],
+        )
+        self._run_all()
+        self.assertEqual(self._statuses(), [pipeline.UP_TO_DATE] * 4)
+
+    def test_preprocessing_profile_makes_cleanup_stale(self):
+        self._run_all()
+        with mock.patch.object(
+            files_management, "preprocessing_profile", files_management.PREPROCESSING_PROFILE_PRUNED
+        ):
+            self.assertEqual(
+                self._statuses(), [pipeline.STALE] + [pipeline.UPSTREAM_WILL_RUN] * 3,
+            )
+            self._run_all()
+            self.assertEqual(self._statuses(), [pipeline.UP_TO_DATE] * 4)
+            # the names are replayed on the pruned html
+            prepostprocessing.get_named_nodes_html(self.page_meta)
+        self.assertEqual(self._statuses()[0], pipeline.STALE)
+
+    def test_unstamped_results_are_adopted(self):
+        self._run_all()
+        self.page_meta.bundle.db_path.unlink()
+        self.assertEqual(
+            pipeline.status(self.page_meta, pipeline.DISTANCES, {}), pipeline.UNSTAMPED
+        )
+        self.assertEqual(
+            pipeline.check(self.page_meta, pipeline.DISTANCES, {}), pipeline.UP_TO_DATE
+        )
+        self.assertEqual(
+            pipeline.status(self.page_meta, pipeline.DISTANCES, {}), pipeline.UP_TO_DATE
+        )
+
+    def test_output_sha256(self):
+        self.assertEqual(
+            [None] * 4,
+            [pipeline.output_sha256(self.page_meta, *stage) for stage in self.stages],
+        )
+        self._run_all()
+        hashes = [pipeline.output_sha256(self.page_meta, *stage) for stage in self.stages]
+        self.assertTrue(all(hashes))
+        self.assertEqual(len(set(hashes)), 4)
+        self.assertEqual(hashes[0], self.page_meta.preprocessed_html_sha256)
+        # the same results give the same hashes
+        prepostprocessing.precompute_data_regions(self.page_meta, 0.3, 3, 10, force_override=True)
+        self.assertEqual(
+            hashes, [pipeline.output_sha256(self.page_meta, *stage) for stage in self.stages]
+        )
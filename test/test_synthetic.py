@@ -0,0 +1,101 @@
+import copy
+import json
+import pathlib
+import tempfile
+from unittest import TestCase
+
+import lxml
+import lxml.html
+
+import benchmark
+import core
+import synthetic
+
+
+class TestSynthetic(TestCase):
+    def test_seed(self):
+        params = synthetic.DEFAULT_PARAMS._replace(noise_rate=0.5, nesting=2, kind=synthetic.MIXED)
+        html = synthetic.to_html(synthetic.generate_page(params))
+        self.assertEqual(html, synthetic.to_html(synthetic.generate_page(params)))
+        self.assertNotEqual(
+            html, synthetic.to_html(synthetic.generate_page(params._replace(seed=1)))
+        )
+
+    def test_shape(self):
+        params = synthetic.DEFAULT_PARAMS._replace(
+            depth=4, fanout=12, record_period=3, n_regions=2, text_length=5, kind=synthetic.MIXED
+        )
+        page = synthetic.generate_page(params)
+        self.assertEqual(8, page.n_data_records)
+
+        root = lxml.html.fromstring(synthetic.to_html(page))
+        tables, lists = root.findall(".//table"), root.findall(".//ul")
+        self.assertEqual((1, 1), (len(tables), len(lists)))
+        for region in tables + lists:
+            self.assertEqual(12, len(region))
+            # html > body > div * depth > div > region
+            self.assertEqual(4 + 3, core.depth(region))
+            # the tags of a record differ, the records are alike
+            self.assertEqual([1, 2, 3] * 4, [len(item) for item in region])
+        self.assertEqual(5, len(tables[0][0][0].text))
+
+        noisy = synthetic.generate_page(params._replace(noise_rate=1.0))
+        self.assertNotEqual([1, 2, 3] * 4, [len(item) for item in noisy.root.find(".//table")])
+
+        nested = synthetic.generate_page(params._replace(nesting=2, kind=synthetic.TABLE))
+        first_cell = nested.root.find(".//table")[0][0]
+        self.assertEqual("ul", first_cell[0].tag)
+        self.assertEqual("table", first_cell[0][0][0][0].tag)
+        # 4 records of 3 + 9 nested records in each region
+        self.assertEqual(2 * (4 + 4 * 12), nested.n_data_records)
+
+    def test_mdr_finds_the_label(self):
+        for params in (
+            synthetic.DEFAULT_PARAMS,
+            synthetic.DEFAULT_PARAMS._replace(n_regions=2, nesting=2, kind=synthetic.MIXED),
+        ):
+            page = synthetic.generate_page(params)
+            thresholds = core.MDREditDistanceThresholds.all_equal(synthetic.MDR_THRESHOLD)
+            _, n_records = benchmark.run_mdr(
+                page.root, benchmark.MINIMUM_DEPTH, benchmark.MAX_TAG_PER_GNODE, thresholds
+            )
+            self.assertEqual(page.n_data_records, n_records, synthetic.page_name(params))
+
+    def test_precomputed_distances_equivalence(self):
+        """ Distances completed from smaller gnodes are the ones computed at once, on a large page. """
+        page = synthetic.generate_page(
+            synthetic.DEFAULT_PARAMS._replace(fanout=40, record_period=4, noise_rate=0.2, nesting=1)
+        )
+
+        def distances(max_tag_per_gnode, precomputed):
+            root = copy.deepcopy(page.root)
+            node_namer = core.NodeNamer()
+            node_namer.load(root)
+            distances_ = {}
+            core.compute_distances(root, distances_, precomputed, node_namer, 3, max_tag_per_gnode)
+            return distances_
+
+        precomputed = distances(2, {})
+        precomputed[core.DICT_PARAM_TAG_PER_GNODE] = 2
+        expected = distances(6, {})
+        self.assertEqual(6, max(expected["table-00000"]))
+        self.assertEqual(expected, distances(6, precomputed))
+
+    def test_write_corpus(self):
+        """ The pages whose label MDR isn't expected to find are written without it. """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            corpus_dir = pathlib.Path(tmp_dir).joinpath("corpus")
+            labeled = [synthetic.DEFAULT_PARAMS._replace(fanout=fanout) for fanout in (4, 8)]
+            unlabeled = [
+                synthetic.DEFAULT_PARAMS._replace(record_period=2),
+                synthetic.DEFAULT_PARAMS._replace(noise_rate=0.5),
+            ]
+            synthetic.write_corpus(corpus_dir, labeled + unlabeled)
+            labels = json.loads(corpus_dir.joinpath("labels.json").read_text())
+            self.assertEqual(
+                {synthetic.page_name(params) + ".html": params.fanout for params in labeled},
+                labels,
+            )
+            pages = benchmark.load_corpus([corpus_dir])
+            self.assertEqual([4, 8], sorted(page.label for page in pages if page.label))
+            self.assertEqual(2, sum(page.label is None for page in pages))